@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request timings cover every other middleware
+    'loans.middleware.MetricsMiddleware',
+    'loans.middleware.NPlusOneDetectorMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -157,5 +160,69 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Cache: Redis when REDIS_URL is set (Docker), in-process memory otherwise (local runs, tests)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Credit scores are fresh for CREDIT_SCORE_CACHE_TTL seconds, then served stale for up to
+# CREDIT_SCORE_CACHE_STALE_TTL more seconds while a background task recomputes them
+CREDIT_SCORE_CACHE_TTL = int(os.environ.get('CREDIT_SCORE_CACHE_TTL', '300'))
+CREDIT_SCORE_CACHE_STALE_TTL = int(os.environ.get('CREDIT_SCORE_CACHE_STALE_TTL', '3600'))
+
+# Seconds a serialized view-loan body stays cached, it is dropped earlier when the loan changes
+LOAN_DETAIL_CACHE_TTL = int(os.environ.get('LOAN_DETAIL_CACHE_TTL', '3600'))
+
 # Data files path
 DATA_DIR = BASE_DIR / 'data'
+
+# Number of spreadsheet rows upserted per statement by the ingestion tasks
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '1000'))
+
+# Loan rows per shard when ingest_all_data fans loan ingestion out across workers
+INGEST_SHARD_SIZE = int(os.environ.get('INGEST_SHARD_SIZE', '50000'))
+
+# Customers scored per vectorized pass by the rescore_customers task
+RESCORE_CHUNK_SIZE = int(os.environ.get('RESCORE_CHUNK_SIZE', '10000'))
+
+# Most checks accepted by one /check-eligibility/batch/ request
+ELIGIBILITY_BATCH_MAX_SIZE = int(os.environ.get('ELIGIBILITY_BATCH_MAX_SIZE', '10000'))
+
+# Most applications accepted by one /create-loan/batch/ request
+LOAN_BATCH_MAX_SIZE = int(os.environ.get('LOAN_BATCH_MAX_SIZE', '10000'))
+
+# Attempts create_loan makes when parallel requests for the same customer keep winning the race
+LOAN_CREATE_MAX_ATTEMPTS = int(os.environ.get('LOAN_CREATE_MAX_ATTEMPTS', '5'))
+
+# When set, /create-loan/ records a PENDING LoanApplication and answers 202 while a Celery task
+# decides it; clients poll /application/<id>/. Requests sending "Prefer: respond-async" get this
+# mode either way
+LOAN_APPLICATIONS_ASYNC = os.environ.get('LOAN_APPLICATIONS_ASYNC', '0') == '1'
+
+# Decision audit records are buffered in process and bulk-inserted once DECISION_LOG_BATCH_SIZE are
+# pending or the oldest is DECISION_LOG_FLUSH_INTERVAL seconds old, checked as requests and tasks finish
+# (an idle process flushes on its next one); past DECISION_LOG_MAX_BUFFER pending records new ones are
+# dropped and counted
+DECISION_LOG_BATCH_SIZE = int(os.environ.get('DECISION_LOG_BATCH_SIZE', '500'))
+DECISION_LOG_FLUSH_INTERVAL = float(os.environ.get('DECISION_LOG_FLUSH_INTERVAL', '5'))
+DECISION_LOG_MAX_BUFFER = int(os.environ.get('DECISION_LOG_MAX_BUFFER', '50000'))
+
+# Seconds between snapshots of a process's request and task metrics in the cache, which /metrics
+# adds up; a snapshot expires METRICS_PROCESS_TTL seconds after its process last published.
+# Only a shared cache (Redis) sums across processes, LocMemCache reports the scraped process alone
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', '10'))
+METRICS_PROCESS_TTL = int(os.environ.get('METRICS_PROCESS_TTL', '300'))
+
+# Log statements a single request runs N_PLUS_ONE_THRESHOLD or more times, for staging
+N_PLUS_ONE_DETECTOR = os.environ.get('N_PLUS_ONE_DETECTOR', '0') == '1'
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '5'))
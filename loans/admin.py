@@ -1,10 +1,11 @@
 from django.contrib import admin
-from .models import Customer, Loan, LoanApplication
+from .models import Customer, DecisionLog, Loan, LoanApplication
+from .profiles import refresh_profiles
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['customer_id', 'first_name', 'last_name', 'phone_number', 'monthly_salary', 'approved_limit', 'current_debt']
+    list_display = ['customer_id', 'first_name', 'last_name', 'phone_number', 'monthly_salary', 'approved_limit', 'current_debt', 'active_emi_total']
     list_filter = ['created_at']
     search_fields = ['first_name', 'last_name', 'phone_number']
     readonly_fields = ['customer_id', 'created_at']
@@ -14,13 +15,45 @@ class CustomerAdmin(admin.ModelAdmin):
 class LoanAdmin(admin.ModelAdmin):
     list_display = ['loan_id', 'customer', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment', 'start_date', 'end_date']
     list_filter = ['start_date', 'end_date', 'interest_rate']
+    list_select_related = ['customer']
     search_fields = ['customer__first_name', 'customer__last_name', 'loan_id']
     readonly_fields = ['loan_id', 'created_at']
+    # A select would list every customer on the change form
+    raw_id_fields = ['customer']
+    
+    def save_model(self, request, obj, form, change):
+        previous_owner = form.initial.get('customer') if change else None
+        super().save_model(request, obj, form, change)
+        refresh_profiles({obj.customer_id, previous_owner} - {None})
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_profiles([obj.customer_id])
+    
+    def delete_queryset(self, request, queryset):
+        customer_ids = set(queryset.values_list('customer_id', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_profiles(customer_ids)
 
 
 @admin.register(LoanApplication)
 class LoanApplicationAdmin(admin.ModelAdmin):
     list_display = ['id', 'customer', 'loan_amount', 'interest_rate', 'tenure', 'status', 'created_at']
     list_filter = ['status', 'created_at']
+    list_select_related = ['customer']
     search_fields = ['customer__first_name', 'customer__last_name']
     readonly_fields = ['created_at']
+    raw_id_fields = ['customer', 'approved_loan']
+
+
+@admin.register(DecisionLog)
+class DecisionLogAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'customer_id', 'loan_amount', 'interest_rate', 'credit_score', 'approval', 'loan_id', 'decided_at']
+    list_filter = ['kind', 'approval']
+    search_fields = ['customer_id', 'loan_id']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
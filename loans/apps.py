@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LoansConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loans'
+    
+    def ready(self):
+        # Connect the model and Celery signal receivers, in web and worker processes alike
+        from . import metrics, signals
+        metrics.warn_if_process_local()
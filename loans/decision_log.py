@@ -0,0 +1,159 @@
+"""
+Write-behind audit log of eligibility and loan decisions.
+
+Views and tasks only append a DecisionLog row to an in-process buffer;
+nothing is written while the request is being answered. The buffer is
+flushed with one ``bulk_create`` once it holds ``DECISION_LOG_BATCH_SIZE``
+records or its oldest record is ``DECISION_LOG_FLUSH_INTERVAL`` seconds old,
+checked when a request or Celery task finishes, and unconditionally when the
+process (or a Celery pool process) exits. There is no timer thread, so an
+idle process holds its records past the interval until its next request or
+task, or its exit. Past ``DECISION_LOG_MAX_BUFFER`` pending records new
+ones are dropped and counted rather than growing memory without bound;
+``stats()`` reports the buffer depth and the drop count.
+"""
+import atexit
+from decimal import Decimal
+import logging
+import threading
+import time
+
+from celery.signals import task_postrun, worker_process_shutdown
+from django.conf import settings
+from django.core.signals import request_finished
+from django.utils import timezone
+
+from .models import DecisionLog
+
+logger = logging.getLogger(__name__)
+
+
+def _settings():
+    return (
+        getattr(settings, 'DECISION_LOG_BATCH_SIZE', 500),
+        getattr(settings, 'DECISION_LOG_FLUSH_INTERVAL', 5),
+        getattr(settings, 'DECISION_LOG_MAX_BUFFER', 50000),
+    )
+
+
+class DecisionBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = []
+        self._oldest = None
+        self.dropped = 0
+        self.flushed = 0
+
+    def add(self, record):
+        max_buffer = _settings()[2]
+        with self._lock:
+            if len(self._records) >= max_buffer:
+                self.dropped += 1
+                return False
+            if not self._records:
+                self._oldest = time.monotonic()
+            self._records.append(record)
+            return True
+
+    def depth(self):
+        return len(self._records)
+
+    def is_due(self):
+        batch_size, interval, _ = _settings()
+        with self._lock:
+            if not self._records:
+                return False
+            return len(self._records) >= batch_size or time.monotonic() - self._oldest >= interval
+
+    def take(self):
+        with self._lock:
+            records, self._records, self._oldest = self._records, [], None
+            return records
+
+    def put_back(self, records):
+        """Return records of a failed flush to the front, dropping what no longer fits"""
+        max_buffer = _settings()[2]
+        with self._lock:
+            room = max(0, max_buffer - len(self._records))
+            kept = records[:room]
+            self.dropped += len(records) - len(kept)
+            self._records[:0] = kept
+            if self._records:
+                self._oldest = self._oldest or time.monotonic()
+
+    def count_flushed(self, count):
+        with self._lock:
+            self.flushed += count
+
+    def clear(self):
+        self.take()
+        self.dropped = 0
+        self.flushed = 0
+
+
+buffer = DecisionBuffer()
+
+
+def record(kind, customer_id, loan_amount, interest_rate, tenure, decision, loan=None):
+    """Buffer the audit record of one decision, returns False if it was dropped"""
+    monthly_installment = decision.monthly_installment
+    if monthly_installment is not None:
+        monthly_installment = Decimal(str(monthly_installment))
+    added = buffer.add(DecisionLog(
+        kind=kind,
+        customer_id=customer_id,
+        loan_amount=loan_amount,
+        interest_rate=interest_rate,
+        tenure=tenure,
+        credit_score=decision.credit_score,
+        approval=decision.approval,
+        corrected_interest_rate=decision.corrected_interest_rate,
+        monthly_installment=monthly_installment,
+        message=decision.message,
+        loan_id=loan.loan_id if loan is not None else None,
+        decided_at=timezone.now(),
+    ))
+    if not added:
+        logger.warning(f"Decision log buffer full, dropped {kind} decision for customer {customer_id}")
+    return added
+
+
+def flush():
+    """Write every buffered record, returns how many were written"""
+    records = buffer.take()
+    if not records:
+        return 0
+    batch_size = _settings()[0]
+    try:
+        DecisionLog.objects.bulk_create(records, batch_size=batch_size)
+    except Exception as e:
+        logger.error(f"Could not write {len(records)} decision log records: {str(e)}")
+        buffer.put_back(records)
+        return 0
+    buffer.count_flushed(len(records))
+    return len(records)
+
+
+def flush_if_due(**kwargs):
+    """Flush when the buffer is full enough or old enough, usable as a signal receiver"""
+    if buffer.is_due():
+        flush()
+
+
+def stats():
+    """Pending records, records dropped because the buffer was full, and records written"""
+    return {'depth': buffer.depth(), 'dropped': buffer.dropped, 'flushed': buffer.flushed}
+
+
+def _flush_at_exit(**kwargs):
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f"Decision log records lost at shutdown: {str(e)}")
+
+
+request_finished.connect(flush_if_due, dispatch_uid='decision_log_flush')
+task_postrun.connect(flush_if_due, dispatch_uid='decision_log_flush')
+# Prefork pool children leave with os._exit, which skips atexit
+worker_process_shutdown.connect(_flush_at_exit, dispatch_uid='decision_log_flush')
+atexit.register(_flush_at_exit)
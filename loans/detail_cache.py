@@ -0,0 +1,53 @@
+"""
+Conditional GET and cached bodies for the view-loan endpoint.
+
+A loan detail response depends on the loan row and on its customer's row,
+so its validator is built from both ``updated_at`` stamps, read with one
+indexed lookup. Clients that already hold that version get a 304; everyone
+else gets the serialized bytes from the cache when they were stored for the
+same version. Saving or deleting a loan drops its cached body right away,
+and writes that bypass signals (bulk loads, ``update()``) still move the
+stamps, which makes the stored body unusable.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date
+
+from .models import Loan
+
+
+def _key(loan_id):
+    return f"loan_detail:{loan_id}"
+
+
+def loan_validators(loan_id):
+    """Return (etag, last_modified timestamp) for a loan, or None if it does not exist"""
+    stamps = Loan.objects.filter(loan_id=loan_id).values_list('updated_at', 'customer__updated_at').first()
+    if stamps is None:
+        return None
+    version = f"{loan_id}:{stamps[0].isoformat()}:{stamps[1].isoformat()}"
+    etag = '"' + hashlib.blake2b(version.encode('utf-8'), digest_size=12).hexdigest() + '"'
+    # Whole seconds, like the If-Modified-Since dates it is compared with
+    return etag, int(max(stamps).timestamp())
+
+
+def validator_headers(etag, last_modified):
+    return {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+
+
+def cached_body(loan_id, etag):
+    """Serialized response bytes stored for exactly this version, or None"""
+    entry = cache.get(_key(loan_id))
+    if entry is not None and entry[0] == etag:
+        return entry[1]
+    return None
+
+
+def store_body(loan_id, etag, content):
+    cache.set(_key(loan_id), (etag, content), timeout=getattr(settings, 'LOAN_DETAIL_CACHE_TTL', 3600))
+
+
+def invalidate(loan_id):
+    cache.delete(_key(loan_id))
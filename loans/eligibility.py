@@ -0,0 +1,402 @@
+"""
+Loan decision engine shared by ``check_eligibility`` and ``create_loan``.
+
+``load_customer`` fetches the customer together with their credit profile in
+one query, and ``decide`` works from that snapshot: the score inputs and the
+open EMI total come from the profile row (or one aggregate over the loans
+table when the customer has no profile yet), and the score itself from the
+score cache. A decision therefore costs at most two queries.
+
+``decide_many`` does the same for a batch of requests with set-based loads
+and NumPy passes, for the batch eligibility endpoint, and ``create_loans``
+decides and bulk-inserts a batch of applications. ``process_application``
+decides a queued ``LoanApplication`` for the asynchronous create-loan mode,
+and ``give_up_application`` rejects one that stayed busy past its retries.
+
+Writes are serialized per customer with an optimistic check on
+``Customer.loan_version``: ``apply_for_loan`` decides from a snapshot and
+only inserts if the version is still the one it read, bumping it in the same
+statement. A request that loses the race re-reads and decides again, so two
+parallel applications can never both pass the EMI check on the same state.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import logging
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import decision_log
+from .models import Customer, CustomerCreditProfile, DecisionLog, Loan, LoanApplication, compute_credit_score
+from .profiles import REFRESH_CHUNK_SIZE, compute_profiles, record_new_loan, refresh_profiles
+from .score_cache import cached_credit_score
+from .scoring import score_arrays, to_cents
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+# (minimum score, exclusive) -> lowest interest rate approved at that score
+RATE_FLOORS = [
+    (50, None),
+    (30, Decimal('12.0')),
+    (10, Decimal('16.0')),
+]
+MAX_EMI_SHARE = Decimal('0.5')
+# Applications per transaction in create_loans
+LOAN_BATCH_CHUNK_SIZE = 1000
+# Upper bound of the random pause before retrying a lost version race, grows per attempt
+RETRY_BACKOFF_SECONDS = 0.01
+
+RATE_TOO_LOW = "Interest rate too low for your credit score"
+SCORE_TOO_LOW = "Credit score too low for loan approval"
+EMI_TOO_HIGH = "Current EMIs exceed 50% of monthly salary"
+CUSTOMER_BUSY = "Too many concurrent applications for this customer, please apply again"
+BATCH_WRITE_FAILED = "Loan could not be written, nothing was created for this application"
+
+
+def calculate_monthly_installment(principal, annual_rate, tenure_months):
+    """Calculate monthly installment using compound interest"""
+    principal = float(principal)
+    monthly_rate = float(annual_rate) / 100 / 12
+    months = int(tenure_months)
+
+    if monthly_rate == 0:
+        return round(principal / months, 2)
+
+    # EMI = P * r * (1 + r)^n / ((1 + r)^n - 1)
+    emi = principal * monthly_rate * (1 + monthly_rate) ** months / ((1 + monthly_rate) ** months - 1)
+    return round(emi, 2)
+
+
+def load_customer(customer_id):
+    """Fetch a customer and their credit profile in one query"""
+    return Customer.objects.select_related('credit_profile').get(customer_id=customer_id)
+
+
+def loan_summary(customer):
+    """Score inputs plus open EMI total, from the profile when the customer has one"""
+    try:
+        return customer.credit_profile.loan_summary()
+    except CustomerCreditProfile.DoesNotExist:
+        return customer.loan_summary()
+
+
+class CustomerBusy(Exception):
+    """Every attempt to create a loan lost the race for the customer's loan_version"""
+
+
+class Decision:
+    def __init__(self, credit_score, approval, corrected_interest_rate, monthly_installment, message):
+        self.credit_score = credit_score
+        self.approval = approval
+        self.corrected_interest_rate = corrected_interest_rate
+        self.monthly_installment = monthly_installment
+        self.message = message
+
+
+def decide(customer, loan_amount, interest_rate, tenure):
+    """Approve or reject a loan for a customer loaded with ``load_customer``"""
+    summary = loan_summary(customer)
+    active_emi_total = summary.pop('active_emi_total')
+    credit_score = cached_credit_score(
+        customer, lambda: compute_credit_score(customer.approved_limit, **summary)
+    )
+
+    approval, corrected_interest_rate, message = _apply_rules(
+        credit_score, interest_rate, active_emi_total, customer.monthly_salary
+    )
+    monthly_installment = calculate_monthly_installment(loan_amount, corrected_interest_rate, tenure)
+    return Decision(credit_score, approval, corrected_interest_rate, monthly_installment, message)
+
+
+def _apply_rules(credit_score, interest_rate, active_emi_total, monthly_salary):
+    """Return (approval, corrected_interest_rate, message) for a scored request"""
+    approval = False
+    corrected_interest_rate = interest_rate
+    message = SCORE_TOO_LOW
+    for min_score, min_rate in RATE_FLOORS:
+        if credit_score > min_score:
+            if min_rate is None or interest_rate >= min_rate:
+                approval = True
+                message = ""
+            else:
+                corrected_interest_rate = min_rate
+                message = RATE_TOO_LOW
+            break
+
+    # Check if sum of current EMIs > 50% of monthly salary
+    if active_emi_total > monthly_salary * MAX_EMI_SHARE:
+        approval = False
+        message = EMI_TOO_HIGH
+    return approval, corrected_interest_rate, message
+
+
+def monthly_installments(principals, annual_rates, tenures):
+    """Vectorized calculate_monthly_installment, same float result for every element"""
+    principal = np.array([float(value) for value in principals], dtype=np.float64)
+    monthly_rate = np.array([float(value) for value in annual_rates], dtype=np.float64) / 100 / 12
+    months = np.array(tenures, dtype=np.int64)
+    # Python's pow, np.power may take a SIMD path that differs from it in the last bit
+    growth = np.array([(1 + rate) ** month for rate, month in zip(monthly_rate.tolist(), months.tolist())])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emi = np.where(
+            monthly_rate == 0,
+            principal / months,
+            principal * monthly_rate * growth / (growth - 1),
+        )
+    # Python's round on each element, np.round rounds halves differently
+    return [round(value, 2) for value in emi.tolist()]
+
+
+def load_customers(customer_ids, lock=False):
+    """
+    Fetch customers with their profiles, computing unsaved ones for customers without
+
+    With ``lock`` the customer rows are locked in primary key order until the
+    surrounding transaction ends.
+    """
+    queryset = Customer.objects.select_related('credit_profile')
+    if lock:
+        queryset = queryset.select_for_update(of=('self',)).order_by('pk')
+    customers = {}
+    for ids in chunked(sorted(set(customer_ids)), REFRESH_CHUNK_SIZE):
+        customers.update((customer.pk, customer) for customer in queryset.filter(pk__in=ids))
+    profiles = {}
+    missing = []
+    for customer_id, customer in customers.items():
+        try:
+            profiles[customer_id] = customer.credit_profile
+        except CustomerCreditProfile.DoesNotExist:
+            missing.append(customer_id)
+    for ids in chunked(sorted(missing), REFRESH_CHUNK_SIZE):
+        for profile in compute_profiles(ids, customers):
+            profiles[profile.customer_id] = profile
+    return customers, profiles
+
+
+def decide_many(requests):
+    """
+    Decide a batch of validated eligibility requests in a few set-based queries
+
+    Returns one Decision per request, in order, or None where the customer
+    does not exist. Scores are computed with the vectorized batch scorer from
+    the same inputs the score cache is filled from.
+    """
+    customers, profiles = load_customers([request['customer_id'] for request in requests])
+    summaries = {customer_id: profile.loan_summary() for customer_id, profile in profiles.items()}
+    ids = sorted(customers)
+    scores = {}
+    if ids:
+        inputs = [summaries[customer_id] for customer_id in ids]
+        scored = score_arrays(
+            to_cents([customers[customer_id].approved_limit for customer_id in ids]),
+            np.array([summary['total_loans'] for summary in inputs], dtype=np.int64),
+            to_cents([summary['total_current_amount'] for summary in inputs]),
+            np.array([summary['loans_paid_on_time'] for summary in inputs], dtype=np.int64),
+            np.array([summary['current_year_loans'] for summary in inputs], dtype=np.int64),
+            to_cents([summary['total_approved_volume'] for summary in inputs]),
+        )
+        scores = dict(zip(ids, scored.tolist()))
+
+    rules = []
+    for request in requests:
+        customer = customers.get(request['customer_id'])
+        if customer is None:
+            rules.append(None)
+            continue
+        rules.append(_apply_rules(
+            scores[customer.pk], request['interest_rate'],
+            summaries[customer.pk]['active_emi_total'], customer.monthly_salary,
+        ))
+
+    found = [index for index, rule in enumerate(rules) if rule is not None]
+    installments = monthly_installments(
+        [requests[index]['loan_amount'] for index in found],
+        [rules[index][1] for index in found],
+        [requests[index]['tenure'] for index in found],
+    )
+    decisions = [None] * len(requests)
+    for index, monthly_installment in zip(found, installments):
+        approval, corrected_interest_rate, message = rules[index]
+        decisions[index] = Decision(
+            scores[requests[index]['customer_id']], approval, corrected_interest_rate, monthly_installment, message
+        )
+    return decisions
+
+
+def build_loan(customer, loan_amount, tenure, decision):
+    """Unsaved Loan for an approved decision, starting today"""
+    today = datetime.now().date()
+    return Loan(
+        customer=customer,
+        loan_amount=loan_amount,
+        tenure=tenure,
+        interest_rate=decision.corrected_interest_rate,
+        monthly_repayment=Decimal(str(decision.monthly_installment)),
+        start_date=today,
+        end_date=today + timedelta(days=tenure * 30)
+    )
+
+
+def claim_customer(customer):
+    """Bump loan_version if it has not moved since ``customer`` was loaded"""
+    claimed = Customer.objects.filter(
+        pk=customer.pk, loan_version=customer.loan_version
+    ).update(loan_version=F('loan_version') + 1)
+    return claimed == 1
+
+
+def apply_for_loan(customer_id, loan_amount, interest_rate, tenure, max_attempts=None):
+    """
+    Decide an application and create the loan if approved
+
+    Returns (Decision, Loan or None). Raises Customer.DoesNotExist for an
+    unknown customer and CustomerBusy when every attempt lost the race.
+    """
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'LOAN_CREATE_MAX_ATTEMPTS', 5)
+    for attempt in range(max_attempts):
+        customer = load_customer(customer_id)
+        decision = decide(customer, loan_amount, interest_rate, tenure)
+        if not decision.approval:
+            return decision, None
+        with transaction.atomic():
+            if claim_customer(customer):
+                loan = build_loan(customer, loan_amount, tenure, decision)
+                loan.save(force_insert=True)
+                record_new_loan(loan, bump_version=False)
+                return decision, loan
+        _back_off(attempt)
+    raise CustomerBusy(customer_id)
+
+
+def _back_off(attempt):
+    time.sleep(random.uniform(0, RETRY_BACKOFF_SECONDS * (attempt + 1)))
+
+
+def process_application(application_id, max_attempts=None):
+    """
+    Decide a PENDING LoanApplication and record the outcome on it
+
+    The decision is made without locks, like in ``apply_for_loan``; the
+    application row is only locked by the short transaction that writes the
+    loan and the new status together, so a redelivered task finds it decided
+    and leaves it alone. Returns the application, or None if it no longer
+    exists. Raises CustomerBusy like ``apply_for_loan``, with nothing written.
+    """
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'LOAN_CREATE_MAX_ATTEMPTS', 5)
+    application = LoanApplication.objects.filter(pk=application_id).first()
+    if application is None or application.status != LoanApplication.PENDING:
+        return application
+    for attempt in range(max_attempts):
+        customer = load_customer(application.customer_id)
+        decision = decide(customer, application.loan_amount, application.interest_rate, application.tenure)
+        with transaction.atomic():
+            application = LoanApplication.objects.select_for_update().filter(pk=application_id).first()
+            if application is None or application.status != LoanApplication.PENDING:
+                # Decided by a redelivered task in the meantime, or deleted
+                return application
+            if not decision.approval:
+                return _record_outcome(application, decision, None)
+            if claim_customer(customer):
+                loan = build_loan(customer, application.loan_amount, application.tenure, decision)
+                loan.save(force_insert=True)
+                record_new_loan(loan, bump_version=False)
+                return _record_outcome(application, decision, loan)
+        _back_off(attempt)
+    raise CustomerBusy(application.customer_id)
+
+
+def _record_outcome(application, decision, loan):
+    """Store a decision on a locked application, its audit record follows the commit"""
+    if loan is not None:
+        application.status = LoanApplication.APPROVED
+        application.approved_loan = loan
+    else:
+        application.status = LoanApplication.REJECTED
+        application.rejection_reason = decision.message
+    application.save(update_fields=['status', 'approved_loan', 'rejection_reason'])
+    transaction.on_commit(lambda: decision_log.record(
+        DecisionLog.LOAN, application.customer_id, application.loan_amount, application.interest_rate,
+        application.tenure, decision, loan,
+    ))
+    return application
+
+
+def give_up_application(application_id, reason=CUSTOMER_BUSY):
+    """Reject an application still PENDING after every retry, so polling clients see a final status"""
+    with transaction.atomic():
+        application = LoanApplication.objects.select_for_update().filter(pk=application_id).first()
+        if application is not None and application.status == LoanApplication.PENDING:
+            application.status = LoanApplication.REJECTED
+            application.rejection_reason = reason
+            application.save(update_fields=['status', 'rejection_reason'])
+    return application
+
+
+def create_loans(requests, chunk_size=LOAN_BATCH_CHUNK_SIZE):
+    """
+    Decide and create loans for a batch of validated applications
+
+    Requests are decided in order with the same rules as ``create_loan``,
+    each approval counting towards the customer's later requests in the
+    batch. The chunk's customer rows stay locked while it is decided and
+    written, and the profile refresh bumps their loan_version, so single
+    applications racing the batch retry against the new state. Approved
+    loans are written with one bulk insert per chunk, in a transaction that
+    also refreshes the touched profiles. Returns one (Decision, Loan or
+    None) pair per request, or None for unknown customers.
+
+    A chunk whose transaction fails is rolled back on its own: each of its
+    requests gets the exception in place of a result, while earlier and
+    later chunks commit and are reported as usual.
+    """
+    results = []
+    for chunk in chunked(requests, chunk_size):
+        try:
+            results.extend(_create_chunk(chunk))
+        except Exception as e:
+            logger.error(f"Could not create a chunk of {len(chunk)} loans: {str(e)}")
+            results.extend([e] * len(chunk))
+    return results
+
+
+def _create_chunk(chunk):
+    outcomes = []
+    with transaction.atomic():
+        customers, profiles = load_customers([request['customer_id'] for request in chunk], lock=True)
+        loans = []
+        for request in chunk:
+            customer = customers.get(request['customer_id'])
+            if customer is None:
+                outcomes.append(None)
+                continue
+            profile = profiles[customer.pk]
+            summary = profile.loan_summary()
+            active_emi_total = summary.pop('active_emi_total')
+            credit_score = compute_credit_score(customer.approved_limit, **summary)
+            approval, corrected_interest_rate, message = _apply_rules(
+                credit_score, request['interest_rate'], active_emi_total, customer.monthly_salary
+            )
+            loan = None
+            if approval:
+                monthly_installment = calculate_monthly_installment(
+                    request['loan_amount'], corrected_interest_rate, request['tenure']
+                )
+                decision = Decision(credit_score, approval, corrected_interest_rate, monthly_installment, message)
+                loan = build_loan(customer, request['loan_amount'], request['tenure'], decision)
+                profile.add_loan(loan)
+                customer.add_exposure(loan)
+                loans.append(loan)
+            else:
+                decision = Decision(credit_score, approval, corrected_interest_rate, None, message)
+            outcomes.append((decision, loan))
+        if loans:
+            Loan.objects.bulk_create(loans)
+            refresh_profiles({loan.customer_id for loan in loans}, lock=False)
+    return outcomes
@@ -0,0 +1,33 @@
+"""
+Streaming NDJSON exports of loans.
+
+Rows are read with ``values_list().iterator()`` (a server-side cursor on
+PostgreSQL) and encoded one line at a time, so memory stays flat however
+many loans are exported and the first line is sent as soon as the first
+chunk arrives.
+"""
+import json
+
+from .fast_serialization import LOAN_LIST_FIELDS, encode_value, with_repayments_left
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Same fields as LoanListSerializer
+CUSTOMER_EXPORT_FIELDS = LOAN_LIST_FIELDS
+BOOK_EXPORT_FIELDS = [
+    'loan_id', 'customer_id', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+    'emis_paid_on_time', 'start_date', 'end_date', 'repayments_left',
+]
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+def ndjson_lines(loans, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one JSON line per loan of ``loans``, ordered by loan_id"""
+    rows = (
+        with_repayments_left(loans)
+        .order_by('loan_id')
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size)
+    )
+    for row in rows:
+        yield json.dumps({field: encode_value(value) for field, value in zip(fields, row)}) + '\n'
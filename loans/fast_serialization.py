@@ -0,0 +1,82 @@
+"""
+Lean serialization of loan list and detail responses.
+
+``LoanListSerializer`` and ``LoanDetailSerializer`` build a model instance per
+row and serialize it field by field. The functions here read the same fields
+as ``values()`` rows instead, compute ``repayments_left`` in SQL and encode
+decimals the way DRF does, so the output is identical JSON at a fraction of
+the CPU cost. ``manage.py benchmark_serialization`` compares both paths.
+"""
+from datetime import date
+from decimal import Decimal
+import json
+
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import Loan
+
+# Same fields as LoanListSerializer
+LOAN_LIST_FIELDS = ['loan_id', 'loan_amount', 'interest_rate', 'monthly_repayment', 'repayments_left']
+# Same fields as LoanDetailSerializer and its nested CustomerDetailSerializer
+LOAN_DETAIL_FIELDS = ['loan_id', 'loan_amount', 'interest_rate', 'monthly_repayment', 'tenure', 'repayments_left']
+CUSTOMER_DETAIL_FIELDS = ['customer_id', 'first_name', 'last_name', 'phone_number', 'age']
+# Non-null DecimalFields of Loan, rendered as fixed two-place strings
+DECIMAL_FIELDS = ['loan_amount', 'interest_rate', 'monthly_repayment']
+
+
+def encode_value(value):
+    # Match DRF's rendering: decimals as fixed two-place strings, dates in ISO format
+    if isinstance(value, Decimal):
+        return f"{value:.2f}"
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def with_repayments_left(loans):
+    """Annotate ``loans`` with the Loan.repayments_left property, computed in SQL"""
+    return loans.annotate(repayments_left=Greatest(F('tenure') - F('emis_paid_on_time'), Value(0)))
+
+
+def loan_list_rows(loans):
+    """``loans`` as a values() queryset of the list fields, for pagination"""
+    return with_repayments_left(loans).values(*LOAN_LIST_FIELDS)
+
+
+def encode_rows(rows):
+    """Encode the decimal columns of values() rows in place, returns the rows as a list"""
+    rows = list(rows)
+    fields = [field for field in DECIMAL_FIELDS if rows and field in rows[0]]
+    for row in rows:
+        for field in fields:
+            row[field] = f"{row[field]:.2f}"
+    return rows
+
+
+def loan_detail_rows(loan_id):
+    """values() queryset of the detail fields of one loan and its customer"""
+    customer_fields = [f'customer__{field}' for field in CUSTOMER_DETAIL_FIELDS]
+    return with_repayments_left(Loan.objects.filter(loan_id=loan_id)).values(*LOAN_DETAIL_FIELDS, *customer_fields)
+
+
+def detail_from_row(row):
+    """Nest a ``loan_detail_rows`` row like LoanDetailSerializer"""
+    detail = {'loan_id': row['loan_id']}
+    detail['customer'] = {field: row[f'customer__{field}'] for field in CUSTOMER_DETAIL_FIELDS}
+    for field in LOAN_DETAIL_FIELDS[1:]:
+        detail[field] = encode_value(row[field])
+    return detail
+
+
+def loan_detail(loan_id):
+    """The LoanDetailSerializer representation of a loan from one query, or None"""
+    row = loan_detail_rows(loan_id).first()
+    return detail_from_row(row) if row is not None else None
+
+
+def render(data):
+    """Encode ``data`` to the same bytes as DRF's JSONRenderer"""
+    content = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    # JSONRenderer escapes the two line terminators that are not valid in JavaScript strings
+    return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
@@ -0,0 +1,337 @@
+"""
+Set-based helpers used by the ingestion tasks.
+
+Rows are plain dicts keyed by the spreadsheet column names. Every batch is
+upserted with a single ``bulk_create(update_conflicts=True)`` statement plus
+one lookup of the ids that already exist, so the number of round trips grows
+with the number of batches rather than the number of rows.
+
+On PostgreSQL the ``copy_*`` helpers offer a faster path for full reloads:
+rows are streamed into a temporary staging table with ``COPY FROM STDIN``
+and merged into the real table with one ``INSERT ... ON CONFLICT DO UPDATE``.
+Rows are parsed before they reach COPY, so a malformed row is skipped and
+counted like on the ORM path instead of aborting the load.
+"""
+from collections import Counter
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+import io
+import logging
+
+import pandas as pd
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Customer, Loan
+from .profiles import refresh_all_profiles, refresh_profiles
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_UPDATE_FIELDS = [
+    'first_name', 'last_name', 'age', 'phone_number', 'monthly_salary', 'approved_limit',
+]
+LOAN_UPDATE_FIELDS = [
+    'customer', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+    'emis_paid_on_time', 'start_date', 'end_date',
+]
+# Written when a customer is first loaded, left alone on later loads
+CUSTOMER_INSERT_ONLY_FIELDS = ['current_debt', 'active_emi_total', 'loan_version', 'created_at']
+LOAN_INSERT_ONLY_FIELDS = ['created_at']
+# Stamped on every write; auto_now does it for the ORM path, the COPY path sets them itself
+TIMESTAMP_FIELDS = ['created_at', 'updated_at']
+# Attributes hashed by delta loads, the same data without touching relations
+CUSTOMER_DIGEST_FIELDS = CUSTOMER_UPDATE_FIELDS
+LOAN_DIGEST_FIELDS = ['customer_id'] + LOAN_UPDATE_FIELDS[1:]
+LOAN_ID_COLUMN = 'Loan ID'
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        # The source files write dates as dd-mm-yyyy, skip pandas' format guessing
+        try:
+            return datetime.strptime(value, '%d-%m-%Y').date()
+        except ValueError:
+            pass
+    value = pd.to_datetime(value)
+    if pd.isna(value):
+        return None
+    return value.date()
+
+
+def customer_from_row(row):
+    """Build an unsaved Customer from a spreadsheet row"""
+    return Customer(
+        customer_id=int(row['Customer ID']),
+        first_name=row['First Name'],
+        last_name=row['Last Name'],
+        age=int(row['Age']),
+        phone_number=str(row['Phone Number']),
+        monthly_salary=Decimal(str(row['Monthly Salary'])),
+        approved_limit=Decimal(str(row['Approved Limit'])),
+        current_debt=Decimal('0.00'),
+    )
+
+
+def loan_from_row(row):
+    """Build an unsaved Loan from a spreadsheet row"""
+    return Loan(
+        loan_id=int(row[LOAN_ID_COLUMN]),
+        customer_id=int(row['Customer ID']),
+        loan_amount=Decimal(str(row['Loan Amount'])),
+        tenure=int(row['Tenure']),
+        interest_rate=Decimal(str(row['Interest Rate'])),
+        monthly_repayment=Decimal(str(row['Monthly payment'])),
+        emis_paid_on_time=int(row['EMIs paid on Time']),
+        start_date=_to_date(row['Date of Approval']),
+        end_date=_to_date(row['End Date']),
+    )
+
+
+def parse_loan_rows(rows, malformed):
+    """Yield a Loan per well-formed row, logging the others and counting them in ``malformed['rows']``"""
+    for row in rows:
+        try:
+            yield loan_from_row(row)
+        except Exception as e:
+            logger.error(f"Error processing loan row {row}: {str(e)}")
+            malformed['rows'] += 1
+
+
+def _upsert(model, objs, update_fields):
+    """
+    Upsert one batch and return (created, updated).
+
+    Rows are counted the same way the old per-row ``get_or_create`` loop
+    counted them: the first occurrence of an id that is not yet stored is a
+    create, everything else (including repeats inside the batch) is an update.
+    Repeated ids are collapsed to their last occurrence because a single
+    ``INSERT ... ON CONFLICT`` may not touch the same row twice, and rows are
+    written in primary key order so concurrent shards lock rows in the same
+    order.
+    """
+    pk_name = model._meta.pk.name
+    ids = [obj.pk for obj in objs]
+    existing = set(model.objects.filter(pk__in=ids).values_list(pk_name, flat=True))
+
+    created = updated = 0
+    latest = {}
+    for obj in objs:
+        if obj.pk in existing or obj.pk in latest:
+            updated += 1
+        else:
+            created += 1
+        latest[obj.pk] = obj
+
+    model.objects.bulk_create(
+        [latest[pk] for pk in sorted(latest)],
+        update_conflicts=True,
+        unique_fields=[pk_name],
+        update_fields=update_fields,
+    )
+    return created, updated
+
+
+def _write_batch(model, objs, update_fields, tracker, rows_consumed, on_write=None):
+    """
+    Upsert one batch in its own transaction, returns (created, updated).
+
+    With a delta ``tracker`` unchanged rows are dropped first, and the new
+    fingerprints and checkpoint commit atomically with the rows themselves.
+    ``on_write`` is called inside the transaction with the rows about to be
+    written, while their previous state is still visible, and may return a
+    callable to run once they are stored.
+    """
+    if tracker is not None:
+        objs = tracker.filter_changed(objs)
+    batch_created = batch_updated = 0
+    with transaction.atomic():
+        if objs:
+            finish = on_write(objs) if on_write else None
+            batch_created, batch_updated = _upsert(model, objs, update_fields)
+            if finish:
+                finish()
+        if tracker is not None:
+            tracker.commit(rows_consumed)
+    return batch_created, batch_updated
+
+
+def _refresh_loan_owners(loans):
+    """Refresh the credit profiles of the customers a loan batch touches"""
+    owners = {loan.customer_id for loan in loans}
+    # A loan moved to another customer also changes its previous owner
+    owners.update(Loan.objects.filter(pk__in=[loan.pk for loan in loans]).values_list('customer_id', flat=True))
+    return lambda: refresh_profiles(owners)
+
+
+def upsert_customers(batches, tracker=None):
+    """Upsert customers from an iterable of row batches, returns (created, updated)"""
+    created = updated = 0
+    for rows in batches:
+        objs = [customer_from_row(row) for row in rows]
+        batch_created, batch_updated = _write_batch(
+            Customer, objs, CUSTOMER_UPDATE_FIELDS + ['updated_at'], tracker, len(rows)
+        )
+        created += batch_created
+        updated += batch_updated
+        logger.info(f"Upserted {batch_created + batch_updated} customers (created {batch_created}, updated {batch_updated})")
+    return created, updated
+
+
+def upsert_loans(batches, customer_ids=None, tracker=None, superseded=()):
+    """
+    Upsert loans from an iterable of row batches, returns (created, updated, skipped).
+
+    Foreign keys are resolved against ``customer_ids``, an in-memory set of
+    known customer ids loaded once up front; rows pointing at an unknown
+    customer are skipped. Rows of the loan ids in ``superseded`` are counted
+    as updates but not written, a later row of the file replaces them.
+    """
+    if customer_ids is None:
+        customer_ids = set(Customer.objects.values_list('customer_id', flat=True))
+
+    created = updated = skipped = 0
+    malformed = Counter()
+    for rows in batches:
+        objs = []
+        for loan in parse_loan_rows(rows, malformed):
+            if loan.customer_id not in customer_ids:
+                logger.warning(f"Customer {loan.customer_id} not found for loan {loan.loan_id}")
+                skipped += 1
+                continue
+            if loan.loan_id in superseded:
+                updated += 1
+                continue
+            objs.append(loan)
+        if not objs and tracker is None:
+            continue
+        batch_created, batch_updated = _write_batch(
+            Loan, objs, LOAN_UPDATE_FIELDS + ['updated_at'], tracker, len(rows), on_write=_refresh_loan_owners
+        )
+        created += batch_created
+        updated += batch_updated
+        logger.info(f"Upserted {batch_created + batch_updated} loans (created {batch_created}, updated {batch_updated})")
+    return created, updated, skipped + malformed['rows']
+
+
+class _CopyStream(io.RawIOBase):
+    """Read-only file object producing CSV lines lazily from a row iterator"""
+
+    def __init__(self, rows):
+        self._lines = self._encode(rows)
+        self._buffer = b''
+
+    @staticmethod
+    def _encode(rows):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for row in rows:
+            writer.writerow(row)
+            yield out.getvalue().encode('utf-8')
+            out.seek(0)
+            out.truncate()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _copy_into_staging(cursor, staging_table, table, columns, rows):
+    column_list = ', '.join(columns)
+    # Private to this connection, so concurrent loads never see each other's rows
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {staging_table} ON COMMIT DROP AS "
+        f"SELECT 0::bigint AS row_no, {column_list} FROM {table} WITH NO DATA"
+    )
+    stream = io.BufferedReader(_CopyStream(
+        [row_no] + values for row_no, values in enumerate(rows)
+    ), buffer_size=1 << 16)
+    cursor.copy_expert(f"COPY {staging_table} (row_no, {column_list}) FROM STDIN WITH (FORMAT csv)", stream)
+
+
+def _merge_from_staging(cursor, staging_table, table, pk, columns, update_columns, join=''):
+    """
+    Merge the staging table into ``table`` and return (created, updated).
+
+    Repeated ids in the staging table collapse to their last row, and every
+    row beyond the first sighting of a new id counts as an update, matching
+    the counts of the ORM path.
+    """
+    column_list = ', '.join(columns)
+    select_list = ', '.join(f"s.{column}" for column in columns)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    cursor.execute(f"SELECT count(*) FROM {staging_table} s {join}")
+    total = cursor.fetchone()[0]
+    # Inserted rows are counted by the server, a load of millions of rows returns one row
+    cursor.execute(
+        f"WITH merged AS ("
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT DISTINCT ON (s.{pk}) {select_list} FROM {staging_table} s {join} "
+        f"ORDER BY s.{pk}, s.row_no DESC "
+        f"ON CONFLICT ({pk}) DO UPDATE SET {updates} "
+        f"RETURNING (xmax = 0) AS inserted"
+        f") SELECT count(*) FILTER (WHERE inserted) FROM merged"
+    )
+    created = cursor.fetchone()[0]
+    return created, total - created
+
+
+def _copy_values(objs, columns):
+    """Column values of unsaved objects for COPY, with the load time as their timestamps"""
+    now = timezone.now()
+    for obj in objs:
+        yield [now if column in TIMESTAMP_FIELDS else getattr(obj, column) for column in columns]
+
+
+def copy_customers(rows):
+    """Bulk load customers through COPY and a staging merge, returns (created, updated)"""
+    table = Customer._meta.db_table
+    columns = ['customer_id'] + CUSTOMER_UPDATE_FIELDS + CUSTOMER_INSERT_ONLY_FIELDS + ['updated_at']
+    values = _copy_values(map(customer_from_row, rows), columns)
+    with transaction.atomic(), connection.cursor() as cursor:
+        _copy_into_staging(cursor, 'customers_staging', table, columns, values)
+        # Existing customers keep their insert-only fields, like the ORM path
+        created, updated = _merge_from_staging(
+            cursor, 'customers_staging', table, 'customer_id', columns, CUSTOMER_UPDATE_FIELDS + ['updated_at']
+        )
+        cursor.execute("DROP TABLE customers_staging")
+    call_command('fix_sequences')
+    return created, updated
+
+
+def copy_loans(rows):
+    """Bulk load loans through COPY and a staging merge, returns (created, updated, skipped)"""
+    table = Loan._meta.db_table
+    columns = ['loan_id', 'customer_id'] + LOAN_UPDATE_FIELDS[1:] + LOAN_INSERT_ONLY_FIELDS + ['updated_at']
+    malformed = Counter()
+    values = _copy_values(parse_loan_rows(rows, malformed), columns)
+    update_columns = [column for column in columns[1:] if column not in LOAN_INSERT_ONLY_FIELDS]
+    with transaction.atomic(), connection.cursor() as cursor:
+        _copy_into_staging(cursor, 'loans_staging', table, columns, values)
+        cursor.execute("SELECT count(*) FROM loans_staging")
+        total = cursor.fetchone()[0]
+        # Loans pointing at unknown customers are skipped, like the ORM path
+        created, updated = _merge_from_staging(
+            cursor, 'loans_staging', table, 'loan_id', columns, update_columns,
+            join=f"JOIN {Customer._meta.db_table} c ON c.customer_id = s.customer_id",
+        )
+        cursor.execute("DROP TABLE loans_staging")
+    call_command('fix_sequences')
+    refresh_all_profiles()
+    return created, updated, total - created - updated + malformed['rows']
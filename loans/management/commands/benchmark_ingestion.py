@@ -0,0 +1,116 @@
+import json
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from loans.readers import FORMATS, count_rows
+from loans.tasks import ingest_customer_data, ingest_loan_data
+
+
+class QueryCounter:
+    """Counts statements through a database execute wrapper, without keeping their SQL"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Time the ingestion tasks and record rows/sec, query count and peak RSS as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer-file', default='generated_data/customer_data.csv',
+                            help='Customer data file (see generate_data)')
+        parser.add_argument('--loan-file', default='generated_data/loan_data.csv',
+                            help='Loan data file (see generate_data)')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from file extension)')
+        parser.add_argument('--mode', choices=['bulk', 'copy', 'delta'], default='bulk', help='Ingestion mode')
+        parser.add_argument('--batch-size', type=int, help='Rows per bulk upsert batch')
+        parser.add_argument('--label', default='', help='Free-form label stored with the run')
+        parser.add_argument('--output', default='benchmarks/ingestion.json',
+                            help='JSON file the run is appended to')
+
+    @contextmanager
+    def measure(self, name, path, fmt, results):
+        rows = count_rows(path, fmt)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            yield
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'rows': rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(rows / elapsed, 1) if elapsed else None,
+            'queries': counter.count,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        self.stdout.write(
+            f"{name}: {rows} rows in {elapsed:.2f}s ({results[name]['rows_per_sec']} rows/s), "
+            f"{counter.count} queries, peak RSS {results[name]['peak_rss_mb']} MB"
+        )
+
+    def handle(self, *args, **options):
+        for key in ('customer_file', 'loan_file'):
+            if not Path(options[key]).exists():
+                raise CommandError(f"{options[key]} not found, create it with manage.py generate_data")
+
+        ingest_options = {
+            'batch_size': options['batch_size'],
+            'fmt': options['format'],
+            'use_copy': options['mode'] == 'copy',
+            'delta': options['mode'] == 'delta',
+        }
+        results = {}
+        with self.measure('customers', options['customer_file'], options['format'], results):
+            outcome = ingest_customer_data(path=options['customer_file'], **ingest_options)
+        if outcome.startswith('Error'):
+            raise CommandError(f'Customer ingestion failed: {outcome}')
+        with self.measure('loans', options['loan_file'], options['format'], results):
+            outcome = ingest_loan_data(path=options['loan_file'], **ingest_options)
+        if outcome.startswith('Error'):
+            raise CommandError(f'Loan ingestion failed: {outcome}')
+
+        run = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'label': options['label'],
+            'mode': options['mode'],
+            'database': connection.vendor,
+            'batch_size': options['batch_size'] or settings.INGEST_BATCH_SIZE,
+            'results': results,
+        }
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        runs = json.loads(output.read_text()) if output.exists() else []
+        runs.append(run)
+        output.write_text(json.dumps(runs, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Benchmark run appended to {output}'))
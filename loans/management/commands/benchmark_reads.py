@@ -0,0 +1,103 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.management.commands.benchmark_ingestion import git_commit
+
+# (name, server option, path template) of every read endpoint that is timed
+TARGETS = [
+    ('wsgi_view_loan', 'wsgi_url', '/view-loan/{loan_id}/'),
+    ('asgi_view_loan', 'asgi_url', '/async/view-loan/{loan_id}/'),
+    ('wsgi_view_loans', 'wsgi_url', '/view-loans/{customer_id}/'),
+    ('asgi_view_loans', 'asgi_url', '/async/view-loans/{customer_id}/'),
+]
+
+
+def fetch(url, timeout):
+    """GET ``url``, return (seconds, ok)"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read throughput of the WSGI views and their async ASGI versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://localhost:8000', help='Server running the WSGI app')
+        parser.add_argument('--asgi-url', default='http://localhost:8001', help='Server running the ASGI app')
+        parser.add_argument('--loan-id', type=int, default=1, help='Loan fetched by the view-loan endpoints')
+        parser.add_argument('--customer-id', type=int, default=1, help='Customer listed by the view-loans endpoints')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests sent to each endpoint')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--label', default='', help='Free-form label stored with the run')
+        parser.add_argument('--output', default='benchmarks/reads.json', help='JSON file the run is appended to')
+
+    def measure(self, url, requests, concurrency, timeout):
+        # Warm up connections, caches and the server's worker pool
+        fetch(url, timeout)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(lambda _: fetch(url, timeout), range(requests)))
+        elapsed = time.perf_counter() - started
+        latencies = [seconds * 1000 for seconds, ok in outcomes if ok]
+        return {
+            'url': url,
+            'requests': requests,
+            'errors': requests - len(latencies),
+            'seconds': round(elapsed, 3),
+            'requests_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        }
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        results = {}
+        for name, server, template in TARGETS:
+            url = options[server].rstrip('/') + template.format(
+                loan_id=options['loan_id'], customer_id=options['customer_id']
+            )
+            result = self.measure(url, options['requests'], options['concurrency'], options['timeout'])
+            if result['errors'] == result['requests']:
+                raise CommandError(f'Every request to {url} failed, is the server running?')
+            results[name] = result
+            self.stdout.write(
+                f"{name}: {result['requests_per_sec']} req/s, p50 {result['p50_ms']} ms, "
+                f"p95 {result['p95_ms']} ms, {result['errors']} errors"
+            )
+
+        run = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'label': options['label'],
+            'concurrency': options['concurrency'],
+            'results': results,
+        }
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        runs = json.loads(output.read_text()) if output.exists() else []
+        runs.append(run)
+        output.write_text(json.dumps(runs, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Benchmark run appended to {output}'))
@@ -0,0 +1,114 @@
+import json
+import statistics
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from loans.fast_serialization import encode_rows, loan_list_rows, render
+from loans.management.commands.benchmark_ingestion import git_commit
+from loans.models import Customer, Loan
+from loans.serializers import LoanListSerializer
+
+
+def render_with_serializer(loans):
+    return JSONRenderer().render(LoanListSerializer(loans, many=True).data)
+
+
+def render_values(rows):
+    return render(encode_rows(rows))
+
+
+# (name, fetch the loan queryset, render the fetched rows to response bytes)
+PATHS = [
+    ('serializer', lambda loans: list(loans.all()), render_with_serializer),
+    ('values', lambda loans: list(loan_list_rows(loans)), render_values),
+]
+
+
+def timed(function, argument):
+    started = time.perf_counter()
+    result = function(argument)
+    return result, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Time the ModelSerializer and values() paths rendering one customer\'s loan list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=10000, help='Loans in the rendered list')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per path')
+        parser.add_argument('--label', default='', help='Free-form label stored with the run')
+        parser.add_argument('--output', default='benchmarks/serialization.json',
+                            help='JSON file the run is appended to')
+
+    def handle(self, *args, **options):
+        if options['loans'] < 1 or options['repeat'] < 1:
+            raise CommandError('--loans and --repeat must be positive')
+
+        results = {}
+        # The fixture customer and loans are rolled back at the end
+        with transaction.atomic():
+            customer = Customer.objects.create(
+                first_name='Benchmark', last_name='Customer', age=30, phone_number='bench-serial',
+                monthly_salary=Decimal('100000'), approved_limit=Decimal('3600000'),
+            )
+            Loan.objects.bulk_create(
+                Loan(
+                    customer=customer, loan_amount=Decimal('100000') + index, tenure=12 + index % 48,
+                    interest_rate=Decimal('12.50'), monthly_repayment=Decimal('8908.70'),
+                    emis_paid_on_time=index % 24, start_date=date(2024, 1, 1),
+                )
+                for index in range(options['loans'])
+            )
+            loans = customer.loans.order_by('loan_id')
+
+            rendered = {}
+            for name, fetch, serialize in PATHS:
+                fetch_times, serialize_times = [], []
+                for _ in range(options['repeat']):
+                    rows, seconds = timed(fetch, loans)
+                    fetch_times.append(seconds)
+                    rendered[name], seconds = timed(serialize, rows)
+                    serialize_times.append(seconds)
+                results[name] = {
+                    'fetch_ms': round(statistics.median(fetch_times) * 1000, 2),
+                    'serialize_ms': round(statistics.median(serialize_times) * 1000, 2),
+                    'bytes': len(rendered[name]),
+                }
+                self.stdout.write(
+                    f"{name}: fetch {results[name]['fetch_ms']} ms, serialize {results[name]['serialize_ms']} ms "
+                    f"(medians of {options['repeat']})"
+                )
+            transaction.set_rollback(True)
+
+        if rendered['serializer'] != rendered['values']:
+            raise CommandError('The values() path rendered different bytes from the serializer')
+        speedup = {
+            phase: round(results['serializer'][phase] / results['values'][phase], 2)
+            for phase in ('fetch_ms', 'serialize_ms')
+        }
+        self.stdout.write(
+            f"values() path: fetch {speedup['fetch_ms']}x, serialize {speedup['serialize_ms']}x faster"
+        )
+
+        run = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'label': options['label'],
+            'database': connection.vendor,
+            'loans': options['loans'],
+            'speedup': speedup,
+            'results': results,
+        }
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        runs = json.loads(output.read_text()) if output.exists() else []
+        runs.append(run)
+        output.write_text(json.dumps(runs, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Benchmark run appended to {output}'))
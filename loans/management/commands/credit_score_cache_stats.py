@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from loans.score_cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show credit score cache hit/miss counters'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+    
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        lookups = sum(stats.values())
+        hit_rate = (stats['hits'] + stats['stale_hits']) / lookups * 100 if lookups else 0
+        self.stdout.write(
+            f"Hits: {stats['hits']}, stale hits: {stats['stale_hits']}, misses: {stats['misses']} "
+            f"(hit rate {hit_rate:.1f}%)"
+        )
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,140 @@
+import csv
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+CUSTOMER_COLUMNS = [
+    'Customer ID', 'First Name', 'Last Name', 'Age', 'Phone Number', 'Monthly Salary', 'Approved Limit',
+]
+LOAN_COLUMNS = [
+    'Customer ID', 'Loan ID', 'Loan Amount', 'Tenure', 'Interest Rate', 'Monthly payment',
+    'EMIs paid on Time', 'Date of Approval', 'End Date',
+]
+FIRST_NAMES = [
+    'Aaron', 'Abbey', 'Abel', 'Abigail', 'Adam', 'Aditi', 'Alice', 'Amit', 'Ana', 'Arjun',
+    'Bella', 'Carlos', 'Chen', 'Deepa', 'Diego', 'Elena', 'Farah', 'Grace', 'Hiro', 'Isha',
+    'Jon', 'Kavya', 'Leo', 'Maya', 'Nikhil', 'Olga', 'Priya', 'Rahul', 'Sara', 'Vikram',
+]
+LAST_NAMES = [
+    'Garcia', 'Gonzalez', 'Rodrigues', 'Fernandez', 'Lopez', 'Martinez', 'Sanchez', 'Perez',
+    'Gomez', 'Martin', 'Sharma', 'Patel', 'Singh', 'Kumar', 'Nair', 'Iyer', 'Smith', 'Brown',
+]
+# Data rows an xlsx sheet can hold below the header
+XLSX_MAX_ROWS = 1048575
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic customer and loan files in the ingestion column layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000, help='Number of customers')
+        parser.add_argument('--loans', type=int, default=30000, help='Number of loans')
+        parser.add_argument('--format', choices=['csv', 'xlsx', 'parquet'], default='csv', help='Output format')
+        parser.add_argument('--output-dir', default='generated_data', help='Directory for the generated files')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, same seed gives the same files')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows generated per chunk')
+
+    def handle(self, *args, **options):
+        customers, loans, fmt = options['customers'], options['loans'], options['format']
+        if customers < 1 or loans < 0:
+            raise CommandError('Need at least one customer and a non-negative number of loans')
+        if fmt == 'xlsx' and max(customers, loans) > XLSX_MAX_ROWS:
+            raise CommandError(f'xlsx holds at most {XLSX_MAX_ROWS} rows, use csv or parquet')
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(options['seed'])
+        chunk_size = options['chunk_size']
+
+        customer_file = output_dir / f'customer_data.{fmt}'
+        self.write(
+            customer_file, fmt, CUSTOMER_COLUMNS,
+            (self.customer_chunk(rng, start, min(start + chunk_size, customers))
+             for start in range(0, customers, chunk_size)),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Wrote {customers} customers to {customer_file}'))
+
+        loan_file = output_dir / f'loan_data.{fmt}'
+        self.write(
+            loan_file, fmt, LOAN_COLUMNS,
+            (self.loan_chunk(rng, start, min(start + chunk_size, loans), customers)
+             for start in range(0, loans, chunk_size)),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Wrote {loans} loans to {loan_file}'))
+
+    def customer_chunk(self, rng, start, stop):
+        size = stop - start
+        ids = np.arange(start + 1, stop + 1)
+        salary = rng.integers(25, 300, size) * 1000
+        return pd.DataFrame({
+            'Customer ID': ids,
+            'First Name': rng.choice(FIRST_NAMES, size),
+            'Last Name': rng.choice(LAST_NAMES, size),
+            'Age': rng.integers(21, 66, size),
+            # Unique ten digit numbers, like the real data
+            'Phone Number': 7000000000 + ids,
+            'Monthly Salary': salary,
+            'Approved Limit': np.round(36 * salary / 100000).astype(np.int64) * 100000,
+        })
+
+    def loan_chunk(self, rng, start, stop, customers):
+        size = stop - start
+        customer_ids = rng.integers(1, customers + 1, size)
+        amount = rng.integers(1, 11, size) * 100000
+        tenure = rng.integers(6, 181, size)
+        rate = np.round(rng.uniform(8, 18, size), 2)
+        monthly_rate = rate / 100 / 12
+        growth = (1 + monthly_rate) ** tenure
+        emi = np.round(amount * monthly_rate * growth / (growth - 1)).astype(np.int64)
+        # Most borrowers pay nearly every EMI on time, a tail pays far fewer
+        paid_share = np.clip(rng.beta(8, 1.5, size), 0, 1)
+        approval = pd.to_datetime(date(2010, 1, 1)) + pd.to_timedelta(rng.integers(0, 365 * 15, size), unit='D')
+        end = approval + pd.to_timedelta(tenure * 30, unit='D')
+        return pd.DataFrame({
+            'Customer ID': customer_ids,
+            'Loan ID': np.arange(start + 1, stop + 1),
+            'Loan Amount': amount,
+            'Tenure': tenure,
+            'Interest Rate': rate,
+            'Monthly payment': emi,
+            'EMIs paid on Time': np.floor(tenure * paid_share).astype(np.int64),
+            'Date of Approval': approval,
+            'End Date': end,
+        })
+
+    def write(self, path, fmt, columns, chunks):
+        if fmt == 'csv':
+            with open(path, 'w', newline='') as handle:
+                csv.writer(handle).writerow(columns)
+                for frame in chunks:
+                    frame.to_csv(handle, header=False, index=False, date_format='%d-%m-%Y')
+        elif fmt == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise CommandError('Writing parquet files requires pyarrow (pip install pyarrow)')
+            writer = None
+            try:
+                for frame in chunks:
+                    table = pa.Table.from_pandas(frame, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            from openpyxl import Workbook
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(columns)
+            for frame in chunks:
+                for row in frame.itertuples(index=False):
+                    sheet.append([value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+                                  for value in row])
+            workbook.save(path)
@@ -1,19 +1,70 @@
+import time
+from celery.result import AsyncResult
 from django.core.management.base import BaseCommand
+from loans.readers import FORMATS
 from loans.tasks import ingest_all_data
 
 
 class Command(BaseCommand):
-    help = 'Ingest customer and loan data from Excel files'
+    help = 'Ingest customer and loan data from spreadsheet files'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--customer-file', help='Customer data file (default: customer_data.xlsx)')
+        parser.add_argument('--loan-file', help='Loan data file (default: loan_data.xlsx)')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from file extension)')
+        parser.add_argument('--shards', type=int, help='Number of loan shards (default: INGEST_SHARD_SIZE rows each)')
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            help='Only write new or changed rows and resume an interrupted run from its checkpoint',
+        )
+        parser.add_argument('--wait', action='store_true', help='Wait for the ingestion and show shard progress')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between progress updates')
     
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting data ingestion...'))
         
         # Run the ingestion task
-        result = ingest_all_data.delay()
+        result = ingest_all_data.delay(
+            customer_file=options['customer_file'],
+            loan_file=options['loan_file'],
+            fmt=options['format'],
+            shards=options['shards'],
+            delta=options['delta'],
+        )
         
         self.stdout.write(
             self.style.SUCCESS(f'Data ingestion task started with ID: {result.id}')
         )
-        self.stdout.write(
-            self.style.SUCCESS('Check Celery logs for progress...')
-        )
+        if not options['wait']:
+            self.stdout.write(
+                self.style.SUCCESS('Check Celery logs for progress...')
+            )
+            return
+        
+        dispatch = result.get()
+        self.stdout.write(f"Customer ingestion: {dispatch['customer_result']}")
+        self.show_shard_progress(dispatch, options['poll_interval'])
+    
+    def show_shard_progress(self, dispatch, poll_interval):
+        shards = [AsyncResult(shard_id) for shard_id in dispatch['shard_ids']]
+        if not shards:
+            self.stdout.write(self.style.WARNING('No loan rows to ingest'))
+            return
+        
+        reported = -1
+        while True:
+            done = sum(1 for shard in shards if shard.ready())
+            if done != reported:
+                self.stdout.write(f'Loan shards completed: {done}/{len(shards)}')
+                reported = done
+            if done == len(shards):
+                break
+            time.sleep(poll_interval)
+        
+        failed = [shard.id for shard in shards if shard.failed()]
+        if failed:
+            self.stdout.write(self.style.ERROR(f"Failed shards: {', '.join(failed)}"))
+            return
+        summary = AsyncResult(dispatch['summary_id']).get()
+        self.stdout.write(self.style.SUCCESS(summary))
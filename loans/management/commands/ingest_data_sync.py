@@ -1,21 +1,48 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from loans.readers import FORMATS
 from loans.tasks import ingest_customer_data, ingest_loan_data
 
 
 class Command(BaseCommand):
-    help = 'Ingest customer and loan data from Excel files (synchronous)'
+    help = 'Ingest customer and loan data from spreadsheet files (synchronous)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Load through COPY into staging tables and merge (PostgreSQL only, '
+                 'other databases use bulk upserts)',
+        )
+        parser.add_argument('--batch-size', type=int, help='Rows per bulk upsert batch')
+        parser.add_argument('--customer-file', help='Customer data file (default: customer_data.xlsx)')
+        parser.add_argument('--loan-file', help='Loan data file (default: loan_data.xlsx)')
+        parser.add_argument('--format', choices=FORMATS, help='Input format (default: from file extension)')
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            help='Only write new or changed rows and resume an interrupted run from its checkpoint',
+        )
     
     def handle(self, *args, **options):
+        if options['copy'] and options['delta']:
+            raise CommandError('--copy is a full reload and cannot be combined with --delta')
+        
         self.stdout.write(self.style.SUCCESS('Starting data ingestion...'))
+        ingest_options = {
+            'batch_size': options['batch_size'],
+            'use_copy': options['copy'],
+            'fmt': options['format'],
+            'delta': options['delta'],
+        }
         
         # Run customer ingestion
         self.stdout.write('Ingesting customer data...')
-        customer_result = ingest_customer_data()
+        customer_result = ingest_customer_data(path=options['customer_file'], **ingest_options)
         self.stdout.write(self.style.SUCCESS(f'Customer ingestion: {customer_result}'))
         
         # Run loan ingestion
         self.stdout.write('Ingesting loan data...')
-        loan_result = ingest_loan_data()
+        loan_result = ingest_loan_data(path=options['loan_file'], **ingest_options)
         self.stdout.write(self.style.SUCCESS(f'Loan ingestion: {loan_result}'))
         
         self.stdout.write(self.style.SUCCESS('Data ingestion completed!'))
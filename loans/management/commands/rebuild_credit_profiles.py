@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from loans.profiles import find_drift, refresh_all_profiles
+
+
+class Command(BaseCommand):
+    help = 'Rebuild customer credit profiles from the loans table, or check them for drift'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report profiles that disagree with the loans table, exit non-zero on drift',
+        )
+    
+    def handle(self, *args, **options):
+        if options['check']:
+            drifted = set()
+            for customer_id, field, stored, expected in find_drift():
+                drifted.add(customer_id)
+                self.stdout.write(f'Customer {customer_id}: {field} is {stored}, expected {expected}')
+            if drifted:
+                raise CommandError(f'{len(drifted)} credit profiles have drifted, run rebuild_credit_profiles')
+            self.stdout.write(self.style.SUCCESS('All credit profiles match the loans table'))
+            return
+        
+        refreshed = refresh_all_profiles()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {refreshed} credit profiles'))
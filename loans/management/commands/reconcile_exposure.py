@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from loans.profiles import REFRESH_CHUNK_SIZE, find_exposure_drift, reset_exposures
+from loans.utils import chunked
+
+
+class Command(BaseCommand):
+    help = "Fix customers whose current_debt or active_emi_total disagree with their open loans"
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drifted customers, exit non-zero on drift',
+        )
+    
+    def handle(self, *args, **options):
+        drifted = set()
+        for customer_id, field, stored, expected in find_exposure_drift():
+            drifted.add(customer_id)
+            self.stdout.write(f'Customer {customer_id}: {field} is {stored}, expected {expected}')
+        
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All customer exposures match the loans table'))
+            return
+        if options['check']:
+            raise CommandError(f'{len(drifted)} customers have drifted exposure, run reconcile_exposure')
+        
+        for ids in chunked(sorted(drifted), REFRESH_CHUNK_SIZE):
+            with transaction.atomic():
+                # Bumping loan_version also retires scores cached from the wrong debt
+                reset_exposures(ids)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {len(drifted)} customers'))
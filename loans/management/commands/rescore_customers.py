@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from loans.tasks import rescore_customers
+
+
+class Command(BaseCommand):
+    help = 'Recompute every customer credit score with vectorized NumPy passes'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Customers scored per pass (default: RESCORE_CHUNK_SIZE)')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Queue the Celery task instead')
+    
+    def handle(self, *args, **options):
+        if options['run_async']:
+            result = rescore_customers.delay(chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'Rescore task started with ID: {result.id}'))
+            return
+        
+        started = time.perf_counter()
+        result = rescore_customers(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'{result} in {time.perf_counter() - started:.1f}s'))
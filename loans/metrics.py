@@ -0,0 +1,290 @@
+"""
+Request and Celery task metrics in the Prometheus text format.
+
+Each process keeps its counters and histograms in memory, so recording is a
+dict update under a lock. Every ``METRICS_PUBLISH_INTERVAL`` seconds (checked
+when a request or task finishes) the process stores a snapshot of them in
+the cache under its own key; ``/metrics`` adds up the snapshots of every
+live process, so web workers and Celery workers show up in one scrape
+without an exporter or push gateway. Snapshots expire with
+``METRICS_PROCESS_TTL`` once their process stops publishing, and a counter
+that drops with them reads as a reset to Prometheus.
+
+The sum spans processes only when they share the cache. With Redis the
+index of process keys is a set, so publishers add themselves without a
+read-modify-write; other shared backends edit the index list under a
+short ``cache.add`` lock. LocMemCache is per process, so each process
+then scrapes only itself, and the app warns at startup outside DEBUG.
+"""
+from bisect import bisect_left
+from functools import lru_cache
+import logging
+import os
+import socket
+import threading
+import time
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+import redis
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'loans_http_requests_total': ('counter', 'Requests by URL name, method and status', None),
+    'loans_http_request_duration_seconds': ('histogram', 'Time spent in the view and middleware', DURATION_BUCKETS),
+    'loans_http_request_queries': ('histogram', 'Database queries per request', QUERY_BUCKETS),
+    'loans_http_request_db_seconds': ('histogram', 'Time per request spent in database queries', DURATION_BUCKETS),
+    'loans_http_response_size_bytes': ('histogram', 'Response body size, streaming responses excluded', SIZE_BUCKETS),
+    'loans_celery_tasks_total': ('counter', 'Finished Celery tasks by name and state', None),
+    'loans_celery_task_duration_seconds': ('histogram', 'Celery task run time', TASK_BUCKETS),
+    'loans_decision_log_buffer_depth': ('gauge', 'Decision log records waiting to be written', None),
+    'loans_decision_log_dropped_total': ('counter', 'Decision log records dropped because the buffer was full', None),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+INDEX_KEY = 'metrics:processes'
+INDEX_LOCK_KEY = 'metrics:processes:lock'
+
+
+def _publish_settings():
+    return (
+        getattr(settings, 'METRICS_PUBLISH_INTERVAL', 10),
+        getattr(settings, 'METRICS_PROCESS_TTL', 300),
+    )
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> value for counters and gauges, [bucket counts..., sum, count] for histograms
+        self._values = {}
+        self._published_at = 0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 3)
+            # Counts per bucket, the +Inf bucket last; cumulated when rendered
+            series[bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [name, labels, list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+            self._published_at = 0
+
+
+registry = Registry()
+
+
+def _process_key():
+    return f"metrics:process:{socket.gethostname()}:{os.getpid()}"
+
+
+def _record_gauges():
+    from .decision_log import stats
+
+    decision_log = stats()
+    registry.set('loans_decision_log_buffer_depth', (), decision_log['depth'])
+    registry.set('loans_decision_log_dropped_total', (), decision_log['dropped'])
+
+
+def warn_if_process_local():
+    """Warn when the cache is per process, /metrics then only shows the process serving the scrape"""
+    if not settings.DEBUG and isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        logger.warning(
+            "Metrics are published to LocMemCache, /metrics only reports the process that serves it; "
+            "set REDIS_URL to add up every web and worker process"
+        )
+
+
+@lru_cache(maxsize=None)
+def _redis_client(url):
+    """One client, with its own connection pool, per Redis URL"""
+    return redis.Redis.from_url(url)
+
+
+def _redis_index():
+    """Redis client and index key when the cache is Redis, else (None, None)"""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, RedisCache):
+        return None, None
+    location = settings.CACHES[DEFAULT_CACHE_ALIAS]['LOCATION']
+    if isinstance(location, str):
+        location = location.split(',')
+    # RedisCache writes to its first server, so that is where the index lives
+    return _redis_client(location[0]), backend.make_and_validate_key(INDEX_KEY)
+
+
+def _edit_index(edit):
+    """Replace the index list with edit(list) under a lock, skipped while another process holds it"""
+    if not cache.add(INDEX_LOCK_KEY, 1, timeout=5):
+        return
+    try:
+        cache.set(INDEX_KEY, edit(cache.get(INDEX_KEY) or []), timeout=None)
+    finally:
+        cache.delete(INDEX_LOCK_KEY)
+
+
+def publish():
+    """Store this process's snapshot in the cache and make sure the index lists it"""
+    _, ttl = _publish_settings()
+    _record_gauges()
+    key = _process_key()
+    cache.set(key, registry.snapshot(), timeout=ttl)
+    registry._published_at = time.monotonic()
+    client, index = _redis_index()
+    if client is not None:
+        client.sadd(index, key)
+    elif key not in (cache.get(INDEX_KEY) or []):
+        # Checked again on the next publish if another process holds the lock
+        _edit_index(lambda processes: processes if key in processes else processes + [key])
+
+
+def publish_if_due(**kwargs):
+    """Publish at most once per METRICS_PUBLISH_INTERVAL, usable as a signal receiver"""
+    interval, _ = _publish_settings()
+    if time.monotonic() - registry._published_at >= interval:
+        try:
+            publish()
+        except Exception as e:
+            logger.warning(f"Could not publish metrics: {str(e)}")
+
+
+def collect():
+    """Sum the snapshots of every live process into {(name, labels): value}"""
+    client, index = _redis_index()
+    if client is not None:
+        processes = [key.decode() for key in client.smembers(index)]
+    else:
+        processes = cache.get(INDEX_KEY) or []
+    snapshots = cache.get_many(processes)
+    # A process dropped here while it publishes again adds itself back on its next publish
+    gone = [key for key in processes if key not in snapshots]
+    if gone and client is not None:
+        client.srem(index, *gone)
+    elif gone:
+        _edit_index(lambda current: [key for key in current if key not in gone])
+    totals = {}
+    for snapshot in snapshots.values():
+        for name, labels, value in snapshot:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            current = totals.get(key)
+            if current is None:
+                totals[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                totals[key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = current + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals):
+    """Prometheus text exposition of ``collect()`` output"""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def observe_request(view, method, status_code, seconds, queries, db_seconds, size):
+    labels = (('view', view),)
+    registry.inc('loans_http_requests_total', labels + (('method', method), ('status', str(status_code))))
+    registry.observe('loans_http_request_duration_seconds', labels, seconds)
+    registry.observe('loans_http_request_queries', labels, queries)
+    registry.observe('loans_http_request_db_seconds', labels, db_seconds)
+    if size is not None:
+        registry.observe('loans_http_response_size_bytes', labels, size)
+
+
+class QueryTimer:
+    """Counts and times statements through a database execute wrapper"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+_task_started = {}
+
+
+def _task_prerun(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    name = getattr(task, 'name', 'unknown')
+    registry.inc('loans_celery_tasks_total', (('state', state or 'UNKNOWN'), ('task', name)))
+    if started is not None:
+        registry.observe('loans_celery_task_duration_seconds', (('task', name),), time.perf_counter() - started)
+    publish_if_due()
+
+
+task_prerun.connect(_task_prerun, dispatch_uid='loans_metrics')
+task_postrun.connect(_task_postrun, dispatch_uid='loans_metrics')
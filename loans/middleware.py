@@ -0,0 +1,134 @@
+from collections import Counter
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _add_execute_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def _remove_execute_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, query count, DB time and response size per URL name
+
+    Listed first in MIDDLEWARE so the timings cover the whole stack. Queries
+    run while a streaming response is being sent are not counted.
+
+    Runs natively in both modes so ASGI requests reach the async views
+    without being adapted to sync. Async views run their queries in the
+    request's sync_to_async thread, so that is where the query timer goes.
+    Recording may publish to the cache, so it runs off the event loop too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = metrics.QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = metrics.QueryTimer()
+        started = time.perf_counter()
+        await sync_to_async(_add_execute_wrapper)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_execute_wrapper)(timer)
+        await sync_to_async(self.observe)(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def observe(self, request, response, elapsed, timer):
+        match = getattr(request, 'resolver_match', None)
+        # Unresolved paths share one label so scanners cannot blow up the series count
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        metrics.observe_request(
+            view, request.method, response.status_code, elapsed, timer.count, timer.seconds, size
+        )
+        metrics.publish_if_due()
+
+
+class RepeatedQueryRecorder:
+    """Counts statements by their SQL before parameters are bound, through a database execute wrapper"""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.counts[sql] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """(sql, count) of every statement run at least ``threshold`` times, most frequent first"""
+        return [(sql, count) for sql, count in self.counts.most_common() if count >= threshold]
+
+
+class NPlusOneDetectorMiddleware:
+    """
+    Log statements that one request runs over and over with different parameters
+
+    The usual sign of an N+1: a query per row of an earlier result instead of
+    one join or IN lookup. Off unless N_PLUS_ONE_DETECTOR is set, meant for
+    staging; a statement is reported once it runs N_PLUS_ONE_THRESHOLD times.
+    Async capable like MetricsMiddleware, with the recorder on the
+    request's sync_to_async thread under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'N_PLUS_ONE_DETECTOR', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'N_PLUS_ONE_THRESHOLD', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = RepeatedQueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.report(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = RepeatedQueryRecorder()
+        await sync_to_async(_add_execute_wrapper)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_execute_wrapper)(recorder)
+        self.report(request, recorder)
+        return response
+
+    def report(self, request, recorder):
+        for sql, count in recorder.repeated(self.threshold):
+            logger.warning(f"Possible N+1 in {request.method} {request.path}: {count} runs of {sql}")
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('file_signature', models.CharField(max_length=64)),
+                ('rows_committed', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'ingestion_checkpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestionFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('customer', 'Customer'), ('loan', 'Loan')], max_length=20)),
+                ('record_id', models.IntegerField()),
+                ('digest', models.CharField(max_length=32)),
+            ],
+            options={
+                'db_table': 'ingestion_fingerprints',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ingestionfingerprint',
+            constraint=models.UniqueConstraint(fields=('kind', 'record_id'), name='unique_fingerprint_per_record'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0002_ingestion_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCreditProfile',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='credit_profile', serialize=False, to='loans.customer')),
+                ('active_loan_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('active_emi_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('loan_count', models.IntegerField(default=0)),
+                ('on_time_count', models.IntegerField(default=0)),
+                ('loans_per_year', models.JSONField(default=dict, help_text='Loan count keyed by start year')),
+                ('approved_volume', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'customer_credit_profiles',
+            },
+        ),
+    ]
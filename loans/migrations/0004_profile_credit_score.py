@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_customer_credit_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='credit_score',
+            field=models.IntegerField(blank=True, help_text='Score from the last batch rescore', null=True),
+        ),
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
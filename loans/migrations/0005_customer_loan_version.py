@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0004_profile_credit_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='loan_version',
+            field=models.PositiveIntegerField(default=0, help_text="Bumped whenever the customer's loans are written"),
+        ),
+    ]
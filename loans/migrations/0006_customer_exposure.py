@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:35
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_exposures(apps, schema_editor):
+    Customer = apps.get_model('loans', 'Customer')
+    Loan = apps.get_model('loans', 'Loan')
+
+    def open_loan_sum(field):
+        total = (
+            Loan.objects.filter(customer_id=OuterRef('pk'), end_date__isnull=True)
+            .values('customer_id').annotate(total=Sum(field)).values('total')
+        )
+        return Coalesce(Subquery(total), Value(Decimal('0')), output_field=DecimalField())
+
+    Customer.objects.update(
+        current_debt=open_loan_sum('loan_amount'),
+        active_emi_total=open_loan_sum('monthly_repayment'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0005_customer_loan_version'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customercreditprofile',
+            name='active_emi_total',
+        ),
+        migrations.RemoveField(
+            model_name='customercreditprofile',
+            name='active_loan_amount',
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='active_emi_total',
+            field=models.DecimalField(decimal_places=2, default=0, help_text="Monthly repayments due on the customer's open loans", max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='current_debt',
+            field=models.DecimalField(decimal_places=2, default=0, help_text="Total amount of the customer's open loans", max_digits=14),
+        ),
+        migrations.RunPython(fill_exposures, migrations.RunPython.noop),
+    ]
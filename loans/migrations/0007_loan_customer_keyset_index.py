@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0006_customer_exposure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['customer', 'loan_id'], name='loans_customer_loan_id_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0007_loan_customer_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
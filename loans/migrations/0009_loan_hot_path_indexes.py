@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0008_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('end_date__isnull', True)), fields=['customer'], name='loans_customer_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['customer', 'start_date'], name='loans_customer_start_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['start_date'], name='loans_start_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['end_date'], name='loans_end_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['interest_rate'], name='loans_interest_rate_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0009_loan_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DecisionLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ELIGIBILITY', 'Eligibility check'), ('LOAN', 'Loan application')], max_length=20)),
+                ('customer_id', models.IntegerField(db_index=True, help_text='Plain id so the trail outlives the customer')),
+                ('loan_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('interest_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('tenure', models.IntegerField()),
+                ('credit_score', models.IntegerField()),
+                ('approval', models.BooleanField()),
+                ('corrected_interest_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('monthly_installment', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('message', models.TextField(blank=True, help_text='Rejection reason, empty when approved')),
+                ('loan_id', models.IntegerField(blank=True, help_text='Loan created by an approved application', null=True)),
+                ('decided_at', models.DateTimeField(help_text='When the decision was made, not when it was flushed')),
+            ],
+            options={
+                'db_table': 'decision_logs',
+            },
+        ),
+    ]
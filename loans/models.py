@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models.lookups import GreaterThanOrEqual
 from django.core.validators import MinValueValidator, MaxValueValidator
+from datetime import datetime
 from decimal import Decimal
 
 
@@ -11,8 +13,15 @@ class Customer(models.Model):
     phone_number = models.CharField(max_length=15, unique=True)
     monthly_salary = models.DecimalField(max_digits=12, decimal_places=2)
     approved_limit = models.DecimalField(max_digits=12, decimal_places=2)
-    current_debt = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    current_debt = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, help_text="Total amount of the customer's open loans"
+    )
+    active_emi_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, help_text="Monthly repayments due on the customer's open loans"
+    )
+    loan_version = models.PositiveIntegerField(default=0, help_text="Bumped whenever the customer's loans are written")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'customers'
@@ -24,63 +33,88 @@ class Customer(models.Model):
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
     
+    def loan_summary(self, year=None):
+        """Aggregate the credit score inputs and the open EMI total in one query"""
+        if year is None:
+            year = datetime.now().year
+        stats = self.loans.aggregate(
+            total_loans=models.Count('pk'),
+            total_current_amount=models.Sum('loan_amount', filter=models.Q(end_date__isnull=True)),
+            active_emi_total=models.Sum('monthly_repayment', filter=models.Q(end_date__isnull=True)),
+            # emis_paid_on_time >= 90% of tenure, in integers so every backend agrees
+            loans_paid_on_time=models.Count('pk', filter=GreaterThanOrEqual(
+                models.F('emis_paid_on_time') * 10, models.F('tenure') * 9
+            )),
+            current_year_loans=models.Count('pk', filter=models.Q(start_date__year=year)),
+            total_approved_volume=models.Sum('loan_amount'),
+        )
+        stats['total_current_amount'] = stats['total_current_amount'] or Decimal('0')
+        stats['total_approved_volume'] = stats['total_approved_volume'] or Decimal('0')
+        stats['active_emi_total'] = stats['active_emi_total'] or Decimal('0')
+        return stats
+    
+    def credit_score_inputs(self, year=None):
+        """Aggregate every credit score input from the loans table in one query"""
+        stats = self.loan_summary(year)
+        del stats['active_emi_total']
+        return stats
+    
     def calculate_credit_score(self):
         """Calculate credit score based on loan history"""
-        loans = self.loans.all()
-        
-        if not loans.exists():
-            return 50  # Default score for new customers
-        
-        # Check if sum of current loans > approved limit
-        current_loans = loans.filter(end_date__isnull=True)
-        total_current_amount = sum(loan.loan_amount for loan in current_loans)
-        
-        if total_current_amount > self.approved_limit:
-            return 0
-        
-        # Calculate components
-        total_loans = loans.count()
-        loans_paid_on_time = sum(1 for loan in loans if loan.emis_paid_on_time >= loan.tenure * 0.9)
-        
-        # Current year activity
-        from datetime import datetime
-        current_year_loans = loans.filter(start_date__year=datetime.now().year).count()
-        
-        # Approved volume (total loan amount)
-        total_approved_volume = sum(loan.loan_amount for loan in loans)
-        
-        # Calculate score (simplified algorithm)
-        score = 0
-        
-        # Past loans paid on time (40% weight)
-        if total_loans > 0:
-            score += (loans_paid_on_time / total_loans) * 40
-        
-        # Number of loans factor (20% weight)
-        if total_loans <= 2:
-            score += 20
-        elif total_loans <= 5:
-            score += 15
-        else:
-            score += 10
-        
-        # Current year activity (20% weight)
-        if current_year_loans <= 2:
-            score += 20
-        elif current_year_loans <= 4:
-            score += 15
-        else:
-            score += 10
-        
-        # Approved volume factor (20% weight)
-        if total_approved_volume <= self.approved_limit * Decimal('0.5'):
-            score += 20
-        elif total_approved_volume <= self.approved_limit * Decimal('0.8'):
-            score += 15
-        else:
-            score += 10
-        
-        return min(100, max(0, int(score)))
+        try:
+            inputs = self.credit_profile.credit_score_inputs()
+        except CustomerCreditProfile.DoesNotExist:
+            inputs = self.credit_score_inputs()
+        return compute_credit_score(self.approved_limit, **inputs)
+    
+    def add_exposure(self, loan):
+        """Count a new open loan in the in-memory exposure columns"""
+        if loan.end_date is None:
+            self.current_debt += Decimal(loan.loan_amount)
+            self.active_emi_total += Decimal(loan.monthly_repayment)
+
+
+def compute_credit_score(approved_limit, total_loans, total_current_amount, loans_paid_on_time,
+                         current_year_loans, total_approved_volume):
+    """Score a customer from their aggregated loan history"""
+    if not total_loans:
+        return 50  # Default score for new customers
+    
+    # Check if sum of current loans > approved limit
+    if total_current_amount > approved_limit:
+        return 0
+    
+    # Calculate score (simplified algorithm)
+    score = 0
+    
+    # Past loans paid on time (40% weight)
+    score += (loans_paid_on_time / total_loans) * 40
+    
+    # Number of loans factor (20% weight)
+    if total_loans <= 2:
+        score += 20
+    elif total_loans <= 5:
+        score += 15
+    else:
+        score += 10
+    
+    # Current year activity (20% weight)
+    if current_year_loans <= 2:
+        score += 20
+    elif current_year_loans <= 4:
+        score += 15
+    else:
+        score += 10
+    
+    # Approved volume factor (20% weight)
+    if total_approved_volume <= approved_limit * Decimal('0.5'):
+        score += 20
+    elif total_approved_volume <= approved_limit * Decimal('0.8'):
+        score += 15
+    else:
+        score += 10
+    
+    return min(100, max(0, int(score)))
 
 
 class Loan(models.Model):
@@ -94,12 +128,30 @@ class Loan(models.Model):
     start_date = models.DateField()
     end_date = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'loans'
+        indexes = [
+            # Keyset pagination of a customer's loans seeks on this
+            models.Index(fields=['customer', 'loan_id'], name='loans_customer_loan_id_idx'),
+            # Open loans of a customer: exposure sums and ?status=active
+            models.Index(
+                fields=['customer'], condition=models.Q(end_date__isnull=True), name='loans_customer_open_idx'
+            ),
+            # A customer's loans started in a given year, as a start_date range
+            models.Index(fields=['customer', 'start_date'], name='loans_customer_start_date_idx'),
+            # Admin list filters
+            models.Index(fields=['start_date'], name='loans_start_date_idx'),
+            models.Index(fields=['end_date'], name='loans_end_date_idx'),
+            models.Index(fields=['interest_rate'], name='loans_interest_rate_idx'),
+        ]
     
     def __str__(self):
-        return f"Loan {self.loan_id} - {self.customer.full_name}"
+        # Only name the customer when already loaded, listing loans must not cost a query per row
+        if Loan.customer.is_cached(self):
+            return f"Loan {self.loan_id} - {self.customer.full_name}"
+        return f"Loan {self.loan_id} - customer {self.customer_id}"
     
     @property
     def repayments_left(self):
@@ -125,6 +177,59 @@ class Loan(models.Model):
         return round(emi, 2)
 
 
+class CustomerCreditProfile(models.Model):
+    """
+    Per-customer credit score inputs, maintained as loans are written
+
+    Lets scoring read one row instead of aggregating the customer's loans;
+    the open loan amount and EMI total live on the customer itself. See
+    loans/profiles.py for how rows are kept current.
+    """
+    customer = models.OneToOneField(
+        Customer, primary_key=True, on_delete=models.CASCADE, related_name='credit_profile'
+    )
+    loan_count = models.IntegerField(default=0)
+    on_time_count = models.IntegerField(default=0)
+    loans_per_year = models.JSONField(default=dict, help_text="Loan count keyed by start year")
+    approved_volume = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    credit_score = models.IntegerField(null=True, blank=True, help_text="Score from the last batch rescore")
+    scored_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'customer_credit_profiles'
+    
+    def __str__(self):
+        return f"Credit profile {self.customer_id}"
+    
+    def loan_summary(self, year=None):
+        """Same as Customer.loan_summary, read from the stored row and the customer's counters"""
+        summary = self.credit_score_inputs(year)
+        summary['active_emi_total'] = self.customer.active_emi_total
+        return summary
+    
+    def credit_score_inputs(self, year=None):
+        """Same inputs as Customer.credit_score_inputs, read from the stored row"""
+        if year is None:
+            year = datetime.now().year
+        return {
+            'total_loans': self.loan_count,
+            'total_current_amount': self.customer.current_debt,
+            'loans_paid_on_time': self.on_time_count,
+            'current_year_loans': self.loans_per_year.get(str(year), 0),
+            'total_approved_volume': self.approved_volume,
+        }
+    
+    def add_loan(self, loan):
+        """Account for a newly created loan, the customer's exposure is kept separately"""
+        self.loan_count += 1
+        if loan.emis_paid_on_time * 10 >= loan.tenure * 9:
+            self.on_time_count += 1
+        year = str(loan.start_date.year)
+        self.loans_per_year[year] = self.loans_per_year.get(year, 0) + 1
+        self.approved_volume += Decimal(loan.loan_amount)
+
+
 class LoanApplication(models.Model):
     """Model to track loan applications"""
     PENDING = 'PENDING'
@@ -150,4 +255,74 @@ class LoanApplication(models.Model):
         db_table = 'loan_applications'
     
     def __str__(self):
-        return f"Application {self.id} - {self.customer.full_name}"
+        if LoanApplication.customer.is_cached(self):
+            return f"Application {self.id} - {self.customer.full_name}"
+        return f"Application {self.id} - customer {self.customer_id}"
+
+
+class DecisionLog(models.Model):
+    """Audit record of one eligibility or loan decision, written in batches by loans.decision_log"""
+    ELIGIBILITY = 'ELIGIBILITY'
+    LOAN = 'LOAN'
+    
+    KIND_CHOICES = [
+        (ELIGIBILITY, 'Eligibility check'),
+        (LOAN, 'Loan application'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    customer_id = models.IntegerField(db_index=True, help_text="Plain id so the trail outlives the customer")
+    loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    interest_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    tenure = models.IntegerField()
+    credit_score = models.IntegerField()
+    approval = models.BooleanField()
+    corrected_interest_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    monthly_installment = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    message = models.TextField(blank=True, help_text="Rejection reason, empty when approved")
+    loan_id = models.IntegerField(null=True, blank=True, help_text="Loan created by an approved application")
+    decided_at = models.DateTimeField(help_text="When the decision was made, not when it was flushed")
+    
+    class Meta:
+        db_table = 'decision_logs'
+    
+    def __str__(self):
+        return f"{self.kind} decision for customer {self.customer_id} at {self.decided_at}"
+
+
+class IngestionFingerprint(models.Model):
+    """Content hash of a source row as of the last committed delta load"""
+    CUSTOMER = 'customer'
+    LOAN = 'loan'
+    
+    KIND_CHOICES = [
+        (CUSTOMER, 'Customer'),
+        (LOAN, 'Loan'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    record_id = models.IntegerField()
+    digest = models.CharField(max_length=32)
+    
+    class Meta:
+        db_table = 'ingestion_fingerprints'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'record_id'], name='unique_fingerprint_per_record'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.record_id}"
+
+
+class IngestionCheckpoint(models.Model):
+    """Progress of an in-flight delta load, used to resume after a crash"""
+    source = models.CharField(max_length=255, unique=True)
+    file_signature = models.CharField(max_length=64)
+    rows_committed = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'ingestion_checkpoints'
+    
+    def __str__(self):
+        return f"{self.source} @ {self.rows_committed}"
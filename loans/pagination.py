@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class LoanCursorPagination(CursorPagination):
+    """
+    Keyset pagination of a customer's loans by loan_id
+
+    Each page seeks past the last loan_id of the previous one instead of
+    using OFFSET, so deep pages cost the same as the first. The next and
+    previous page URLs go in the Link header, keeping the body the plain
+    list the endpoint has always returned.
+    """
+    ordering = 'loan_id'
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def get_link_header(self):
+        links = [
+            f'<{url}>; rel="{rel}"'
+            for rel, url in (('next', self.get_next_link()), ('prev', self.get_previous_link()))
+            if url
+        ]
+        return ', '.join(links)
+
+    def get_paginated_response(self, data):
+        link = self.get_link_header()
+        return Response(data, headers={'Link': link} if link else None)
@@ -0,0 +1,230 @@
+"""
+Maintenance of CustomerCreditProfile rows.
+
+Loans created through the API update their customer's profile in place;
+bulk writes (ingestion) recompute the profiles of the customers they touched
+with a couple of grouped queries. ``rebuild_credit_profiles`` recomputes or
+checks every row.
+
+Every path that writes loans goes through here, so this is also where each
+touched customer's ``loan_version`` is bumped, which retires their cached
+credit score, and where the customer's ``current_debt`` and
+``active_emi_total`` exposure columns are moved: with ``F()`` increments for
+single loans, with one recomputing UPDATE for bulk writes.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, ExtractYear
+from django.utils import timezone
+from django.db.models.lookups import GreaterThanOrEqual
+
+from .models import Customer, CustomerCreditProfile, Loan
+from .utils import chunked
+
+PROFILE_FIELDS = ['loan_count', 'on_time_count', 'loans_per_year', 'approved_volume']
+EXPOSURE_FIELDS = ['current_debt', 'active_emi_total']
+OPEN_LOANS = Q(end_date__isnull=True)
+# Customers recomputed per grouped query when refreshing many profiles
+REFRESH_CHUNK_SIZE = 1000
+
+
+def compute_profiles(customer_ids, customers=None):
+    """
+    Build unsaved profiles for ``customer_ids`` from the loans table
+
+    When ``customers`` maps ids to loaded Customer objects, each profile is
+    attached to its customer and the customer's in-memory exposure columns
+    are recomputed by the same query, so the profile reads as if maintained.
+    """
+    profiles = {customer_id: CustomerCreditProfile(customer_id=customer_id) for customer_id in customer_ids}
+    if customers is not None:
+        for customer_id, profile in profiles.items():
+            customer = customers[customer_id]
+            customer.current_debt = customer.active_emi_total = Decimal('0')
+            profile.customer = customer
+    loans = Loan.objects.filter(customer_id__in=list(profiles))
+    totals = loans.values('customer_id').annotate(
+        loan_count=Count('pk'),
+        on_time_count=Count('pk', filter=GreaterThanOrEqual(F('emis_paid_on_time') * 10, F('tenure') * 9)),
+        approved_volume=Sum('loan_amount'),
+        current_debt=Sum('loan_amount', filter=OPEN_LOANS),
+        active_emi_total=Sum('monthly_repayment', filter=OPEN_LOANS),
+    )
+    for row in totals:
+        profile = profiles[row.pop('customer_id')]
+        for field in EXPOSURE_FIELDS:
+            value = row.pop(field)
+            if customers is not None:
+                setattr(profile.customer, field, value if value is not None else Decimal('0'))
+        for field, value in row.items():
+            setattr(profile, field, value if value is not None else Decimal('0'))
+    years = loans.values('customer_id', year=ExtractYear('start_date')).annotate(count=Count('pk'))
+    for row in years:
+        profiles[row['customer_id']].loans_per_year[str(row['year'])] = row['count']
+    return list(profiles.values())
+
+
+def compute_exposures(customer_ids):
+    """Map each of ``customer_ids`` to (current_debt, active_emi_total) from the loans table"""
+    exposures = {customer_id: (Decimal('0'), Decimal('0')) for customer_id in customer_ids}
+    totals = Loan.objects.filter(customer_id__in=list(exposures), end_date__isnull=True).values('customer_id').annotate(
+        current_debt=Sum('loan_amount'), active_emi_total=Sum('monthly_repayment'),
+    )
+    for row in totals:
+        exposures[row['customer_id']] = (row['current_debt'], row['active_emi_total'])
+    return exposures
+
+
+def _open_loan_sum(field):
+    total = Loan.objects.filter(OPEN_LOANS, customer_id=OuterRef('pk')).values('customer_id').annotate(total=Sum(field))
+    return Coalesce(Subquery(total.values('total')), Value(Decimal('0')), output_field=DecimalField())
+
+
+def bump_loan_versions(customer_ids):
+    Customer.objects.filter(customer_id__in=list(customer_ids)).update(loan_version=F('loan_version') + 1)
+
+
+def reset_exposures(customer_ids, bump_versions=True):
+    """Recompute the exposure columns of ``customer_ids`` in one set-based UPDATE"""
+    updates = {
+        'current_debt': _open_loan_sum('loan_amount'),
+        'active_emi_total': _open_loan_sum('monthly_repayment'),
+    }
+    if bump_versions:
+        updates['loan_version'] = F('loan_version') + 1
+    return Customer.objects.filter(customer_id__in=list(customer_ids)).update(**updates)
+
+
+def lock_customers(customer_ids, *fields):
+    """
+    Lock the customer rows of ``customer_ids`` in primary key order until the transaction ends
+
+    Returns their ``values_list('customer_id', *fields)`` rows. Recomputing
+    writers take this lock before reading loans: a loan recorded meanwhile
+    holds the row through its ``loan_version`` bump, so either it commits
+    first and is read, or its ``F()`` increments wait and land on the
+    recomputed values.
+    """
+    queryset = Customer.objects.select_for_update().filter(customer_id__in=list(customer_ids)).order_by('customer_id')
+    return list(queryset.values_list('customer_id', *fields))
+
+
+def _store_profiles(ids, bump_versions):
+    reset_exposures(ids, bump_versions)
+    CustomerCreditProfile.objects.bulk_create(
+        compute_profiles(ids),
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=PROFILE_FIELDS + ['updated_at'],
+    )
+
+
+def refresh_profiles(customer_ids, bump_versions=True, lock=True):
+    """
+    Recompute and store the profiles and exposure columns of ``customer_ids``
+
+    Each chunk's customer rows are locked while it is read and written; pass
+    ``lock=False`` when the caller already holds them.
+    """
+    for ids in chunked(sorted(set(customer_ids)), REFRESH_CHUNK_SIZE):
+        if not lock:
+            _store_profiles(ids, bump_versions)
+            continue
+        with transaction.atomic():
+            lock_customers(ids)
+            _store_profiles(ids, bump_versions)
+
+
+def refresh_all_profiles():
+    """Recompute every customer's profile, chunk by chunk"""
+    customer_ids = Customer.objects.order_by('customer_id').values_list('customer_id', flat=True)
+    refreshed = 0
+    for ids in chunked(customer_ids.iterator(chunk_size=REFRESH_CHUNK_SIZE), REFRESH_CHUNK_SIZE):
+        with transaction.atomic():
+            refresh_profiles(ids)
+        refreshed += len(ids)
+    return refreshed
+
+
+def record_new_loan(loan, bump_version=True):
+    """
+    Add a freshly created loan to its customer's profile
+
+    Pass ``bump_version=False`` when the caller already bumped the
+    customer's ``loan_version`` in the same transaction. Either way the
+    customer row is locked before the profile row.
+    """
+    with transaction.atomic():
+        if bump_version:
+            # Customer row before profile row, the order every other writer locks them in
+            bump_loan_versions([loan.customer_id])
+        profile = CustomerCreditProfile.objects.select_for_update().filter(customer_id=loan.customer_id).first()
+        if profile is None:
+            # First profile for this customer, the aggregate already includes the loan
+            refresh_profiles([loan.customer_id], bump_versions=False, lock=False)
+            return
+        profile.add_loan(loan)
+        profile.save()
+        if loan.end_date is None:
+            Customer.objects.filter(pk=loan.customer_id).update(
+                current_debt=F('current_debt') + loan.loan_amount,
+                active_emi_total=F('active_emi_total') + loan.monthly_repayment,
+            )
+
+
+def close_loan(loan, end_date=None):
+    """
+    Close an open loan and take it off its customer's exposure
+
+    Returns False if the loan was already closed.
+    """
+    end_date = end_date or datetime.now().date()
+    with transaction.atomic():
+        closed = Loan.objects.filter(pk=loan.pk, end_date__isnull=True).update(
+            end_date=end_date, updated_at=timezone.now()
+        )
+        if not closed:
+            return False
+        Customer.objects.filter(pk=loan.customer_id).update(
+            current_debt=F('current_debt') - loan.loan_amount,
+            active_emi_total=F('active_emi_total') - loan.monthly_repayment,
+            loan_version=F('loan_version') + 1,
+        )
+    loan.end_date = end_date
+    return True
+
+
+def find_drift():
+    """Yield (customer_id, field, stored, expected) for every stale profile or exposure value"""
+    customers = Customer.objects.order_by('customer_id').only('customer_id', *EXPOSURE_FIELDS)
+    for chunk in chunked(customers.iterator(chunk_size=REFRESH_CHUNK_SIZE), REFRESH_CHUNK_SIZE):
+        stored = {customer.pk: customer for customer in chunk}
+        profiles = CustomerCreditProfile.objects.in_bulk(list(stored))
+        expected_customers = {customer.pk: Customer(customer_id=customer.pk) for customer in chunk}
+        for expected in compute_profiles(list(stored), expected_customers):
+            current = profiles.get(expected.customer_id)
+            if current is None:
+                # No profile yet, readers aggregate the loans table instead
+                continue
+            for field in PROFILE_FIELDS:
+                if getattr(current, field) != getattr(expected, field):
+                    yield expected.customer_id, field, getattr(current, field), getattr(expected, field)
+            for field in EXPOSURE_FIELDS:
+                stored_value = getattr(stored[expected.customer_id], field)
+                expected_value = getattr(expected.customer, field)
+                if stored_value != expected_value:
+                    yield expected.customer_id, field, stored_value, expected_value
+
+
+def find_exposure_drift():
+    """Yield (customer_id, field, stored, expected) for every stale exposure column"""
+    customers = Customer.objects.order_by('customer_id').values_list('customer_id', *EXPOSURE_FIELDS)
+    for chunk in chunked(customers.iterator(chunk_size=REFRESH_CHUNK_SIZE), REFRESH_CHUNK_SIZE):
+        expected = compute_exposures([row[0] for row in chunk])
+        for customer_id, *stored in chunk:
+            for field, current, correct in zip(EXPOSURE_FIELDS, stored, expected[customer_id]):
+                if current != correct:
+                    yield customer_id, field, current, correct
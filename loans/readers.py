@@ -0,0 +1,198 @@
+"""
+Streaming readers for the ingestion source files.
+
+Each reader yields lists of row dicts keyed by the header names, at most
+``chunk_size`` rows at a time, so memory use is bounded by the chunk size
+instead of the size of the file.
+
+Readers can also be restricted to a ``[start, stop)`` range of data rows
+(0-based, header excluded), which is how sharded ingestion splits a file.
+Getting to ``start`` costs differently per format: delimited files seek
+straight to a byte position found by ``row_offsets``, parquet files skip
+whole row groups from the footer, but xlsx has no index, so every shard of
+a workbook parses it from the top and the last one reads all of it. Convert
+large workbooks to csv or parquet before sharding them.
+"""
+from itertools import islice
+from pathlib import Path
+
+import pandas as pd
+
+FORMATS = ('xlsx', 'csv', 'tsv', 'parquet')
+
+EXTENSIONS = {
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.txt': 'tsv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+
+def detect_format(path, fmt=None):
+    """Return the reader format for ``path``, an explicit ``fmt`` always wins"""
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+        return fmt
+    suffix = Path(path).suffix.lower()
+    if suffix not in EXTENSIONS:
+        raise ValueError(f"Cannot detect format of '{path}', pass one of {', '.join(FORMATS)}")
+    return EXTENSIONS[suffix]
+
+
+def _read_xlsx(path, chunk_size, start, stop):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        rows = islice(rows, start, stop)
+        while True:
+            values_chunk = list(islice(rows, chunk_size))
+            if not values_chunk:
+                return
+            # Formatted but empty trailing rows come back as all-None tuples
+            chunk = [
+                dict(zip(header, values)) for values in values_chunk
+                if any(value is not None for value in values)
+            ]
+            if chunk:
+                yield chunk
+    finally:
+        workbook.close()
+
+
+def _read_delimited(path, chunk_size, sep, start, stop, seek=None):
+    nrows = None if stop is None else max(0, stop - start)
+    if nrows == 0:
+        return
+    if seek is None:
+        skiprows = range(1, start + 1) if start else None
+        with pd.read_csv(path, sep=sep, chunksize=chunk_size, skiprows=skiprows, nrows=nrows) as reader:
+            for frame in reader:
+                yield frame.to_dict('records')
+        return
+    row, position = seek
+    names = list(pd.read_csv(path, sep=sep, nrows=0).columns)
+    with open(path, 'rb') as handle:
+        handle.seek(position)
+        reader = pd.read_csv(
+            handle, sep=sep, chunksize=chunk_size, header=None, names=names,
+            skiprows=start - row or None, nrows=nrows,
+        )
+        with reader:
+            for frame in reader:
+                yield frame.to_dict('records')
+
+
+def _parquet_file(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading parquet files requires pyarrow (pip install pyarrow)")
+    return pq.ParquetFile(path)
+
+
+def _read_parquet(path, chunk_size, start, stop):
+    parquet_file = _parquet_file(path)
+    # Row groups wholly outside the range are skipped without being decoded
+    row_groups = []
+    offset = first_row = 0
+    for index in range(parquet_file.metadata.num_row_groups):
+        group_start, offset = offset, offset + parquet_file.metadata.row_group(index).num_rows
+        if offset <= start:
+            continue
+        if stop is not None and group_start >= stop:
+            break
+        if not row_groups:
+            first_row = group_start
+        row_groups.append(index)
+    if not row_groups:
+        return
+    offset = first_row
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups):
+        batch_start, offset = offset, offset + batch.num_rows
+        if offset <= start:
+            continue
+        if stop is not None and batch_start >= stop:
+            return
+        lower = max(start - batch_start, 0)
+        upper = batch.num_rows if stop is None else min(stop - batch_start, batch.num_rows)
+        yield batch.slice(lower, upper - lower).to_pylist()
+
+
+def read_rows(path, fmt=None, chunk_size=1000, start=0, stop=None, seek=None):
+    """
+    Stream ``path`` as lists of row dicts, picking the reader by format or extension
+
+    ``seek`` is a ``(row, position)`` pair from ``row_offsets`` for a row at
+    or before ``start``; delimited files jump to it instead of reading the
+    rows ahead of it. Other formats ignore it.
+    """
+    fmt = detect_format(path, fmt)
+    if fmt == 'xlsx':
+        return _read_xlsx(path, chunk_size, start, stop)
+    if fmt == 'csv':
+        return _read_delimited(path, chunk_size, ',', start, stop, seek)
+    if fmt == 'tsv':
+        return _read_delimited(path, chunk_size, '\t', start, stop, seek)
+    return _read_parquet(path, chunk_size, start, stop)
+
+
+def row_offsets(path, rows, fmt=None):
+    """
+    Map each data row number in ``rows`` to the byte position its line starts at
+
+    One pass over the raw lines of a delimited file, without parsing them.
+    Returns an empty dict for formats that cannot be entered mid-file.
+    """
+    if detect_format(path, fmt) not in ('csv', 'tsv'):
+        return {}
+    wanted = set(rows)
+    offsets = {}
+    with open(path, 'rb') as handle:
+        position = len(handle.readline())
+        for row, line in enumerate(handle):
+            if row in wanted:
+                offsets[row] = position
+            position += len(line)
+    return offsets
+
+
+def read_column(path, column, fmt=None):
+    """Every value of one column as a pandas Series, in row order, parsing no other column"""
+    fmt = detect_format(path, fmt)
+    if fmt == 'parquet':
+        return _parquet_file(path).read(columns=[column]).column(column).to_pandas()
+    if fmt == 'xlsx':
+        return pd.read_excel(path, usecols=[column])[column]
+    return pd.read_csv(path, sep=',' if fmt == 'csv' else '\t', usecols=[column])[column]
+
+
+def count_rows(path, fmt=None):
+    """Return the number of data rows in ``path`` without materialising them"""
+    fmt = detect_format(path, fmt)
+    if fmt == 'parquet':
+        return _parquet_file(path).metadata.num_rows
+    if fmt == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return sum(1 for _ in workbook.active.iter_rows(min_row=2, values_only=True))
+        finally:
+            workbook.close()
+    with open(path, 'rb') as handle:
+        lines = sum(chunk.count(b'\n') for chunk in iter(lambda: handle.read(1 << 20), b''))
+        if handle.tell() == 0:
+            return 0
+        handle.seek(-1, 2)
+        if handle.read(1) != b'\n':
+            lines += 1
+    return max(0, lines - 1)
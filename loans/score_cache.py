@@ -0,0 +1,99 @@
+"""
+Cached credit scores.
+
+Entries are keyed by customer, ``loan_version``, approved limit and year, so
+any loan write (which bumps ``loan_version``) or limit change simply moves the
+customer to a new key. Within a key, an entry is fresh for
+``CREDIT_SCORE_CACHE_TTL`` seconds; after that it is still served for up to
+``CREDIT_SCORE_CACHE_STALE_TTL`` more seconds while a Celery task recomputes
+it in the background.
+"""
+from datetime import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STATS_KEYS = {
+    'hits': 'credit_score_cache:hits',
+    'stale_hits': 'credit_score_cache:stale_hits',
+    'misses': 'credit_score_cache:misses',
+}
+
+
+def _ttls():
+    return (
+        getattr(settings, 'CREDIT_SCORE_CACHE_TTL', 300),
+        getattr(settings, 'CREDIT_SCORE_CACHE_STALE_TTL', 3600),
+    )
+
+
+def cache_key(customer):
+    return (
+        f"credit_score:{customer.pk}:{customer.loan_version}:"
+        f"{customer.approved_limit}:{datetime.now().year}"
+    )
+
+
+def _count(stat):
+    key = STATS_KEYS[stat]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr, losing one count is fine
+        pass
+
+
+def store_credit_score(customer, compute=None):
+    """Compute the customer's score and cache it as fresh"""
+    ttl, stale_ttl = _ttls()
+    score = compute() if compute is not None else customer.calculate_credit_score()
+    cache.set(cache_key(customer), (score, time.time() + ttl), timeout=ttl + stale_ttl)
+    return score
+
+
+def _schedule_refresh(customer):
+    # One refresh per key at a time, concurrent stale readers just serve the old value
+    if not cache.add(f"{cache_key(customer)}:refreshing", True, timeout=_ttls()[0]):
+        return
+    from .tasks import refresh_credit_score
+
+    try:
+        refresh_credit_score.apply_async((customer.pk,), retry=False)
+    except Exception as e:
+        logger.warning(f"Could not queue credit score refresh for customer {customer.pk}: {str(e)}")
+        store_credit_score(customer)
+
+
+def cached_credit_score(customer, compute=None):
+    """
+    Return the customer's credit score, from the cache when possible
+
+    ``compute`` replaces ``customer.calculate_credit_score`` on a miss, for
+    callers that already hold the score inputs.
+    """
+    entry = cache.get(cache_key(customer))
+    if entry is None:
+        _count('misses')
+        return store_credit_score(customer, compute)
+    score, fresh_until = entry
+    if time.time() < fresh_until:
+        _count('hits')
+    else:
+        _count('stale_hits')
+        _schedule_refresh(customer)
+    return score
+
+
+def cache_stats():
+    """Hit, stale hit and miss counts since the counters were last reset"""
+    values = cache.get_many(list(STATS_KEYS.values()))
+    return {stat: values.get(key, 0) for stat, key in STATS_KEYS.items()}
+
+
+def reset_cache_stats():
+    cache.delete_many(list(STATS_KEYS.values()))
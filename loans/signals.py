@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import detail_cache
+from .models import Loan
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def drop_cached_loan_detail(sender, instance, **kwargs):
+    detail_cache.invalidate(instance.pk)
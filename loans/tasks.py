@@ -1,61 +1,121 @@
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
-import pandas as pd
+from django.db import connection
+from itertools import chain
 import logging
-from datetime import datetime
-from decimal import Decimal
-from .models import Customer, Loan
+import numpy as np
+import pandas as pd
+from .delta import DeltaTracker, clear_fingerprints
+from .eligibility import CustomerBusy, give_up_application, process_application
+from .ingestion import (
+    CUSTOMER_DIGEST_FIELDS, LOAN_DIGEST_FIELDS, LOAN_ID_COLUMN,
+    copy_customers, copy_loans, upsert_customers, upsert_loans,
+)
+from .models import Customer, IngestionFingerprint
+from .readers import count_rows, read_column, read_rows, row_offsets
+from .score_cache import store_credit_score
+from .scoring import rescore_customers as rescore_all_customers
 
 logger = logging.getLogger(__name__)
 
 
+def _batch_size(batch_size=None):
+    return batch_size or getattr(settings, 'INGEST_BATCH_SIZE', 1000)
+
+
+def _default_file(path, name):
+    return str(path or settings.BASE_DIR / name)
+
+
+def shard_ranges(total_rows, shards=None):
+    """Split ``total_rows`` into contiguous ``(start, stop)`` row ranges"""
+    if total_rows <= 0:
+        return []
+    if not shards:
+        shard_size = getattr(settings, 'INGEST_SHARD_SIZE', 50000)
+        shards = -(-total_rows // shard_size)
+    shards = max(1, min(shards, total_rows))
+    size = -(-total_rows // shards)
+    return [(start, min(start + size, total_rows)) for start in range(0, total_rows, size)]
+
+
+def superseded_loan_ids(loan_ids, ranges):
+    """
+    For each shard range, the loan ids whose last row in the file is in a later shard
+
+    A sequential load leaves a repeated loan id with its last row. Shards run
+    in any order, so each one leaves such ids to the shard holding that row
+    and the outcome no longer depends on which shard commits last.
+    """
+    ids = pd.to_numeric(pd.Series(loan_ids).reset_index(drop=True), errors='coerce')
+    rows = pd.Series(np.arange(len(ids)))
+    last_row = rows.groupby(ids).transform('max')
+    repeated = ids.notna() & ids.duplicated(keep='last')
+    return [
+        sorted({int(loan_id) for loan_id in ids[repeated & (rows >= start) & (rows < stop) & (last_row >= stop)]})
+        for start, stop in ranges
+    ]
+
+
+def _copy_supported(use_copy):
+    """COPY is PostgreSQL only, other databases fall back to the bulk ORM path"""
+    if use_copy and connection.vendor != 'postgresql':
+        logger.info(f"COPY loading is not available on {connection.vendor}, using bulk upserts")
+        return False
+    return use_copy
+
+
+def _start_tracking(kind, fields, path, delta, start=0, stop=None):
+    """
+    Return a DeltaTracker for delta loads, None otherwise
+
+    A full load rewrites rows without hashing them, so it also drops the
+    stored fingerprints of that kind; a later delta run then starts clean.
+    Shards leave that to ingest_all_data, which clears once up front.
+    """
+    if delta:
+        tracker = DeltaTracker.for_file(kind, fields, path, start, stop)
+        if tracker.resume_offset:
+            logger.info(f"Resuming {tracker.source} after {tracker.resume_offset} committed rows")
+        return tracker
+    if not start and stop is None:
+        clear_fingerprints(kind)
+    return None
+
+
+def _unchanged_note(tracker):
+    return f" ({tracker.unchanged} unchanged)" if tracker is not None else ''
+
+
 @shared_task
-def ingest_customer_data():
+def ingest_customer_data(batch_size=None, use_copy=False, path=None, fmt=None, delta=False):
     """
-    Ingest customer data from Excel file
+    Ingest customer data from a spreadsheet (xlsx, csv, tsv or parquet)
+
+    With ``delta`` only new or changed rows are written, and a crashed run
+    resumes from its last committed batch.
     """
     try:
-        # Read customer data
-        customer_file = settings.BASE_DIR / 'customer_data.xlsx'
-        df = pd.read_excel(customer_file)
+        if use_copy and delta:
+            raise ValueError("COPY loading is a full reload and cannot be combined with delta mode")
         
-        customers_created = 0
-        customers_updated = 0
+        # Stream customer data in batches
+        customer_file = _default_file(path, 'customer_data.xlsx')
+        tracker = _start_tracking(IngestionFingerprint.CUSTOMER, CUSTOMER_DIGEST_FIELDS, customer_file, delta)
+        batches = read_rows(
+            customer_file, fmt=fmt, chunk_size=_batch_size(batch_size),
+            start=tracker.resume_offset if tracker else 0,
+        )
         
-        for _, row in df.iterrows():
-            customer_id = row['Customer ID']
-            
-            # Check if customer exists
-            customer, created = Customer.objects.get_or_create(
-                customer_id=customer_id,
-                defaults={
-                    'first_name': row['First Name'],
-                    'last_name': row['Last Name'],
-                    'age': row['Age'],
-                    'phone_number': str(row['Phone Number']),
-                    'monthly_salary': Decimal(str(row['Monthly Salary'])),
-                    'approved_limit': Decimal(str(row['Approved Limit'])),
-                    'current_debt': Decimal('0.00')
-                }
-            )
-            
-            if created:
-                customers_created += 1
-                logger.info(f"Created customer: {customer.full_name}")
-            else:
-                # Update existing customer
-                customer.first_name = row['First Name']
-                customer.last_name = row['Last Name']
-                customer.age = row['Age']
-                customer.phone_number = str(row['Phone Number'])
-                customer.monthly_salary = Decimal(str(row['Monthly Salary']))
-                customer.approved_limit = Decimal(str(row['Approved Limit']))
-                customer.save()
-                customers_updated += 1
-                logger.info(f"Updated customer: {customer.full_name}")
+        if _copy_supported(use_copy):
+            customers_created, customers_updated = copy_customers(chain.from_iterable(batches))
+        else:
+            customers_created, customers_updated = upsert_customers(batches, tracker=tracker)
+        if tracker is not None:
+            tracker.finish()
         
         logger.info(f"Customer data ingestion completed. Created: {customers_created}, Updated: {customers_updated}")
-        return f"Success: Created {customers_created}, Updated {customers_updated} customers"
+        return f"Success: Created {customers_created}, Updated {customers_updated} customers{_unchanged_note(tracker)}"
         
     except Exception as e:
         logger.error(f"Error ingesting customer data: {str(e)}")
@@ -63,72 +123,37 @@ def ingest_customer_data():
 
 
 @shared_task
-def ingest_loan_data():
+def ingest_loan_data(batch_size=None, use_copy=False, path=None, fmt=None, delta=False):
     """
-    Ingest loan data from Excel file
+    Ingest loan data from a spreadsheet (xlsx, csv, tsv or parquet)
+
+    With ``delta`` only new or changed rows are written, and a crashed run
+    resumes from its last committed batch.
     """
     try:
-        # Read loan data
-        loan_file = settings.BASE_DIR / 'loan_data.xlsx'
-        df = pd.read_excel(loan_file)
+        if use_copy and delta:
+            raise ValueError("COPY loading is a full reload and cannot be combined with delta mode")
         
-        loans_created = 0
-        loans_updated = 0
+        # Stream loan data in batches
+        loan_file = _default_file(path, 'loan_data.xlsx')
+        tracker = _start_tracking(IngestionFingerprint.LOAN, LOAN_DIGEST_FIELDS, loan_file, delta)
+        batches = read_rows(
+            loan_file, fmt=fmt, chunk_size=_batch_size(batch_size),
+            start=tracker.resume_offset if tracker else 0,
+        )
         
-        for _, row in df.iterrows():
-            try:
-                customer_id = row['Customer ID']
-                loan_id = row['Loan ID']
-                
-                # Get customer
-                try:
-                    customer = Customer.objects.get(customer_id=customer_id)
-                except Customer.DoesNotExist:
-                    logger.warning(f"Customer {customer_id} not found for loan {loan_id}")
-                    continue
-                
-                # Parse dates
-                start_date = pd.to_datetime(row['Date of Approval']).date()
-                end_date = pd.to_datetime(row['End Date']).date()
-                
-                # Check if loan exists
-                loan, created = Loan.objects.get_or_create(
-                    loan_id=loan_id,
-                    defaults={
-                        'customer': customer,
-                        'loan_amount': Decimal(str(row['Loan Amount'])),
-                        'tenure': int(row['Tenure']),
-                        'interest_rate': Decimal(str(row['Interest Rate'])),
-                        'monthly_repayment': Decimal(str(row['Monthly payment'])),
-                        'emis_paid_on_time': int(row['EMIs paid on Time']),
-                        'start_date': start_date,
-                        'end_date': end_date
-                    }
-                )
-                
-                if created:
-                    loans_created += 1
-                    logger.info(f"Created loan: {loan_id} for customer {customer.full_name}")
-                else:
-                    # Update existing loan
-                    loan.customer = customer
-                    loan.loan_amount = Decimal(str(row['Loan Amount']))
-                    loan.tenure = int(row['Tenure'])
-                    loan.interest_rate = Decimal(str(row['Interest Rate']))
-                    loan.monthly_repayment = Decimal(str(row['Monthly payment']))
-                    loan.emis_paid_on_time = int(row['EMIs paid on Time'])
-                    loan.start_date = start_date
-                    loan.end_date = end_date
-                    loan.save()
-                    loans_updated += 1
-                    logger.info(f"Updated loan: {loan_id} for customer {customer.full_name}")
-                    
-            except Exception as e:
-                logger.error(f"Error processing loan row {row.to_dict()}: {str(e)}")
-                continue
+        if _copy_supported(use_copy):
+            loans_created, loans_updated, loans_skipped = copy_loans(chain.from_iterable(batches))
+        else:
+            loans_created, loans_updated, loans_skipped = upsert_loans(batches, tracker=tracker)
+        if tracker is not None:
+            tracker.finish()
         
-        logger.info(f"Loan data ingestion completed. Created: {loans_created}, Updated: {loans_updated}")
-        return f"Success: Created {loans_created}, Updated {loans_updated} loans"
+        logger.info(
+            f"Loan data ingestion completed. Created: {loans_created}, Updated: {loans_updated}, "
+            f"Skipped: {loans_skipped}"
+        )
+        return f"Success: Created {loans_created}, Updated {loans_updated} loans{_unchanged_note(tracker)}"
         
     except Exception as e:
         logger.error(f"Error ingesting loan data: {str(e)}")
@@ -136,19 +161,139 @@ def ingest_loan_data():
 
 
 @shared_task
-def ingest_all_data():
+def ingest_loan_shard(start, stop, path=None, fmt=None, batch_size=None, delta=False, position=None,
+                      superseded=None):
+    """
+    Ingest the ``[start, stop)`` row range of the loan file
+
+    ``position`` is the byte offset of row ``start`` in a delimited file, so
+    the shard reads its own rows only instead of every row ahead of them.
+    ``superseded`` lists the loan ids a later shard writes, see
+    ``superseded_loan_ids``.
+    """
+    loan_file = _default_file(path, 'loan_data.xlsx')
+    tracker = _start_tracking(IngestionFingerprint.LOAN, LOAN_DIGEST_FIELDS, loan_file, delta, start, stop)
+    resume_at = start + (tracker.resume_offset if tracker else 0)
+    batches = read_rows(
+        loan_file, fmt=fmt, chunk_size=_batch_size(batch_size), start=resume_at, stop=stop,
+        seek=(start, position) if position is not None else None,
+    )
+    created, updated, skipped = upsert_loans(batches, tracker=tracker, superseded=set(superseded or ()))
+    if tracker is not None:
+        tracker.finish()
+    logger.info(f"Loan shard {start}-{stop} completed. Created: {created}, Updated: {updated}, Skipped: {skipped}")
+    return {
+        'created': created,
+        'updated': updated,
+        'skipped': skipped,
+        'unchanged': tracker.unchanged if tracker else 0,
+    }
+
+
+@shared_task
+def summarize_loan_shards(shard_results, customer_result=''):
     """
-    Ingest both customer and loan data
+    Add up the per-shard loan counts once every shard has finished
+    """
+    totals = {'created': 0, 'updated': 0, 'skipped': 0, 'unchanged': 0}
+    for shard_result in shard_results:
+        for key in totals:
+            totals[key] += shard_result.get(key, 0)
+    loan_result = (
+        f"Success: Created {totals['created']}, Updated {totals['updated']} loans "
+        f"({totals['skipped']} skipped, {totals['unchanged']} unchanged across {len(shard_results)} shards)"
+    )
+    result = f"Customer ingestion: {customer_result}\nLoan ingestion: {loan_result}"
+    logger.info("Data ingestion process completed")
+    return result
+
+
+@shared_task
+def ingest_all_data(customer_file=None, loan_file=None, fmt=None, shards=None, delta=False):
+    """
+    Ingest customer data, then fan loan ingestion out across workers
+
+    Loans are split into row-range shards that run as a chord, so the loan
+    counts are not known when this returns. Instead of the summary string it
+    used to return, the result is a dict of ``customer_result`` (the
+    customer task's string), ``shard_ids`` (one task id per shard) and
+    ``summary_id``, the ``summarize_loan_shards`` task whose result is that
+    "Customer ingestion: ...\nLoan ingestion: ..." string.
     """
     logger.info("Starting data ingestion process...")
     
-    # First ingest customers
-    customer_result = ingest_customer_data()
+    # Customers first, so every shard can resolve its foreign keys
+    customer_result = ingest_customer_data(path=customer_file, fmt=fmt, delta=delta)
     
-    # Then ingest loans
-    loan_result = ingest_loan_data()
+    # Then fan the loans out
+    loan_file = _default_file(loan_file, 'loan_data.xlsx')
+    if not delta:
+        clear_fingerprints(IngestionFingerprint.LOAN)
+    ranges = shard_ranges(count_rows(loan_file, fmt), shards)
+    if not ranges:
+        return {'customer_result': customer_result, 'shard_ids': [], 'summary_id': None}
     
-    result = f"Customer ingestion: {customer_result}\nLoan ingestion: {loan_result}"
-    logger.info("Data ingestion process completed")
+    # Each shard of a delimited file starts reading at its own first line
+    offsets = row_offsets(loan_file, [start for start, _ in ranges], fmt)
+    # Repeated loan ids are written once, from their last row, like a sequential load
+    superseded = [[]] * len(ranges)
+    if len(ranges) > 1:
+        superseded = superseded_loan_ids(read_column(loan_file, LOAN_ID_COLUMN, fmt), ranges)
+    header = [
+        ingest_loan_shard.s(
+            start, stop, path=loan_file, fmt=fmt, delta=delta, position=offsets.get(start), superseded=ids,
+        )
+        for (start, stop), ids in zip(ranges, superseded)
+    ]
+    summary = chord(header)(summarize_loan_shards.s(customer_result=customer_result))
+    logger.info(f"Dispatched {len(ranges)} loan shards")
     
-    return result
+    return {
+        'customer_result': customer_result,
+        'shard_ids': [shard.id for shard in summary.parent.results],
+        'summary_id': summary.id,
+    }
+
+
+@shared_task
+def rescore_customers(chunk_size=None):
+    """
+    Recompute and store every customer's credit score in vectorized chunks
+    """
+    scored = rescore_all_customers(chunk_size=chunk_size or getattr(settings, 'RESCORE_CHUNK_SIZE', 10000))
+    logger.info(f"Rescored {scored} customers")
+    return f"Success: Rescored {scored} customers"
+
+
+@shared_task
+def refresh_credit_score(customer_id):
+    """
+    Recompute a customer's cached credit score after its entry went stale
+    """
+    try:
+        customer = Customer.objects.select_related('credit_profile').get(customer_id=customer_id)
+    except Customer.DoesNotExist:
+        return None
+    return store_credit_score(customer)
+
+
+@shared_task(bind=True, max_retries=10)
+def process_loan_application(self, application_id):
+    """
+    Decide a PENDING loan application queued by the async create-loan mode
+
+    Retried with a delay while parallel applications for the same customer
+    keep winning the race. Once the retries run out the application is
+    rejected as busy rather than left PENDING.
+    """
+    try:
+        application = process_application(application_id)
+    except CustomerBusy as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=1)
+        logger.error(f"Loan application {application_id} rejected, customer busy after {self.max_retries} retries")
+        application = give_up_application(application_id)
+    if application is None:
+        logger.warning(f"Loan application {application_id} no longer exists")
+        return None
+    return application.status
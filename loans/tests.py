@@ -1,14 +1,115 @@
-from django.test import TestCase, Client
-from django.urls import reverse
-from rest_framework import status
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import partial
 from decimal import Decimal
+from io import StringIO
 import json
+import os
+import random
+import re
+import tempfile
+import threading
+from unittest import mock
+import warnings
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, Client, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import redis
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from . import decision_log, eligibility, ingestion, metrics, profiles, scoring, tasks
+from .decision_log import flush, stats
+from .eligibility import (
+    BATCH_WRITE_FAILED, CUSTOMER_BUSY, CustomerBusy, RATE_TOO_LOW, calculate_monthly_installment, create_loans,
+    monthly_installments, process_application
+)
+from .fast_serialization import encode_rows, loan_detail, loan_list_rows, render
+from .ingestion import _to_date, chunked, copy_loans, upsert_customers, upsert_loans
+from .middleware import NPlusOneDetectorMiddleware
+from .models import Customer, CustomerCreditProfile, DecisionLog, IngestionCheckpoint, Loan, LoanApplication
+from .profiles import (
+    close_loan, compute_exposures, find_drift, find_exposure_drift, record_new_loan, refresh_all_profiles,
+    refresh_profiles, reset_exposures
+)
+from .readers import detect_format, read_column, read_rows, row_offsets
+from .score_cache import cache_key, cache_stats, cached_credit_score
+from .serializers import LoanApplicationSerializer, LoanDetailSerializer, LoanListSerializer
+from .tasks import (
+    ingest_customer_data, ingest_loan_data, ingest_loan_shard, process_loan_application, refresh_credit_score,
+    rescore_customers, shard_ranges, summarize_loan_shards, superseded_loan_ids
+)
+from .urls import urlpatterns
+
+
+def make_customer(**fields):
+    """Save a customer, John Doe on a 50000 salary and the 1800000 limit it earns unless overridden"""
+    defaults = {
+        'first_name': 'John', 'last_name': 'Doe', 'age': 30, 'phone_number': '1234567890',
+        'monthly_salary': Decimal('50000'), 'approved_limit': Decimal('1800000'),
+    }
+    return Customer.objects.create(**{**defaults, **fields})
 
-from .models import Customer, Loan
 
+def make_loan(customer, **fields):
+    """Save a loan of 100000 over 12 months at 12% from 2024-01-01 unless overridden"""
+    defaults = {
+        'loan_amount': Decimal('100000'), 'tenure': 12, 'interest_rate': Decimal('12'),
+        'monthly_repayment': Decimal('8884.88'), 'start_date': date(2024, 1, 1),
+    }
+    return Loan.objects.create(customer=customer, **{**defaults, **fields})
 
-class CreditApprovalAPITest(TestCase):
+
+@contextmanager
+def file_sqlite_database():
+    """Point the default connection, in every thread, at a migrated SQLite file instead of the in-memory test database"""
+    name = connection.settings_dict['NAME']
+    # Closing an in-memory database drops it, keep its connection aside for the tests that follow
+    memory, connection.connection = connection.connection, None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Thread connections are built from the same settings dict
+        connection.settings_dict['NAME'] = os.path.join(tmpdir, 'test.sqlite3')
+        try:
+            call_command('migrate', verbosity=0, interactive=False, database=connection.alias)
+            yield
+        finally:
+            connection.close()
+            connection.settings_dict['NAME'] = name
+            connection.connection = memory
+
+
+class DecisionBufferMixin:
+    """Start and end every test with an empty decision log buffer, which is shared by the whole process"""
+    
+    def _pre_setup(self):
+        super()._pre_setup()
+        decision_log.buffer.clear()
+    
+    def _post_teardown(self):
+        # Records of this test must not be flushed into the next one, or at exit once the test database is gone
+        decision_log.buffer.clear()
+        super()._post_teardown()
+
+
+class CreditApprovalAPITest(DecisionBufferMixin, TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.customer_data = {
             'first_name': 'John',
@@ -183,3 +284,1674 @@ class CreditApprovalAPITest(TestCase):
         # Score should be higher now
         score = customer.calculate_credit_score()
         self.assertGreater(score, 50)
+
+
+class BulkIngestionTest(TestCase):
+    def customer_row(self, customer_id, **overrides):
+        row = {
+            'Customer ID': customer_id,
+            'First Name': 'Jane',
+            'Last Name': 'Roe',
+            'Age': 35,
+            'Phone Number': 9000000000 + customer_id,
+            'Monthly Salary': 60000,
+            'Approved Limit': 2200000,
+        }
+        row.update(overrides)
+        return row
+    
+    def loan_row(self, loan_id, customer_id, **overrides):
+        row = {
+            'Customer ID': customer_id,
+            'Loan ID': loan_id,
+            'Loan Amount': 100000,
+            'Tenure': 12,
+            'Interest Rate': 12.5,
+            'Monthly payment': 8900,
+            'EMIs paid on Time': 12,
+            'Date of Approval': '2023-01-01',
+            'End Date': '2023-12-31',
+        }
+        row.update(overrides)
+        return row
+    
+    def test_customer_upsert_counts(self):
+        """Test created/updated counts match the per-row semantics"""
+        make_customer(
+            customer_id=1, first_name='Old', last_name='Name', phone_number='9000000001',
+            monthly_salary=Decimal('1000'), approved_limit=Decimal('1000')
+        )
+        rows = [self.customer_row(i) for i in range(1, 6)]
+        rows.append(self.customer_row(2, **{'First Name': 'Later'}))
+        
+        created, updated = upsert_customers(chunked(rows, 4))
+        
+        self.assertEqual((created, updated), (4, 2))
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(Customer.objects.get(customer_id=1).first_name, 'Jane')
+        self.assertEqual(Customer.objects.get(customer_id=2).first_name, 'Later')
+    
+    def test_loan_upsert_queries_per_batch(self):
+        """Test loan ingestion cost grows with batches, not rows"""
+        upsert_customers([[self.customer_row(1), self.customer_row(2)]])
+        rows = [self.loan_row(i, 1 + i % 2) for i in range(1, 201)]
+        rows.append(self.loan_row(500, 99))
+        
+        with CaptureQueriesContext(connection) as ctx:
+            created, updated, skipped = upsert_loans(chunked(rows, 100))
+        
+        self.assertEqual((created, updated, skipped), (200, 0, 1))
+        # A fixed number of statements per batch (upsert plus credit profile refresh)
+        self.assertLessEqual(len(ctx.captured_queries), 1 + 3 * 9)
+        self.assertEqual(Loan.objects.filter(customer_id=1).count(), 100)
+    
+    def test_dates_parse_like_the_baseline(self):
+        """Test dd-mm-yyyy is read day first and every other spelling goes to pandas unchanged"""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertEqual(_to_date('09-03-2017'), date(2017, 3, 9))
+            self.assertEqual(_to_date('2023-01-01'), date(2023, 1, 1))
+            self.assertEqual(_to_date('01/02/2024'), date(2024, 1, 2))
+        self.assertIsNone(_to_date(float('nan')))
+    
+    def test_malformed_rows_are_skipped_by_every_loader(self):
+        """Test the ORM and COPY loaders skip and count bad rows alike instead of failing the load"""
+        upsert_customers([[self.customer_row(1)]])
+        rows = [self.loan_row(i, 1) for i in range(1, 5)]
+        rows.append(self.loan_row(5, 1, **{'Loan Amount': 'n/a'}))
+        rows.append(self.loan_row(6, 99))
+        loaders = {'orm': lambda: upsert_loans([rows])}
+        if connection.vendor == 'postgresql':
+            loaders['copy'] = lambda: copy_loans(rows)
+        
+        for name, load in loaders.items():
+            with self.subTest(name):
+                Loan.objects.all().delete()
+                self.assertEqual(load(), (4, 0, 2))
+                self.assertEqual(Loan.objects.count(), 4)
+    
+    def test_copy_merge_counts_inserts_in_sql(self):
+        """Test the staging merge gets its insert count as one row instead of a row per merged loan"""
+        cursor = mock.Mock()
+        cursor.fetchone.side_effect = [(5,), (3,)]
+        
+        merged = ingestion._merge_from_staging(cursor, 'loans_staging', 'loans', 'loan_id', ['loan_id', 'tenure'], ['tenure'])
+        
+        self.assertEqual(merged, (3, 2))
+        cursor.fetchall.assert_not_called()
+        statement = cursor.execute.call_args.args[0]
+        self.assertTrue(statement.startswith('WITH merged AS (INSERT INTO loans '))
+        self.assertTrue(statement.endswith(') SELECT count(*) FILTER (WHERE inserted) FROM merged'))
+    
+    def test_copy_merge_lists_every_column_once(self):
+        """Test the COPY and merge statements of both loaders name each column once, PostgreSQL rejects repeats"""
+        cursor = mock.MagicMock()
+        cursor.fetchone.return_value = (0,)
+        fake_connection = mock.MagicMock()
+        fake_connection.cursor.return_value.__enter__.return_value = cursor
+        
+        with mock.patch.object(ingestion, 'connection', fake_connection), \
+                mock.patch.object(ingestion, 'call_command'), mock.patch.object(ingestion, 'refresh_all_profiles'):
+            ingestion.copy_customers([])
+            ingestion.copy_loans([])
+        
+        statements = [call.args[0] for call in cursor.execute.call_args_list + cursor.copy_expert.call_args_list]
+        column_lists = [
+            match.group(1).split(', ')
+            for statement in statements for match in re.finditer(r'(?:INSERT INTO|COPY) \w+ \(([^)]*)\)', statement)
+        ]
+        self.assertEqual(len(column_lists), 4)
+        for columns in column_lists:
+            self.assertIn('created_at', columns)
+            self.assertEqual(len(columns), len(set(columns)), columns)
+    
+    def test_copy_mode_falls_back_on_sqlite(self):
+        """Test --copy uses the bulk ORM path when the database is not PostgreSQL"""
+        out = StringIO()
+        call_command('ingest_data_sync', '--copy', stdout=out)
+        
+        self.assertIn('Success: Created 300', out.getvalue())
+        self.assertTrue(Loan.objects.exists())
+
+
+class StreamingReaderTest(TestCase):
+    def test_xlsx_is_read_in_chunks(self):
+        """Test the xlsx reader yields bounded chunks covering every row"""
+        chunks = list(read_rows(settings.BASE_DIR / 'customer_data.xlsx', chunk_size=64))
+        
+        self.assertTrue(all(len(chunk) <= 64 for chunk in chunks))
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 300)
+        self.assertEqual(chunks[0][0]['Customer ID'], 1)
+    
+    def test_format_detection(self):
+        """Test formats come from the extension unless given explicitly"""
+        self.assertEqual(detect_format('loans.csv'), 'csv')
+        self.assertEqual(detect_format('loans.PARQUET'), 'parquet')
+        self.assertEqual(detect_format('loans.dat', 'csv'), 'csv')
+        with self.assertRaises(ValueError):
+            detect_format('loans.dat')
+    
+    def test_ingest_from_delimited_text(self):
+        """Test the tasks ingest the tab separated example files"""
+        customer_result = ingest_customer_data(path=settings.BASE_DIR / 'customer_data_example.txt', batch_size=3)
+        ingest_customer_data()
+        loan_result = ingest_loan_data(path=settings.BASE_DIR / 'loan_data_example.txt', batch_size=3)
+        
+        self.assertEqual(customer_result, 'Success: Created 10, Updated 0 customers')
+        self.assertEqual(loan_result, 'Success: Created 10, Updated 0 loans')
+        self.assertEqual(Loan.objects.get(loan_id=5930).start_date, date(2017, 3, 9))
+
+
+class ShardedIngestionTest(TestCase):
+    def test_shard_ranges_cover_all_rows(self):
+        """Test shard ranges are contiguous and cover every row once"""
+        self.assertEqual(shard_ranges(0, 4), [])
+        self.assertEqual(shard_ranges(10, 3), [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(shard_ranges(2, 8), [(0, 1), (1, 2)])
+        with self.settings(INGEST_SHARD_SIZE=300):
+            self.assertEqual(len(shard_ranges(782)), 3)
+    
+    def test_delimited_shards_seek_to_their_rows(self):
+        """Test csv shards entered at their byte offset read the same rows as a scan from the top"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'loans.csv')
+            with open(path, 'w') as handle:
+                handle.write('Loan ID,Name\n')
+                for loan_id in range(1, 101):
+                    handle.write(f'{loan_id},"Loan {loan_id}"\n')
+            ranges = shard_ranges(100, 3)
+            offsets = row_offsets(path, [start for start, _ in ranges])
+            
+            for start, stop in ranges:
+                scanned = [row for chunk in read_rows(path, chunk_size=7, start=start, stop=stop) for row in chunk]
+                sought = [
+                    row for chunk in read_rows(path, chunk_size=7, start=start, stop=stop, seek=(start, offsets[start]))
+                    for row in chunk
+                ]
+                self.assertEqual(sought, scanned)
+                self.assertEqual(sought[0], {'Loan ID': start + 1, 'Name': f'Loan {start + 1}'})
+            # A resumed shard skips its committed rows from its own offset
+            resumed = [row for chunk in read_rows(path, start=50, stop=60, seek=(34, offsets[34])) for row in chunk]
+            self.assertEqual([row['Loan ID'] for row in resumed], list(range(51, 61)))
+        self.assertEqual(row_offsets('loan_data.xlsx', [0]), {})
+    
+    def test_repeated_loan_ids_keep_their_last_row_in_any_shard_order(self):
+        """Test shards leave a repeated loan id to its last row whichever shard commits last"""
+        make_customer(customer_id=1)
+        loan_ids = [1, 2, 3, 1, 4, 2, 5, 1, 6]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'loans.csv')
+            with open(path, 'w') as handle:
+                handle.write(
+                    'Customer ID,Loan ID,Loan Amount,Tenure,Interest Rate,Monthly payment,'
+                    'EMIs paid on Time,Date of Approval,End Date\n'
+                )
+                for row, loan_id in enumerate(loan_ids):
+                    handle.write(f'1,{loan_id},{1000 * (row + 1)},12,10,100,12,01-01-2020,01-01-2021\n')
+            
+            sequential = ingest_loan_data(path=path)
+            amounts = dict(Loan.objects.values_list('loan_id', 'loan_amount'))
+            Loan.objects.all().delete()
+            
+            ranges = shard_ranges(len(loan_ids), 3)
+            superseded = superseded_loan_ids(read_column(path, 'Loan ID'), ranges)
+            results = [
+                ingest_loan_shard(start, stop, path=path, superseded=ids)
+                for (start, stop), ids in reversed(list(zip(ranges, superseded)))
+            ]
+        
+        self.assertEqual(superseded, [[1, 2], [1], []])
+        self.assertEqual(sequential, 'Success: Created 6, Updated 3 loans')
+        self.assertIn('Created 6, Updated 3 loans', summarize_loan_shards(results))
+        self.assertEqual(dict(Loan.objects.values_list('loan_id', 'loan_amount')), amounts)
+        self.assertEqual(amounts[1], Decimal('8000'))
+    
+    def test_ingest_all_data_returns_task_ids(self):
+        """Test the dispatch result names the customer result, the shard tasks and the summary task"""
+        with mock.patch.object(tasks, 'chord') as chord:
+            summary = chord.return_value.return_value
+            summary.id = 'summary'
+            summary.parent.results = [mock.Mock(id=f'shard-{index}') for index in range(3)]
+            result = tasks.ingest_all_data(shards=3)
+        
+        self.assertEqual(result, {
+            'customer_result': 'Success: Created 300, Updated 0 customers',
+            'shard_ids': ['shard-0', 'shard-1', 'shard-2'],
+            'summary_id': 'summary',
+        })
+        header = chord.call_args.args[0]
+        self.assertEqual([signature.args for signature in header], [(0, 261), (261, 522), (522, 782)])
+        # loan_data.xlsx repeats loan ids across shards, only the last shard owns all of its rows
+        self.assertTrue(header[0].kwargs['superseded'])
+        self.assertEqual(header[-1].kwargs['superseded'], [])
+    
+    def test_shards_add_up_to_full_load(self):
+        """Test running every shard and summarizing matches a single pass"""
+        ingest_customer_data()
+        results = [ingest_loan_shard(start, stop) for start, stop in shard_ranges(782, 4)]
+        summary = summarize_loan_shards(results, customer_result='ok')
+        
+        self.assertEqual(Loan.objects.count(), 753)
+        self.assertIn('Created 753, Updated 29 loans', summary)
+
+
+class DeltaIngestionTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def write_customers(self, name, rows):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as handle:
+            handle.write('Customer ID,First Name,Last Name,Age,Phone Number,Monthly Salary,Approved Limit\n')
+            for customer_id, first_name in rows:
+                handle.write(f'{customer_id},{first_name},Roe,40,{9000000000 + customer_id},50000,1800000\n')
+        return path
+    
+    def test_only_changed_rows_are_written(self):
+        """Test a delta run skips rows whose content hash is unchanged"""
+        rows = [(i, 'Jane') for i in range(1, 11)]
+        first = ingest_customer_data(path=self.write_customers('a.csv', rows), delta=True, batch_size=4)
+        rows[2] = (3, 'Changed')
+        rows.append((11, 'New'))
+        second = ingest_customer_data(path=self.write_customers('b.csv', rows), delta=True, batch_size=4)
+        
+        self.assertEqual(first, 'Success: Created 10, Updated 0 customers (0 unchanged)')
+        self.assertEqual(second, 'Success: Created 1, Updated 1 customers (9 unchanged)')
+        self.assertEqual(Customer.objects.get(customer_id=3).first_name, 'Changed')
+    
+    def test_crashed_run_resumes_from_checkpoint(self):
+        """Test a failing batch leaves a checkpoint that the next run resumes from"""
+        path = self.write_customers('c.csv', [(i, 'Jane') for i in range(1, 11)])
+        real_upsert = ingestion._upsert
+        calls = []
+        
+        def failing_upsert(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('worker lost')
+            return real_upsert(*args, **kwargs)
+        
+        with mock.patch.object(ingestion, '_upsert', failing_upsert):
+            crashed = ingest_customer_data(path=path, delta=True, batch_size=4)
+        
+        self.assertTrue(crashed.startswith('Error'))
+        self.assertEqual(IngestionCheckpoint.objects.get().rows_committed, 4)
+        
+        resumed = ingest_customer_data(path=path, delta=True, batch_size=4)
+        
+        self.assertEqual(resumed, 'Success: Created 6, Updated 0 customers (0 unchanged)')
+        self.assertEqual(Customer.objects.count(), 10)
+        self.assertFalse(IngestionCheckpoint.objects.exists())
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_generate_and_benchmark(self):
+        """Test generated files ingest cleanly and the run is recorded as JSON"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            call_command('generate_data', customers=20, loans=60, output_dir=tmpdir, stdout=StringIO())
+            output = os.path.join(tmpdir, 'bench.json')
+            call_command(
+                'benchmark_ingestion',
+                customer_file=os.path.join(tmpdir, 'customer_data.csv'),
+                loan_file=os.path.join(tmpdir, 'loan_data.csv'),
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output) as handle:
+                runs = json.load(handle)
+        
+        self.assertEqual(Customer.objects.count(), 20)
+        self.assertEqual(Loan.objects.count(), 60)
+        self.assertEqual(runs[0]['results']['loans']['rows'], 60)
+        self.assertIn('peak_rss_mb', runs[0]['results']['customers'])
+
+
+def legacy_credit_score(customer):
+    """Reference implementation: the original per-object scoring loop"""
+    loans = list(customer.loans.all())
+    if not loans:
+        return 50
+    if sum(loan.loan_amount for loan in loans if loan.end_date is None) > customer.approved_limit:
+        return 0
+    total_loans = len(loans)
+    on_time = sum(1 for loan in loans if loan.emis_paid_on_time >= loan.tenure * 0.9)
+    current_year = sum(1 for loan in loans if loan.start_date.year == datetime.now().year)
+    volume = sum(loan.loan_amount for loan in loans)
+    score = (on_time / total_loans) * 40
+    score += 20 if total_loans <= 2 else 15 if total_loans <= 5 else 10
+    score += 20 if current_year <= 2 else 15 if current_year <= 4 else 10
+    if volume <= customer.approved_limit * Decimal('0.5'):
+        score += 20
+    elif volume <= customer.approved_limit * Decimal('0.8'):
+        score += 15
+    else:
+        score += 10
+    return min(100, max(0, int(score)))
+
+
+def make_random_book(customers=40, seed=7):
+    """Create customers with varied loan histories for scoring parity tests"""
+    rng = random.Random(seed)
+    this_year = date.today().year
+    for index in range(customers):
+        salary = Decimal(rng.randrange(20, 300) * 1000)
+        customer = make_customer(
+            first_name='C', last_name=str(index), phone_number=f'80000{index:05d}', monthly_salary=salary,
+            approved_limit=Decimal(round(36 * salary / 100000) * 100000)
+        )
+        for _ in range(rng.choice([0, 1, 2, 3, 5, 8, 12])):
+            tenure = rng.randrange(3, 200)
+            start = date(rng.choice([this_year, this_year - 1, this_year - 5]), rng.randrange(1, 13), 1)
+            make_loan(
+                customer, loan_amount=Decimal(rng.randrange(1, 15) * 100000), tenure=tenure,
+                interest_rate=Decimal('11.50'), monthly_repayment=Decimal(rng.randrange(1000, 50000)),
+                emis_paid_on_time=rng.choice([tenure, tenure * 9 // 10, -(-tenure * 9 // 10), rng.randrange(0, tenure + 1)]),
+                start_date=start, end_date=None if rng.random() < 0.2 else date(this_year + 3, 1, 1)
+            )
+
+
+class CreditScoreQueryTest(TestCase):
+    def test_matches_legacy_scoring(self):
+        """Test the aggregate query scores every customer like the original loop"""
+        make_random_book()
+        
+        for customer in Customer.objects.all():
+            self.assertEqual(customer.calculate_credit_score(), legacy_credit_score(customer), customer.last_name)
+    
+    def test_single_query(self):
+        """Test scoring costs one query regardless of loan history"""
+        make_random_book(customers=1, seed=3)
+        customer = Customer.objects.select_related('credit_profile').get()
+        for _ in range(30):
+            make_loan(
+                customer, loan_amount=Decimal('1000'), tenure=10, interest_rate=Decimal('10'),
+                monthly_repayment=Decimal('100'), start_date='2020-01-01', end_date='2021-01-01'
+            )
+        
+        with self.assertNumQueries(1):
+            customer.calculate_credit_score()
+
+
+class CreditProfileTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+    
+    def create_loan(self, **overrides):
+        loan_data = {'customer_id': self.customer.customer_id, 'loan_amount': 100000, 'interest_rate': 15.0, 'tenure': 12}
+        loan_data.update(overrides)
+        return self.client.post(reverse('create_loan'), data=json.dumps(loan_data), content_type='application/json')
+    
+    def test_create_loan_updates_profile(self):
+        """Test approved loans are added to the profile incrementally"""
+        self.create_loan()
+        self.create_loan(loan_amount=200000)
+        
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual(profile.loan_count, 2)
+        self.assertEqual(profile.approved_volume, Decimal('300000'))
+        self.assertEqual(sum(profile.loans_per_year.values()), 2)
+        self.assertEqual(list(find_drift()), [])
+    
+    def test_eligibility_reads_profile_row(self):
+        """Test eligibility does not scan loans once a profile exists"""
+        self.create_loan()
+        eligibility_data = {'customer_id': self.customer.customer_id, 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 12}
+        
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('check_eligibility'), data=json.dumps(eligibility_data), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_profile_scores_match_legacy(self):
+        """Test scoring from rebuilt profiles matches the original loop"""
+        make_random_book(seed=11)
+        call_command('rebuild_credit_profiles', stdout=StringIO())
+        
+        for customer in Customer.objects.select_related('credit_profile'):
+            self.assertEqual(customer.calculate_credit_score(), legacy_credit_score(customer))
+    
+    def test_drift_check(self):
+        """Test --check reports profiles that no longer match the loans table"""
+        self.create_loan()
+        Loan.objects.filter(customer=self.customer).update(emis_paid_on_time=12)
+        
+        with self.assertRaises(CommandError):
+            call_command('rebuild_credit_profiles', '--check', stdout=StringIO())
+        call_command('rebuild_credit_profiles', stdout=StringIO())
+        call_command('rebuild_credit_profiles', '--check', stdout=StringIO())
+    
+    def test_ingestion_refreshes_profiles(self):
+        """Test bulk loan ingestion keeps profiles in step with the loans table"""
+        ingest_customer_data()
+        ingest_loan_data(batch_size=200)
+        
+        self.assertEqual(list(find_drift()), [])
+
+
+class ExposureCounterTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+    
+    def open_loan(self, amount='200000', emi='20000'):
+        loan = make_loan(self.customer, loan_amount=Decimal(amount), monthly_repayment=Decimal(emi))
+        record_new_loan(loan)
+        return loan
+    
+    def test_counters_follow_open_and_close(self):
+        """Test opening and closing loans moves current_debt and active_emi_total"""
+        first = self.open_loan()
+        self.open_loan(amount='100000', emi='6000')
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('300000'))
+        self.assertEqual(self.customer.active_emi_total, Decimal('26000'))
+        version = self.customer.loan_version
+        
+        self.assertTrue(close_loan(first))
+        self.assertFalse(close_loan(first))
+        
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('100000'))
+        self.assertEqual(self.customer.active_emi_total, Decimal('6000'))
+        self.assertEqual(self.customer.loan_version, version + 1)
+        self.assertEqual(list(find_drift()), [])
+    
+    def test_eligibility_reads_counters(self):
+        """Test the EMI rule uses the stored total without touching the loans table"""
+        self.open_loan(emi='26000')
+        eligibility_data = {'customer_id': self.customer.customer_id, 'loan_amount': 1000, 'interest_rate': 20, 'tenure': 12}
+        
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('check_eligibility'), data=json.dumps(eligibility_data), content_type='application/json'
+            )
+        self.assertFalse(response.json()['approval'])
+    
+    def test_ingestion_sets_counters(self):
+        """Test bulk loads leave every customer's exposure equal to their open loans"""
+        ingest_customer_data()
+        ingest_loan_data(batch_size=200)
+        
+        self.assertEqual(list(find_exposure_drift()), [])
+    
+    def test_reconcile_command(self):
+        """Test reconcile_exposure reports and repairs drifted counters"""
+        self.open_loan()
+        Customer.objects.filter(pk=self.customer.pk).update(current_debt=0, active_emi_total=5)
+        
+        with self.assertRaises(CommandError):
+            call_command('reconcile_exposure', '--check', stdout=StringIO())
+        call_command('reconcile_exposure', stdout=StringIO())
+        call_command('reconcile_exposure', '--check', stdout=StringIO())
+        
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('200000'))
+
+
+class VectorizedRescoreTest(TestCase):
+    def test_parity_with_per_object_scoring(self):
+        """Test batch rescoring stores the same score as calculate_credit_score"""
+        make_random_book(customers=60, seed=5)
+        make_customer(
+            first_name='Over', last_name='Limit', age=40, phone_number='7000000000',
+            monthly_salary=Decimal('10000'), approved_limit=Decimal('100000')
+        ).loans.create(
+            loan_amount=Decimal('500000'), tenure=12, interest_rate=Decimal('10'),
+            monthly_repayment=Decimal('1000'), start_date='2020-01-01'
+        )
+        
+        result = rescore_customers(chunk_size=7)
+        
+        self.assertEqual(result, 'Success: Rescored 61 customers')
+        for customer in Customer.objects.all():
+            self.assertEqual(customer.credit_profile.credit_score, legacy_credit_score(customer), customer.last_name)
+        self.assertEqual(list(find_drift()), [])
+    
+    def test_loans_are_read_under_row_locks(self):
+        """Test rescoring and profile refreshes lock each chunk's customers before reading its loans"""
+        make_random_book(customers=5, seed=5)
+        versions = dict(Customer.objects.values_list('customer_id', 'loan_version'))
+        depth = len(connection.atomic_blocks)
+        calls = []
+        
+        def record(module, name):
+            real = getattr(module, name)
+            
+            def wrapper(*args, **kwargs):
+                calls.append((name, len(connection.atomic_blocks) - depth))
+                return real(*args, **kwargs)
+            return mock.patch.object(module, name, wrapper)
+        
+        with record(scoring, 'lock_customers'), record(scoring, '_score_chunk'):
+            scoring.rescore_customers(chunk_size=3)
+        self.assertEqual(calls, [('lock_customers', 1), ('_score_chunk', 1)] * 2)
+        # Applications decided against the old profiles lose their version claim and re-decide
+        for customer_id, version in Customer.objects.values_list('customer_id', 'loan_version'):
+            self.assertEqual(version, versions[customer_id] + 1)
+        
+        calls.clear()
+        with record(profiles, 'lock_customers'), record(profiles, 'compute_profiles'):
+            refresh_profiles(versions)
+        self.assertEqual(calls, [('lock_customers', 1), ('compute_profiles', 1)])
+
+
+class CreditScoreCacheTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+    
+    def check(self):
+        eligibility_data = {'customer_id': self.customer.customer_id, 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 12}
+        return self.client.post(reverse('check_eligibility'), data=json.dumps(eligibility_data), content_type='application/json')
+    
+    def test_repeated_checks_hit_cache(self):
+        """Test the score is computed once for repeated checks"""
+        for _ in range(3):
+            self.check()
+        
+        self.assertEqual(cache_stats(), {'hits': 2, 'stale_hits': 0, 'misses': 1})
+    
+    def test_loan_write_invalidates(self):
+        """Test creating a loan retires the cached score"""
+        self.check()
+        loan_data = {'customer_id': self.customer.customer_id, 'loan_amount': 100000, 'interest_rate': 15.0, 'tenure': 12}
+        self.client.post(reverse('create_loan'), data=json.dumps(loan_data), content_type='application/json')
+        self.check()
+        
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.loan_version, 1)
+        # create_loan reuses the first entry, the check after it cannot
+        self.assertEqual(cache_stats(), {'hits': 1, 'stale_hits': 0, 'misses': 2})
+    
+    def test_stale_entry_served_while_refreshing(self):
+        """Test an expired entry is returned and a background refresh is queued"""
+        cache.set(cache_key(self.customer), (77, 0), timeout=60)
+        
+        with mock.patch('loans.tasks.refresh_credit_score.apply_async') as apply_async:
+            self.assertEqual(cached_credit_score(self.customer), 77)
+            self.assertEqual(cached_credit_score(self.customer), 77)
+        
+        apply_async.assert_called_once_with((self.customer.customer_id,), retry=False)
+
+
+class EligibilityEngineTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def post(self, name, customer, **overrides):
+        loan_data = {'customer_id': customer.customer_id, 'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12}
+        loan_data.update(overrides)
+        return self.client.post(reverse(name), data=json.dumps(loan_data), content_type='application/json')
+    
+    def test_query_budget(self):
+        """Test a decision costs at most two queries with or without a profile"""
+        make_random_book(customers=20, seed=13)
+        customers = list(Customer.objects.all())
+        
+        # No profile yet: the customer row plus one aggregate over their loans
+        for customer in customers:
+            with self.assertNumQueries(2):
+                self.post('check_eligibility', customer)
+        
+        refresh_all_profiles()
+        cache.clear()
+        for customer in customers:
+            with self.assertNumQueries(1):
+                self.post('check_eligibility', customer)
+        
+        # Rejected applications never write, so they stay within the same budget
+        over_limit = make_customer(
+            first_name='Over', last_name='Limit', age=40, phone_number='7000000001',
+            monthly_salary=Decimal('10000'), approved_limit=Decimal('100000')
+        )
+        over_limit.loans.create(
+            loan_amount=Decimal('500000'), tenure=12, interest_rate=Decimal('10'),
+            monthly_repayment=Decimal('1000'), start_date='2020-01-01'
+        )
+        cache.clear()
+        with self.assertNumQueries(2):
+            response = self.post('create_loan', over_limit)
+        self.assertEqual(response.json()['message'], 'Credit score too low for loan approval')
+    
+    def test_rate_floors(self):
+        """Test both views agree on approval, corrected rate and message"""
+        customer = make_customer()
+        cases = [
+            (60, 10, True, '10.00', 'Loan approved successfully'),
+            (40, 10, False, '12.0', 'Interest rate too low for your credit score'),
+            (40, 12, True, '12.00', 'Loan approved successfully'),
+            (20, 15, False, '16.0', 'Interest rate too low for your credit score'),
+            (5, 20, False, '20.00', 'Credit score too low for loan approval'),
+        ]
+        for score, rate, approved, corrected, message in cases:
+            with mock.patch('loans.eligibility.cached_credit_score', return_value=score):
+                check = self.post('check_eligibility', customer, interest_rate=rate).json()
+                created = self.post('create_loan', customer, interest_rate=rate, loan_amount=1000).json()
+            self.assertEqual(check['approval'], approved, score)
+            self.assertEqual(Decimal(str(check['corrected_interest_rate'])), Decimal(corrected), score)
+            self.assertEqual(created['loan_approved'], approved, score)
+            self.assertEqual(created['message'], message, score)
+
+
+class BatchEligibilityTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def test_matches_single_checks(self):
+        """Test every batch result equals the single endpoint, in request order"""
+        make_random_book(customers=30, seed=17)
+        customer_ids = list(Customer.objects.values_list('customer_id', flat=True))
+        # Half the customers have profiles, half are aggregated from their loans
+        refresh_profiles(customer_ids[::2])
+        rng = random.Random(3)
+        payload = [
+            {
+                'customer_id': rng.choice(customer_ids),
+                'loan_amount': rng.randrange(1, 20) * 50000,
+                'interest_rate': rng.choice([0, 8.5, 11.99, 12, 14, 16, 18.25]),
+                'tenure': rng.randrange(1, 240),
+            }
+            for _ in range(200)
+        ]
+        
+        with self.assertNumQueries(3):
+            response = self.client.post(
+                reverse('check_eligibility_batch'), data=json.dumps(payload), content_type='application/json'
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()
+        self.assertEqual(len(results), len(payload))
+        for item, result in zip(payload, results):
+            single = self.client.post(reverse('check_eligibility'), data=json.dumps(item), content_type='application/json')
+            self.assertEqual(result, single.json())
+    
+    def test_inline_errors(self):
+        """Test invalid items and unknown customers are reported in place"""
+        customer = make_customer()
+        payload = [
+            {'customer_id': customer.customer_id, 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 12},
+            {'customer_id': customer.customer_id, 'loan_amount': -5, 'interest_rate': 12, 'tenure': 12},
+            {'customer_id': 99999, 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 12},
+        ]
+        
+        response = self.client.post(
+            reverse('check_eligibility_batch'), data=json.dumps(payload), content_type='application/json'
+        )
+        
+        results = response.json()
+        self.assertTrue(results[0]['approval'])
+        self.assertIn('loan_amount', results[1]['errors'])
+        self.assertEqual(results[2], {'customer_id': 99999, 'error': 'Customer not found'})
+        
+        response = self.client.post(
+            reverse('check_eligibility_batch'), data=json.dumps(payload[0]), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_installments_match_the_scalar_formula(self):
+        """Test the vectorized installments equal calculate_monthly_installment exactly, 0% rates included"""
+        grid = [
+            (Decimal(principal), Decimal(rate), tenure)
+            for principal in ('1000', '12345.67', '100000', '999999.99', '5000000')
+            for rate in ('0', '0.5', '7.25', '8', '10', '12', '12.5', '16', '33.33')
+            for tenure in (1, 6, 12, 13, 60, 360)
+        ]
+        
+        vectorized = monthly_installments(*zip(*grid))
+        
+        self.assertEqual(vectorized, [calculate_monthly_installment(*case) for case in grid])
+
+
+
+class BatchLoanCreationTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def applications(self, count=60, seed=5):
+        rng = random.Random(seed)
+        customer_ids = list(Customer.objects.values_list('customer_id', flat=True))
+        return [
+            {
+                'customer_id': rng.choice(customer_ids),
+                'loan_amount': rng.randrange(1, 10) * 100000,
+                'interest_rate': rng.choice([10, 12.5, 16, 17.5]),
+                'tenure': rng.randrange(6, 60),
+            }
+            for _ in range(count)
+        ]
+    
+    def test_matches_sequential_requests(self):
+        """Test a batch approves exactly what one request per loan would"""
+        make_random_book(customers=6, seed=21)
+        refresh_all_profiles()
+        payload = self.applications()
+        payload.append({'customer_id': 99999, 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 12})
+        payload.append({'customer_id': payload[0]['customer_id'], 'loan_amount': 1000, 'interest_rate': 12, 'tenure': 0})
+        
+        with transaction.atomic():
+            expected = [
+                self.client.post(reverse('create_loan'), data=json.dumps(item), content_type='application/json').json()
+                for item in payload
+            ]
+            transaction.set_rollback(True)
+        cache.clear()
+        loans_before = Loan.objects.count()
+        
+        response = self.client.post(reverse('create_loan_batch'), data=json.dumps(payload), content_type='application/json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()
+        self.assertEqual(len(results), len(payload))
+        for single, batch in zip(expected[:-2], results[:-2]):
+            self.assertEqual(batch['loan_id'] is None, single['loan_id'] is None)
+            single.pop('loan_id')
+            self.assertEqual({key: value for key, value in batch.items() if key != 'loan_id'}, single)
+        self.assertEqual(results[-2], {'customer_id': 99999, 'error': 'Customer not found'})
+        self.assertIn('tenure', results[-1]['errors'])
+        
+        approved = [result['loan_id'] for result in results if result.get('loan_id')]
+        self.assertTrue(approved)
+        self.assertEqual(Loan.objects.count(), loans_before + len(approved))
+        self.assertEqual(Loan.objects.filter(loan_id__in=approved).count(), len(approved))
+        self.assertEqual(list(find_drift()), [])
+    
+    def test_chunks_carry_state(self):
+        """Test later chunks see the loans approved by earlier ones"""
+        make_random_book(customers=4, seed=8)
+        serializer = LoanApplicationSerializer(data=self.applications(count=40, seed=9), many=True)
+        serializer.is_valid(raise_exception=True)
+        
+        one_chunk = create_loans(serializer.validated_data)
+        created = Loan.objects.filter(loan_id__in=[loan.loan_id for _, loan in one_chunk if loan])
+        approvals = [decision.approval for decision, _ in one_chunk]
+        self.assertIn(True, approvals)
+        self.assertIn(False, approvals)
+        created.delete()
+        refresh_all_profiles()
+        
+        in_chunks = create_loans(serializer.validated_data, chunk_size=7)
+        
+        self.assertEqual([decision.approval for decision, _ in in_chunks], approvals)
+    
+    def test_failed_chunk_is_reported_per_item(self):
+        """Test a chunk that fails to write is listed per item while the other chunks' loans are committed"""
+        customer = make_customer()
+        payload = [
+            {'customer_id': customer.customer_id, 'loan_amount': 10000, 'interest_rate': 16, 'tenure': 12}
+            for _ in range(6)
+        ]
+        real_bulk_create = Loan.objects.bulk_create
+        writes = []
+        
+        def bulk_create(objs, *args, **kwargs):
+            writes.append(len(objs))
+            if len(writes) == 2:
+                raise DatabaseError('disk full')
+            return real_bulk_create(objs, *args, **kwargs)
+        
+        with mock.patch('loans.views.create_loans', partial(create_loans, chunk_size=2)), \
+                mock.patch.object(Loan.objects, 'bulk_create', bulk_create), \
+                self.assertLogs('loans.eligibility', level='ERROR'):
+            response = self.client.post(reverse('create_loan_batch'), data=json.dumps(payload), content_type='application/json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()
+        self.assertEqual(writes, [2, 2, 2])
+        for result in results[2:4]:
+            self.assertEqual(result, {'customer_id': customer.customer_id, 'loan_id': None, 'error': BATCH_WRITE_FAILED})
+        created = [result['loan_id'] for result in results[:2] + results[4:]]
+        self.assertTrue(all(created))
+        self.assertEqual(sorted(Loan.objects.values_list('loan_id', flat=True)), sorted(created))
+        self.assertEqual(list(find_drift()), [])
+
+
+
+class ConcurrentLoanCreationTest(DecisionBufferMixin, TransactionTestCase):
+    """Parallel applications for one customer must not be approved past its limits"""
+    
+    requests = 200
+    threads = 16
+    
+    @classmethod
+    def setUpClass(cls):
+        # Threads on the shared in-memory SQLite test database fail on locks instead of waiting
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            cls.enterClassContext(file_sqlite_database())
+        super().setUpClass()
+    
+    def busy_customer(self, phone):
+        return make_customer(first_name='Busy', last_name=phone, age=35, phone_number=phone)
+    
+    def application(self, customer):
+        # At 12% approvals stop once the approved volume drags the score down to 30
+        return {'customer_id': customer.customer_id, 'loan_amount': 100000, 'interest_rate': 12, 'tenure': 12}
+    
+    def test_lost_version_race_answers_503(self):
+        """Test an application that loses every loan_version claim raises CustomerBusy and answers 503 with Retry-After"""
+        customer = self.busy_customer('9000000003')
+        real_load_customer = eligibility.load_customer
+        
+        def load_customer(customer_id):
+            loaded = real_load_customer(customer_id)
+            # Another application claims the customer between this read and its own claim
+            Customer.objects.filter(pk=customer_id).update(loan_version=F('loan_version') + 1)
+            return loaded
+        
+        with mock.patch.object(eligibility, 'load_customer', load_customer), \
+                override_settings(LOAN_CREATE_MAX_ATTEMPTS=3):
+            with self.assertRaises(CustomerBusy):
+                eligibility.apply_for_loan(customer.customer_id, Decimal('100000'), Decimal('12'), 12)
+            with self.assertLogs('loans.views', level='WARNING'):
+                response = self.client.post(
+                    reverse('create_loan'), data=json.dumps(self.application(customer)), content_type='application/json'
+                )
+        
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(customer.loans.exists())
+    
+    def test_parallel_requests_respect_limits(self):
+        cache.clear()
+        sequential, parallel = self.busy_customer('9000000001'), self.busy_customer('9000000002')
+        for _ in range(self.requests):
+            self.client.post(
+                reverse('create_loan'), data=json.dumps(self.application(sequential)), content_type='application/json'
+            )
+        expected = sequential.loans.count()
+        
+        def apply(_):
+            client = Client()
+            try:
+                while True:
+                    response = client.post(
+                        reverse('create_loan'), data=json.dumps(self.application(parallel)), content_type='application/json'
+                    )
+                    # Retry after a 503 like a well behaved client, minus the wait
+                    if response.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+                        return response.status_code
+            finally:
+                connection.close()
+        
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            codes = list(pool.map(apply, range(self.requests)))
+        
+        approved = parallel.loans.count()
+        self.assertEqual(set(codes), {status.HTTP_200_OK, status.HTTP_201_CREATED})
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), approved)
+        # Same number of loans as one request at a time, however the races went
+        self.assertEqual(approved, expected)
+        self.assertGreater(expected, 0)
+        self.assertLess(expected, self.requests)
+        self.assertEqual(list(find_drift()), [])
+        connection.close()
+
+
+class AsyncReadPathTest(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.loans = [
+            make_loan(
+                self.customer, loan_amount=Decimal(amount), interest_rate=Decimal('12.5'),
+                emis_paid_on_time=3, start_date='2024-01-01'
+            )
+            for amount in ('100000', '250000.50')
+        ]
+    
+    async def test_async_views_match_sync(self):
+        """Test the async endpoints return the same bodies and statuses as the DRF views"""
+        async_client = AsyncClient()
+        pairs = [
+            ('view_loan', 'view_loan_async', {'loan_id': self.loans[1].loan_id}),
+            ('view_loan', 'view_loan_async', {'loan_id': 99999}),
+            ('view_loans_by_customer', 'view_loans_by_customer_async', {'customer_id': self.customer.customer_id}),
+            ('view_loans_by_customer', 'view_loans_by_customer_async', {'customer_id': 99999}),
+        ]
+        for sync_name, async_name, kwargs in pairs:
+            expected = await sync_to_async(self.client.get)(reverse(sync_name, kwargs=kwargs))
+            response = await async_client.get(reverse(async_name, kwargs=kwargs))
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.json(), expected.json())
+        
+        response = await async_client.post(reverse('view_loan_async', kwargs={'loan_id': self.loans[0].loan_id}))
+        self.assertEqual(response.status_code, 405)
+
+
+class ReadBenchmarkCommandTest(LiveServerTestCase):
+    # The live server only speaks WSGI, so the asgi_* targets below reach the async views through it and
+    # their timings are not checked; AsyncReadPathTest runs those views under ASGI through AsyncClient
+    
+    def test_benchmark_records_all_targets(self):
+        """Test the WSGI endpoints are timed and the run is appended as JSON"""
+        customer = make_customer()
+        loan = make_loan(customer, start_date='2024-01-01')
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'reads.json')
+            call_command(
+                'benchmark_reads', wsgi_url=self.live_server_url, asgi_url=self.live_server_url,
+                loan_id=loan.loan_id, customer_id=customer.customer_id, requests=20, concurrency=4,
+                output=output, stdout=StringIO(),
+            )
+            with open(output) as handle:
+                runs = json.load(handle)
+        
+        results = runs[0]['results']
+        self.assertEqual(set(results), {'wsgi_view_loan', 'asgi_view_loan', 'wsgi_view_loans', 'asgi_view_loans'})
+        for name in ('wsgi_view_loan', 'wsgi_view_loans'):
+            self.assertEqual(results[name]['errors'], 0)
+            self.assertEqual(results[name]['requests'], 20)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        for index in range(25):
+            make_loan(
+                self.customer, loan_amount=Decimal('1000'), interest_rate=Decimal('10'),
+                monthly_repayment=Decimal('100'), end_date=date(2025, 1, 1) if index % 3 == 0 else None
+            )
+        self.url = reverse('view_loans_by_customer', kwargs={'customer_id': self.customer.customer_id})
+    
+    def walk(self, url):
+        """Follow rel="next" links, returning every loan_id seen and the queries of each page"""
+        seen, pages = [], []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [loan['loan_id'] for loan in response.json()]
+            pages.append([query['sql'] for query in queries.captured_queries])
+            match = re.search(r'<([^>]+)>; rel="next"', response.get('Link', ''))
+            url = match.group(1) if match else None
+        return seen, pages
+    
+    def test_pages_cover_all_loans_without_offset(self):
+        """Test following next links returns every loan once, in loan_id order, seeking by key"""
+        seen, pages = self.walk(f'{self.url}?limit=10')
+        
+        self.assertEqual(seen, list(self.customer.loans.order_by('loan_id').values_list('loan_id', flat=True)))
+        self.assertEqual(len(pages), 3)
+        for queries in pages:
+            self.assertEqual(len(queries), 2)
+            self.assertNotIn('OFFSET', queries[-1].upper())
+        self.assertIn('"loans"."loan_id" >', pages[-1][-1])
+    
+    def test_status_filter(self):
+        """Test ?status=active and ?status=closed split the loans by end_date"""
+        active, _ = self.walk(f'{self.url}?status=active&limit=4')
+        closed, _ = self.walk(f'{self.url}?status=closed&limit=4')
+        
+        self.assertEqual(len(active), 16)
+        self.assertEqual(len(closed), 9)
+        self.assertEqual(sorted(active + closed), sorted(self.customer.loans.values_list('loan_id', flat=True)))
+        self.assertEqual(self.client.get(f'{self.url}?status=pending').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f'{self.url}?cursor=bogus').status_code, status.HTTP_404_NOT_FOUND)
+    
+    async def test_async_view_pages_alike(self):
+        """Test the async endpoint returns the same page and Link header"""
+        async_url = reverse('view_loans_by_customer_async', kwargs={'customer_id': self.customer.customer_id})
+        expected = await sync_to_async(self.client.get)(f'{self.url}?limit=5&status=active')
+        response = await AsyncClient().get(f'{async_url}?limit=5&status=active')
+        
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['Link'].replace('/async', ''), expected['Link'])
+
+
+class LoanExportTest(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        other = make_customer(
+            first_name='Jane', last_name='Roe', age=41, phone_number='1234567891',
+            monthly_salary=Decimal('90000'), approved_limit=Decimal('3200000')
+        )
+        for index, owner in enumerate([self.customer] * 7 + [other] * 3):
+            make_loan(
+                owner, loan_amount=Decimal('1000.5') * (index + 1), interest_rate=Decimal('10.25'),
+                monthly_repayment=Decimal('88.1'), emis_paid_on_time=index * 2,
+                end_date=date(2025, 1, 1) if index % 2 else None
+            )
+    
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    
+    def test_customer_export_matches_serializer(self):
+        """Test each line equals the LoanListSerializer output for that loan"""
+        url = reverse('export_customer_loans', kwargs={'customer_id': self.customer.customer_id})
+        rows = self.read(self.client.get(url, HTTP_ACCEPT='application/x-ndjson'))
+        
+        expected = json.loads(json.dumps(LoanListSerializer(self.customer.loans.order_by('loan_id'), many=True).data))
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(self.read(self.client.get(f'{url}?status=active'))), 4)
+        missing = reverse('export_customer_loans', kwargs={'customer_id': 99999})
+        self.assertEqual(self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_full_book_is_staff_only(self):
+        """Test the whole-book export redirects anonymous users and streams for staff"""
+        url = reverse('export_loan_book')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        rows = self.read(self.client.get(url))
+        
+        self.assertEqual([row['loan_id'] for row in rows], sorted(Loan.objects.values_list('loan_id', flat=True)))
+        self.assertEqual(rows[0]['start_date'], '2024-01-01')
+        self.assertEqual(rows[0]['customer_id'], self.customer.customer_id)
+
+
+class LoanDetailCachingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+        self.loan = make_loan(self.customer)
+        self.url = reverse('view_loan', kwargs={'loan_id': self.loan.loan_id})
+    
+    def test_revalidation_returns_304(self):
+        """Test If-None-Match and If-Modified-Since short-circuit to 304 in one query"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_cached_body_until_loan_or_customer_changes(self):
+        """Test repeat reads skip the detail query and any write serves a new version"""
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, first.content)
+        
+        self.loan.emis_paid_on_time = 5
+        self.loan.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['repayments_left'], 7)
+        
+        # update() sends no signal, the stamp still moves the version
+        second = response['ETag']
+        self.assertTrue(close_loan(self.loan))
+        self.assertNotEqual(self.client.get(self.url)['ETag'], second)
+        
+        self.customer.first_name = 'Jonathan'
+        self.customer.save()
+        self.assertEqual(self.client.get(self.url).json()['customer']['first_name'], 'Jonathan')
+    
+    def test_missing_loan(self):
+        response = self.client.get(reverse('view_loan', kwargs={'loan_id': 99999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {'error': 'Loan not found'})
+
+
+class FastSerializationTest(TestCase):
+    def setUp(self):
+        self.customer = make_customer(first_name='Zoë', last_name='O Brien')
+        for index, paid in enumerate([0, 5, 15]):
+            make_loan(
+                self.customer, loan_amount=Decimal('100000.5') + index, interest_rate=Decimal('12.25'),
+                monthly_repayment=Decimal('8884.8'), emis_paid_on_time=paid
+            )
+    
+    def test_same_bytes_as_serializers(self):
+        """Test the values() path renders exactly what the ModelSerializers render"""
+        loans = self.customer.loans.order_by('loan_id')
+        self.assertEqual(
+            render(encode_rows(loan_list_rows(loans))),
+            JSONRenderer().render(LoanListSerializer(loans, many=True).data),
+        )
+        for loan in loans:
+            self.assertEqual(render(loan_detail(loan.loan_id)), JSONRenderer().render(LoanDetailSerializer(loan).data))
+        self.assertIsNone(loan_detail(99999))
+    
+    def test_list_endpoint_uses_one_query_per_page(self):
+        """Test a page costs the customer lookup plus one values() query"""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('view_loans_by_customer', kwargs={'customer_id': self.customer.customer_id}))
+        self.assertEqual([loan['repayments_left'] for loan in response.json()], [12, 7, 0])
+        self.assertEqual(response.json()[0]['loan_amount'], '100000.50')
+    
+    def test_benchmark_command(self):
+        """Test the benchmark checks both paths agree and appends its run"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'serialization.json')
+            call_command('benchmark_serialization', loans=50, repeat=1, output=output, stdout=StringIO())
+            with open(output) as handle:
+                runs = json.load(handle)
+        
+        self.assertEqual(set(runs[0]['results']), {'serializer', 'values'})
+        self.assertEqual(runs[0]['loans'], 50)
+        # The fixture loans were rolled back
+        self.assertEqual(Loan.objects.count(), 3)
+
+
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN every statement a hot path runs and fail on full table scans
+
+    Plans are read with EXPLAIN QUERY PLAN on SQLite and EXPLAIN on
+    PostgreSQL, where sequential scans are disabled for the check because
+    the planner prefers them on tables this small whatever indexes exist.
+    """
+    def setUp(self):
+        self.customer = make_customer()
+        self.loans = [
+            make_loan(self.customer, end_date=end_date)
+            for end_date in [None, date(2025, 1, 1)]
+        ]
+    
+    def full_scans(self, sql):
+        """Plan lines of ``sql`` that read a whole table"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall() if 'Seq Scan' in row[0]]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            # "SCAN t USING INDEX i" walks an index; a bare "SCAN t" reads every row
+            return [row[-1] for row in cursor.fetchall() if row[-1].startswith('SCAN') and 'USING' not in row[-1]]
+    
+    def assertNoFullScans(self, run):
+        with CaptureQueriesContext(connection) as captured:
+            run()
+        statements = [query['sql'] for query in captured.captured_queries
+                      if query['sql'].split(' ', 1)[0] in ('SELECT', 'UPDATE')]
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertEqual(self.full_scans(sql), [], sql)
+    
+    def test_hot_paths_use_indexes(self):
+        customer_id = self.customer.customer_id
+        hot_paths = {
+            'loan summary': lambda: Customer.objects.get(pk=customer_id).loan_summary(2024),
+            'open exposure': lambda: compute_exposures([customer_id]),
+            'exposure reset': lambda: reset_exposures([customer_id]),
+            'active loans page': lambda: self.client.get(
+                reverse('view_loans_by_customer', kwargs={'customer_id': customer_id}), {'status': 'active'}
+            ),
+            'loan detail': lambda: self.client.get(reverse('view_loan', kwargs={'loan_id': self.loans[0].loan_id})),
+            'loans per year': lambda: list(Loan.objects.filter(customer_id=customer_id, start_date__year=2024)),
+            'admin start_date filter': lambda: list(Loan.objects.filter(
+                start_date__gte=date(2024, 1, 1), start_date__lt=date(2024, 2, 1)
+            )),
+            'admin end_date filter': lambda: list(Loan.objects.filter(end_date__gte=date(2025, 1, 1))),
+            'admin interest_rate filter': lambda: list(Loan.objects.filter(interest_rate=Decimal('12'))),
+        }
+        for name, run in hot_paths.items():
+            with self.subTest(name):
+                self.assertNoFullScans(run)
+    
+    def test_year_lookup_is_a_date_range(self):
+        # Django compiles __year on a DateField to a BETWEEN the (customer, start_date) index serves
+        sql = str(Loan.objects.filter(start_date__year=2024).query)
+        self.assertNotIn('strftime', sql.lower())
+        self.assertIn('BETWEEN 2024-01-01 AND 2024-12-31', sql)
+
+
+class AsyncLoanApplicationTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+    
+    def apply(self, interest_rate=12, **extra):
+        payload = {
+            'customer_id': self.customer.customer_id, 'loan_amount': 100000,
+            'interest_rate': interest_rate, 'tenure': 12,
+        }
+        return self.client.post(
+            reverse('create_loan'), data=json.dumps(payload), content_type='application/json', **extra
+        )
+    
+    def poll(self, application_id):
+        return self.client.get(reverse('view_application', kwargs={'application_id': application_id}))
+    
+    def test_queued_application_is_decided_by_task(self):
+        """Test a PENDING application is queued on commit and the task links the loan"""
+        with mock.patch('loans.views.process_loan_application.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.apply(HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        application_id = response.json()['application_id']
+        self.assertEqual(response['Location'], reverse('view_application', kwargs={'application_id': application_id}))
+        apply_async.assert_called_once_with((application_id,), retry=False)
+        self.assertEqual(self.poll(application_id).json()['status'], 'PENDING')
+        self.assertFalse(Loan.objects.exists())
+        
+        self.assertEqual(process_loan_application(application_id), 'APPROVED')
+        result = self.poll(application_id).json()
+        self.assertEqual(result['status'], 'APPROVED')
+        self.assertTrue(result['loan_approved'])
+        self.assertEqual(result['loan_id'], Loan.objects.get().loan_id)
+        self.assertEqual(result['monthly_installment'], 8884.88)
+        
+        # A redelivered task leaves the decided application alone
+        self.assertEqual(process_loan_application(application_id), 'APPROVED')
+        self.assertEqual(Loan.objects.count(), 1)
+    
+    def test_rejection_reason(self):
+        """Test a rejected application reports the decision message"""
+        with self.settings(LOAN_APPLICATIONS_ASYNC=True):
+            with mock.patch('loans.views.process_loan_application.apply_async'):
+                response = self.apply(interest_rate=10)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        process_application(response.json()['application_id'])
+        
+        result = self.poll(response.json()['application_id']).json()
+        self.assertEqual(result['status'], 'REJECTED')
+        self.assertEqual(result['message'], RATE_TOO_LOW)
+        self.assertIsNone(result['loan_id'])
+    
+    def test_decided_inline_without_broker(self):
+        """Test the application is still decided, loudly, when the task cannot be queued"""
+        with mock.patch('loans.views.process_loan_application.apply_async', side_effect=OSError('no broker')):
+            with self.assertLogs('loans.views', level='ERROR') as logs:
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.apply(HTTP_PREFER='respond-async')
+        self.assertIn('deciding it inline: no broker', logs.output[0])
+        self.assertEqual(self.poll(response.json()['application_id']).json()['status'], 'APPROVED')
+    
+    def test_decided_without_holding_the_application_lock(self):
+        """Test the decision runs outside the transaction that locks the application"""
+        with mock.patch('loans.views.process_loan_application.apply_async'):
+            application_id = self.apply(HTTP_PREFER='respond-async').json()['application_id']
+        depth = len(connection.atomic_blocks)
+        depths = []
+        real_decide = eligibility.decide
+        
+        def decide(*args):
+            depths.append(len(connection.atomic_blocks))
+            return real_decide(*args)
+        
+        with mock.patch.object(eligibility, 'decide', decide):
+            self.assertEqual(eligibility.process_application(application_id).status, 'APPROVED')
+        self.assertEqual(depths, [depth])
+    
+    def test_busy_application_is_rejected_once_retries_run_out(self):
+        """Test an application that stays busy through every retry ends REJECTED instead of PENDING"""
+        with mock.patch('loans.views.process_loan_application.apply_async'):
+            application_id = self.apply(HTTP_PREFER='respond-async').json()['application_id']
+        busy = mock.Mock(side_effect=CustomerBusy(self.customer.customer_id))
+        with mock.patch('loans.tasks.process_application', busy):
+            with self.assertLogs('loans.tasks', level='ERROR'):
+                result = process_loan_application.apply((application_id,))
+        
+        self.assertEqual(result.get(), 'REJECTED')
+        self.assertEqual(busy.call_count, process_loan_application.max_retries + 1)
+        response = self.poll(application_id).json()
+        self.assertEqual((response['status'], response['message']), ('REJECTED', CUSTOMER_BUSY))
+        self.assertFalse(Loan.objects.exists())
+    
+    def test_sync_mode_and_missing_records(self):
+        """Test create_loan stays synchronous by default and 404s are reported"""
+        self.assertEqual(self.apply().status_code, status.HTTP_201_CREATED)
+        
+        self.customer.customer_id = 99999
+        response = self.apply(HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.poll(99999).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DecisionLogTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+    
+    def post(self, name, payload):
+        return self.client.post(reverse(name), data=json.dumps(payload), content_type='application/json')
+    
+    def application(self, interest_rate):
+        return {
+            'customer_id': self.customer.customer_id, 'loan_amount': 100000,
+            'interest_rate': interest_rate, 'tenure': 12,
+        }
+    
+    def test_decisions_are_buffered_then_flushed(self):
+        """Test requests only buffer their decisions and a flush writes them in one batch"""
+        self.post('check_eligibility', self.application(10))
+        self.post('create_loan', self.application(12))
+        self.post('create_loan_batch', [self.application(10), self.application(12)])
+        self.assertFalse(DecisionLog.objects.exists())
+        self.assertEqual(stats()['depth'], 4)
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(flush(), 4)
+        self.assertEqual(stats(), {'depth': 0, 'dropped': 0, 'flushed': 4})
+        
+        logs = list(DecisionLog.objects.order_by('id'))
+        self.assertEqual([log.kind for log in logs], ['ELIGIBILITY', 'LOAN', 'LOAN', 'LOAN'])
+        # After the first loan the score clears 50 and any rate is accepted
+        self.assertEqual([log.approval for log in logs], [False, True, True, True])
+        self.assertEqual(logs[0].message, RATE_TOO_LOW)
+        self.assertEqual(logs[0].corrected_interest_rate, Decimal('12'))
+        self.assertEqual(logs[0].credit_score, 50)
+        self.assertEqual(
+            [log.loan_id for log in logs if log.approval],
+            list(Loan.objects.order_by('loan_id').values_list('loan_id', flat=True)),
+        )
+        self.assertEqual(logs[1].monthly_installment, Decimal('8884.88'))
+    
+    def test_flush_when_batch_full_or_old(self):
+        """Test the end of a request flushes on size or age, not before"""
+        with self.settings(DECISION_LOG_BATCH_SIZE=2, DECISION_LOG_FLUSH_INTERVAL=3600):
+            self.post('check_eligibility', self.application(12))
+            self.assertEqual(DecisionLog.objects.count(), 0)
+            self.post('check_eligibility', self.application(12))
+            self.assertEqual(DecisionLog.objects.count(), 2)
+        with self.settings(DECISION_LOG_BATCH_SIZE=100, DECISION_LOG_FLUSH_INTERVAL=0):
+            self.post('check_eligibility', self.application(12))
+            self.assertEqual(DecisionLog.objects.count(), 3)
+    
+    def test_full_buffer_drops_and_failed_flush_keeps(self):
+        """Test records past the buffer limit are dropped and counted, a failed write is retried"""
+        with self.settings(DECISION_LOG_MAX_BUFFER=2):
+            for _ in range(3):
+                self.post('check_eligibility', self.application(12))
+        self.assertEqual(stats(), {'depth': 2, 'dropped': 1, 'flushed': 0})
+        
+        with mock.patch.object(DecisionLog.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            self.assertEqual(flush(), 0)
+        self.assertEqual(stats()['depth'], 2)
+        self.assertEqual(flush(), 2)
+        self.assertEqual(DecisionLog.objects.count(), 2)
+
+
+class MetricsTest(DecisionBufferMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+        self.customer = make_customer()
+    
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+    
+    def test_requests_recorded_per_url_name(self):
+        """Test counts, latency, query and size histograms are exported per URL name"""
+        url = reverse('view_loans_by_customer', kwargs={'customer_id': self.customer.customer_id})
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(reverse('view_loan', kwargs={'loan_id': 99999}))
+        self.client.get('/no-such-page/')
+        
+        text = self.scrape()
+        self.assertIn('loans_http_requests_total{view="view_loans_by_customer",method="GET",status="200"} 2', text)
+        self.assertIn('loans_http_requests_total{view="view_loan",method="GET",status="404"} 1', text)
+        self.assertIn('loans_http_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('# TYPE loans_http_request_duration_seconds histogram', text)
+        self.assertIn('loans_http_request_duration_seconds_count{view="view_loans_by_customer"} 2', text)
+        self.assertIn('loans_http_request_duration_seconds_bucket{view="view_loans_by_customer",le="+Inf"} 2', text)
+        # Customer lookup and one page query per request, both under the le="2" bucket
+        self.assertIn('loans_http_request_queries_bucket{view="view_loans_by_customer",le="2"} 2', text)
+        self.assertIn('loans_http_request_queries_sum{view="view_loans_by_customer"} 4', text)
+        self.assertIn('loans_http_response_size_bytes_count{view="view_loans_by_customer"} 2', text)
+        self.assertRegex(text, r'\nloans_decision_log_buffer_depth \d+\n')
+        self.assertRegex(text, r'\nloans_decision_log_dropped_total \d+\n')
+    
+    async def test_asgi_requests_stay_async(self):
+        """Test ASGI requests pass the middleware without being adapted to sync and are still measured"""
+        with self.settings(DEBUG=True), mock.patch('django.core.handlers.base.logger') as handler_logger:
+            ASGIHandler()
+        adapted = [call for call in handler_logger.debug.call_args_list if 'adapted' in call.args[0]]
+        self.assertNotIn('MetricsMiddleware', str(adapted))
+        
+        url = reverse('view_loans_by_customer_async', kwargs={'customer_id': self.customer.customer_id})
+        publish_if_due = metrics.publish_if_due
+        publishing_threads = []
+        
+        def record_thread():
+            publishing_threads.append(threading.get_ident())
+            publish_if_due()
+        
+        with mock.patch.object(metrics, 'publish_if_due', record_thread):
+            response = await AsyncClient().get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Publishing may block on the cache, so it stays off the event loop
+        self.assertEqual(len(publishing_threads), 1)
+        self.assertNotEqual(publishing_threads[0], threading.get_ident())
+        
+        text = await sync_to_async(self.scrape)()
+        self.assertIn('loans_http_requests_total{view="view_loans_by_customer_async",method="GET",status="200"} 1', text)
+        # Run in the sync_to_async thread of the async view, where the query timer is installed
+        self.assertIn('loans_http_request_queries_sum{view="view_loans_by_customer_async"} 2', text)
+    
+    def test_celery_task_timings(self):
+        """Test task run times are exported by task name and state"""
+        task_prerun.send(sender=refresh_credit_score, task_id='abc', task=refresh_credit_score)
+        task_postrun.send(sender=refresh_credit_score, task_id='abc', task=refresh_credit_score, state='SUCCESS')
+        
+        text = self.scrape()
+        self.assertIn('loans_celery_tasks_total{state="SUCCESS",task="loans.tasks.refresh_credit_score"} 1', text)
+        self.assertIn('loans_celery_task_duration_seconds_count{task="loans.tasks.refresh_credit_score"} 1', text)
+    
+    def test_snapshots_of_other_processes_are_summed(self):
+        """Test /metrics adds up every published process and forgets expired ones"""
+        self.client.get(reverse('view_loans_by_customer', kwargs={'customer_id': self.customer.customer_id}))
+        other = [['loans_http_requests_total', (('view', 'view_loans_by_customer'), ('method', 'GET'), ('status', '200')), 5]]
+        cache.set('metrics:process:other:1', other)
+        cache.set(metrics.INDEX_KEY, ['metrics:process:other:1', 'metrics:process:gone:2'])
+        
+        text = self.scrape()
+        self.assertIn('loans_http_requests_total{view="view_loans_by_customer",method="GET",status="200"} 6', text)
+        self.assertNotIn('metrics:process:gone:2', cache.get(metrics.INDEX_KEY))
+    
+    def test_index_edits_wait_for_the_lock(self):
+        """Test a process does not rewrite the index list while another process holds its lock"""
+        cache.add(metrics.INDEX_LOCK_KEY, 1)
+        metrics.publish()
+        self.assertIsNone(cache.get(metrics.INDEX_KEY))
+        
+        cache.delete(metrics.INDEX_LOCK_KEY)
+        metrics.publish()
+        self.assertEqual(cache.get(metrics.INDEX_KEY), [metrics._process_key()])
+    
+    def test_redis_index_is_a_set(self):
+        """Test with Redis processes join and leave the index with SADD and SREM"""
+        client = mock.Mock()
+        client.smembers.return_value = {metrics._process_key().encode(), b'metrics:process:gone:2'}
+        with mock.patch.object(metrics, '_redis_index', return_value=(client, ':1:metrics:processes')):
+            metrics.publish()
+            text = self.scrape()
+        
+        client.sadd.assert_called_with(':1:metrics:processes', metrics._process_key())
+        client.srem.assert_called_once_with(':1:metrics:processes', 'metrics:process:gone:2')
+        self.assertIsNone(cache.get(metrics.INDEX_KEY))
+        self.assertRegex(text, r'\nloans_decision_log_buffer_depth \d+\n')
+    
+    def test_redis_index_uses_a_public_client(self):
+        """Test the Redis index goes through a redis-py client on the cache's first server"""
+        location = 'redis://cache-1:6379/2,redis://cache-2:6379/2'
+        redis_cache = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': location}}
+        with self.settings(CACHES=redis_cache):
+            client, index = metrics._redis_index()
+            self.assertIs(metrics._redis_index()[0], client)
+        
+        self.assertIsInstance(client, redis.Redis)
+        self.assertEqual(client.connection_pool.connection_kwargs['host'], 'cache-1')
+        self.assertEqual(client.connection_pool.connection_kwargs['db'], 2)
+        self.assertEqual(index, ':1:metrics:processes')
+        self.assertEqual(metrics._redis_index(), (None, None))
+    
+    def test_process_local_cache_warns(self):
+        """Test LocMemCache outside DEBUG logs that /metrics only covers one process"""
+        with self.settings(DEBUG=False), self.assertLogs('loans.metrics', level='WARNING') as logs:
+            metrics.warn_if_process_local()
+        self.assertIn('LocMemCache', logs.output[0])
+        with self.settings(DEBUG=True), self.assertNoLogs('loans.metrics', level='WARNING'):
+            metrics.warn_if_process_local()
+
+
+# Most queries one request to each endpoint of loans/urls.py may run, savepoints included. Checked
+# against customers with 1, 10 and 1000 loans, so a cost that grows with history fails here
+QUERY_BUDGETS = {
+    'home': 0,
+    # Phone number uniqueness check and insert
+    'register_customer': 2,
+    'check_eligibility': 1,
+    'check_eligibility_batch': 1,
+    # Customer, version claim, insert and the profile update, inside savepoints
+    'create_loan': 9,
+    'create_loan_batch': 8,
+    'view_application': 1,
+    # ETag validators, then the detail row on a cache miss
+    'view_loan': 2,
+    'view_loans_by_customer': 2,
+    'export_customer_loans': 2,
+    # Session and staff user, then one cursor over the book
+    'export_loan_book': 3,
+    'metrics': 0,
+    'view_loan_async': 1,
+    'view_loans_by_customer_async': 2,
+    # Admin change lists, where Loan.__str__ used to load each row's customer
+    'admin:loans_loan_changelist': 6,
+    'admin:loans_loanapplication_changelist': 5,
+}
+
+
+# A due decision log flush runs at the end of whichever request finishes next, keep it out of the counts
+@override_settings(DECISION_LOG_FLUSH_INTERVAL=3600)
+class QueryBudgetTest(DecisionBufferMixin, TestCase):
+    HISTORY_SIZES = [1, 10, 1000]
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = []
+        for size in cls.HISTORY_SIZES:
+            customer = make_customer(
+                last_name=f'Doe {size}', phone_number=f'99900{size}', monthly_salary=Decimal('2000000'),
+                approved_limit=Decimal('72000000')
+            )
+            Loan.objects.bulk_create(
+                Loan(
+                    customer=customer, loan_amount=Decimal('10000'), tenure=12, interest_rate=Decimal('14'),
+                    monthly_repayment=Decimal('897.85'), emis_paid_on_time=12, start_date=date(2020, 1, 1),
+                    end_date=date(2021, 1, 1) if index % 2 else None,
+                )
+                for index in range(size)
+            )
+            loan = customer.loans.order_by('loan_id').first()
+            LoanApplication.objects.create(
+                customer=customer, loan_amount=loan.loan_amount, interest_rate=loan.interest_rate,
+                tenure=loan.tenure, status=LoanApplication.APPROVED, approved_loan=loan,
+            )
+            cls.customers.append(customer)
+        refresh_all_profiles()
+        cls.staff = User.objects.create_user('staff', password='secret', is_staff=True, is_superuser=True)
+    
+    def setUp(self):
+        cache.clear()
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+    
+    def request_for(self, name, customer, index):
+        """(client, method, url, JSON payload) of a typical request to ``name`` for ``customer``"""
+        application = {'customer_id': customer.customer_id, 'loan_amount': 50000, 'interest_rate': 16, 'tenure': 12}
+        if name == 'register_customer':
+            return self.client, 'post', reverse(name), {
+                'first_name': 'Jane', 'last_name': 'Roe', 'age': 30, 'monthly_income': 50000,
+                'phone_number': f'55500{index}',
+            }
+        if name in ('check_eligibility', 'create_loan'):
+            return self.client, 'post', reverse(name), application
+        if name in ('check_eligibility_batch', 'create_loan_batch'):
+            return self.client, 'post', reverse(name), [application] * 3
+        if name == 'view_application':
+            application_id = LoanApplication.objects.get(customer=customer).pk
+            return self.client, 'get', reverse(name, kwargs={'application_id': application_id}), None
+        if name in ('view_loan', 'view_loan_async'):
+            loan_id = customer.loans.order_by('loan_id').values_list('loan_id', flat=True).first()
+            return self.client, 'get', reverse(name, kwargs={'loan_id': loan_id}), None
+        if name in ('view_loans_by_customer', 'view_loans_by_customer_async', 'export_customer_loans'):
+            return self.client, 'get', reverse(name, kwargs={'customer_id': customer.customer_id}), None
+        if name == 'export_loan_book' or name.startswith('admin:'):
+            return self.staff_client, 'get', reverse(name), None
+        return self.client, 'get', reverse(name), None
+    
+    def queries_for(self, name, customer, index):
+        """Statements run by one request to ``name``, including while streaming the response"""
+        client, method, url, payload = self.request_for(name, customer, index)
+        with CaptureQueriesContext(connection) as captured:
+            if method == 'post':
+                response = client.post(url, data=json.dumps(payload), content_type='application/json')
+            else:
+                response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, name)
+        return [query['sql'] for query in captured.captured_queries]
+    
+    def test_every_endpoint_has_a_budget(self):
+        self.assertEqual({pattern.name for pattern in urlpatterns} - set(QUERY_BUDGETS), set())
+    
+    def test_endpoints_stay_within_budget(self):
+        for name, budget in QUERY_BUDGETS.items():
+            counts = []
+            for index, customer in enumerate(self.customers):
+                with self.subTest(name, loans=self.HISTORY_SIZES[index]):
+                    queries = self.queries_for(name, customer, index)
+                    counts.append(len(queries))
+                    self.assertLessEqual(len(queries), budget, '\n'.join(queries))
+            with self.subTest(name, check='flat'):
+                self.assertEqual(len(set(counts)), 1, f'{name} query count varies with history size: {counts}')
+    
+    def test_loan_str_costs_no_query(self):
+        """Test naming loans and applications does not load each one's customer"""
+        loans = list(Loan.objects.all()[:20])
+        applications = list(LoanApplication.objects.all())
+        with self.assertNumQueries(0):
+            names = [str(loan) for loan in loans] + [str(application) for application in applications]
+        self.assertIn(f'customer {loans[0].customer_id}', names[0])
+        self.assertIn('John Doe 1', str(Loan.objects.select_related('customer').first()))
+
+
+class NPlusOneDetectorTest(TestCase):
+    def setUp(self):
+        customer = make_customer()
+        for _ in range(6):
+            make_loan(customer)
+    
+    def test_repeated_statements_are_logged(self):
+        """Test a statement run once per row is reported with its count"""
+        def n_plus_one(request):
+            return HttpResponse(', '.join(loan.customer.full_name for loan in Loan.objects.all()))
+        
+        with self.assertRaises(MiddlewareNotUsed):
+            NPlusOneDetectorMiddleware(n_plus_one)
+        
+        with self.settings(N_PLUS_ONE_DETECTOR=True):
+            middleware = NPlusOneDetectorMiddleware(n_plus_one)
+        with self.assertLogs('loans.middleware', level='WARNING') as logs:
+            middleware(RequestFactory().get('/view-loans/1/'))
+        [line] = logs.output
+        self.assertIn('GET /view-loans/1/: 6 runs of SELECT', line)
+        self.assertIn('FROM "customers"', line)
+    
+    async def test_async_requests_are_checked_without_adaptation(self):
+        """Test under ASGI the detector runs natively and still sees the view's queries"""
+        with self.settings(DEBUG=True, N_PLUS_ONE_DETECTOR=True), \
+                mock.patch('django.core.handlers.base.logger') as handler_logger:
+            ASGIHandler()
+        adapted = [call for call in handler_logger.debug.call_args_list if 'adapted' in call.args[0]]
+        self.assertNotIn('NPlusOneDetectorMiddleware', str(adapted))
+        
+        def names():
+            return ', '.join(loan.customer.full_name for loan in Loan.objects.all())
+        
+        async def n_plus_one(request):
+            return HttpResponse(await sync_to_async(names)())
+        
+        with self.settings(N_PLUS_ONE_DETECTOR=True):
+            middleware = NPlusOneDetectorMiddleware(n_plus_one)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('loans.middleware', level='WARNING') as logs:
+            await middleware(RequestFactory().get('/async/view-loans/1/'))
+        [line] = logs.output
+        self.assertIn('GET /async/view-loans/1/: 6 runs of SELECT', line)
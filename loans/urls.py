@@ -5,7 +5,16 @@ urlpatterns = [
     path('', views.home_page, name='home'),
     path('register/', views.register_customer, name='register_customer'),
     path('check-eligibility/', views.check_eligibility, name='check_eligibility'),
+    path('check-eligibility/batch/', views.check_eligibility_batch, name='check_eligibility_batch'),
     path('create-loan/', views.create_loan, name='create_loan'),
+    path('create-loan/batch/', views.create_loan_batch, name='create_loan_batch'),
+    path('application/<int:application_id>/', views.view_application, name='view_application'),
     path('view-loan/<int:loan_id>/', views.view_loan, name='view_loan'),
     path('view-loans/<int:customer_id>/', views.view_loans_by_customer, name='view_loans_by_customer'),
+    path('view-loans/<int:customer_id>/export.ndjson', views.export_customer_loans, name='export_customer_loans'),
+    path('export/loans.ndjson', views.export_loan_book, name='export_loan_book'),
+    path('metrics', views.metrics_view, name='metrics'),
+    # Async ORM read path, meant to be served by an ASGI server (see the web-asgi service)
+    path('async/view-loan/<int:loan_id>/', views.view_loan_async, name='view_loan_async'),
+    path('async/view-loans/<int:customer_id>/', views.view_loans_by_customer_async, name='view_loans_by_customer_async'),
 ]
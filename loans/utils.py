@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def chunked(rows, size):
+    """Yield lists of at most ``size`` items from ``rows``"""
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
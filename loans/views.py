@@ -1,23 +1,42 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
 from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
 from datetime import datetime, timedelta
 from decimal import Decimal
 import logging
 
-from .models import Customer, Loan, LoanApplication
+from . import decision_log, detail_cache, metrics
+from .eligibility import (
+    BATCH_WRITE_FAILED, CustomerBusy, apply_for_loan, calculate_monthly_installment, create_loans, decide, decide_many,
+    give_up_application, load_customer, process_application,
+)
+from .fast_serialization import detail_from_row, encode_rows, loan_detail, loan_detail_rows, loan_list_rows, render
+from .exports import BOOK_EXPORT_FIELDS, CONTENT_TYPE as NDJSON, CUSTOMER_EXPORT_FIELDS, ndjson_lines
+from .models import Customer, DecisionLog, Loan, LoanApplication
+from .pagination import LoanCursorPagination
+from .tasks import process_loan_application
 from .serializers import (
     CustomerRegistrationSerializer, CustomerSerializer,
     LoanEligibilitySerializer, LoanEligibilityResponseSerializer,
-    LoanApplicationSerializer, LoanApplicationResponseSerializer,
-    LoanDetailSerializer, LoanListSerializer
+    LoanApplicationSerializer, LoanApplicationResponseSerializer
 )
 
 logger = logging.getLogger(__name__)
 
+# ?status= values accepted by the view-loans endpoints, mapped to end_date__isnull
+LOAN_STATUS_FILTERS = {'active': True, 'closed': False}
+
 
 def home_page(request):
     """Home page with API documentation"""
@@ -195,54 +214,68 @@ def check_eligibility(request):
     tenure = data['tenure']
     
     try:
-        customer = Customer.objects.get(customer_id=customer_id)
+        customer = load_customer(customer_id)
     except Customer.DoesNotExist:
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Calculate credit score
-    credit_score = customer.calculate_credit_score()
-    
-    # Check eligibility based on credit score
-    approval = False
-    corrected_interest_rate = interest_rate
-    
-    if credit_score > 50:
-        approval = True
-    elif credit_score > 30:
-        if interest_rate >= 12:
-            approval = True
-        else:
-            corrected_interest_rate = Decimal('12.0')
-    elif credit_score > 10:
-        if interest_rate >= 16:
-            approval = True
-        else:
-            corrected_interest_rate = Decimal('16.0')
-    else:
-        approval = False
-    
-    # Check if sum of current EMIs > 50% of monthly salary
-    current_loans = customer.loans.filter(end_date__isnull=True)
-    total_current_emis = sum(loan.monthly_repayment for loan in current_loans)
-    
-    if total_current_emis > customer.monthly_salary * Decimal('0.5'):
-        approval = False
-    
-    # Calculate monthly installment
-    monthly_installment = calculate_monthly_installment(loan_amount, corrected_interest_rate, tenure)
+    decision = decide(customer, loan_amount, interest_rate, tenure)
+    decision_log.record(DecisionLog.ELIGIBILITY, customer_id, loan_amount, interest_rate, tenure, decision)
     
     response_data = {
         'customer_id': customer_id,
-        'approval': approval,
+        'approval': decision.approval,
         'interest_rate': interest_rate,
-        'corrected_interest_rate': corrected_interest_rate,
+        'corrected_interest_rate': decision.corrected_interest_rate,
         'tenure': tenure,
-        'monthly_installment': monthly_installment
+        'monthly_installment': decision.monthly_installment
     }
     
     return Response(response_data, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+def check_eligibility_batch(request):
+    """Check loan eligibility for a list of requests, results in request order"""
+    items = request.data
+    if not isinstance(items, list):
+        return Response({'error': 'Expected a list of eligibility requests'}, status=status.HTTP_400_BAD_REQUEST)
+    max_size = getattr(settings, 'ELIGIBILITY_BATCH_MAX_SIZE', 10000)
+    if len(items) > max_size:
+        return Response(
+            {'error': f'At most {max_size} eligibility requests per batch'}, status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    results = [None] * len(items)
+    valid = []
+    positions = []
+    for index, item in enumerate(items):
+        serializer = LoanEligibilitySerializer(data=item)
+        if serializer.is_valid():
+            valid.append(serializer.validated_data)
+            positions.append(index)
+        else:
+            results[index] = {'errors': serializer.errors}
+    
+    for index, data, decision in zip(positions, valid, decide_many(valid)):
+        if decision is None:
+            results[index] = {'customer_id': data['customer_id'], 'error': 'Customer not found'}
+            continue
+        decision_log.record(
+            DecisionLog.ELIGIBILITY, data['customer_id'], data['loan_amount'], data['interest_rate'], data['tenure'],
+            decision,
+        )
+        results[index] = {
+            'customer_id': data['customer_id'],
+            'approval': decision.approval,
+            'interest_rate': data['interest_rate'],
+            'corrected_interest_rate': decision.corrected_interest_rate,
+            'tenure': data['tenure'],
+            'monthly_installment': decision.monthly_installment
+        }
+    
+    return Response(results, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 def create_loan(request):
     """Create a new loan"""
@@ -251,81 +284,36 @@ def create_loan(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     data = serializer.validated_data
+    if _respond_async(request):
+        return _queue_application(data)
+    
     customer_id = data['customer_id']
     loan_amount = data['loan_amount']
     interest_rate = data['interest_rate']
     tenure = data['tenure']
     
     try:
-        customer = Customer.objects.get(customer_id=customer_id)
+        decision, loan = apply_for_loan(customer_id, loan_amount, interest_rate, tenure)
     except Customer.DoesNotExist:
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
+    except CustomerBusy:
+        logger.warning(f"Gave up creating a loan for busy customer {customer_id}")
+        return Response(
+            {'error': 'Too many concurrent applications for this customer, please retry'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'}
+        )
+    decision_log.record(DecisionLog.LOAN, customer_id, loan_amount, interest_rate, tenure, decision, loan)
     
-    # Check eligibility first
-    eligibility_data = {
-        'customer_id': customer_id,
-        'loan_amount': loan_amount,
-        'interest_rate': interest_rate,
-        'tenure': tenure
-    }
-    
-    # Re-use eligibility logic
-    credit_score = customer.calculate_credit_score()
-    
-    # Check eligibility based on credit score
-    approval = False
-    corrected_interest_rate = interest_rate
-    message = ""
-    
-    if credit_score > 50:
-        approval = True
-    elif credit_score > 30:
-        if interest_rate >= 12:
-            approval = True
-        else:
-            message = "Interest rate too low for your credit score"
-    elif credit_score > 10:
-        if interest_rate >= 16:
-            approval = True
-        else:
-            message = "Interest rate too low for your credit score"
-    else:
-        approval = False
-        message = "Credit score too low for loan approval"
-    
-    # Check if sum of current EMIs > 50% of monthly salary
-    current_loans = customer.loans.filter(end_date__isnull=True)
-    total_current_emis = sum(loan.monthly_repayment for loan in current_loans)
-    
-    if total_current_emis > customer.monthly_salary * Decimal('0.5'):
-        approval = False
-        message = "Current EMIs exceed 50% of monthly salary"
-    
+    approval = decision.approval
+    message = decision.message
     loan_id = None
     monthly_installment = None
     
-    if approval:
-        # Use corrected interest rate if needed
-        if credit_score <= 30 and interest_rate < 12:
-            corrected_interest_rate = Decimal('12.0')
-        elif credit_score <= 10 and interest_rate < 16:
-            corrected_interest_rate = Decimal('16.0')
-        
-        monthly_installment = calculate_monthly_installment(loan_amount, corrected_interest_rate, tenure)
-        
-        # Create loan
-        with transaction.atomic():
-            loan = Loan.objects.create(
-                customer=customer,
-                loan_amount=loan_amount,
-                tenure=tenure,
-                interest_rate=corrected_interest_rate,
-                monthly_repayment=monthly_installment,
-                start_date=datetime.now().date(),
-                end_date=datetime.now().date() + timedelta(days=tenure * 30)
-            )
-            loan_id = loan.loan_id
-            message = "Loan approved successfully"
+    if loan is not None:
+        # An approved rate never needs correcting
+        monthly_installment = decision.monthly_installment
+        loan_id = loan.loan_id
+        message = "Loan approved successfully"
     
     response_data = {
         'loan_id': loan_id,
@@ -338,16 +326,147 @@ def create_loan(request):
     return Response(response_data, status=status.HTTP_201_CREATED if approval else status.HTTP_200_OK)
 
 
+def _respond_async(request):
+    """Whether create_loan should queue the application instead of deciding it in the request"""
+    if getattr(settings, 'LOAN_APPLICATIONS_ASYNC', False):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '').lower()
+
+
+def _queue_application(data):
+    """Record a PENDING application, decided by a Celery task once the insert commits"""
+    if not Customer.objects.filter(customer_id=data['customer_id']).exists():
+        return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    with transaction.atomic():
+        application = LoanApplication.objects.create(
+            customer_id=data['customer_id'],
+            loan_amount=data['loan_amount'],
+            interest_rate=data['interest_rate'],
+            tenure=data['tenure'],
+        )
+        transaction.on_commit(lambda: _enqueue_application(application.pk))
+    
+    location = reverse('view_application', kwargs={'application_id': application.pk})
+    return Response(_application_data(application), status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
+def _enqueue_application(application_id):
+    try:
+        process_loan_application.apply_async((application_id,), retry=False)
+    except Exception as e:
+        # Without a broker nobody would ever decide it, so decide it here. The 202 then waits for the
+        # decision like a synchronous request would, which is worth an alert
+        logger.error(f"Could not queue loan application {application_id}, deciding it inline: {str(e)}")
+        try:
+            process_application(application_id)
+        except CustomerBusy:
+            logger.error(f"Loan application {application_id} rejected, customer busy")
+            give_up_application(application_id)
+
+
+def _application_data(application):
+    loan = application.approved_loan
+    if application.status == LoanApplication.APPROVED:
+        message = "Loan approved successfully"
+    elif application.status == LoanApplication.REJECTED:
+        message = application.rejection_reason
+    else:
+        message = "Application is being processed"
+    return {
+        'application_id': application.pk,
+        'customer_id': application.customer_id,
+        'status': application.status,
+        'loan_id': loan.loan_id if loan is not None else None,
+        'loan_approved': application.status == LoanApplication.APPROVED,
+        'message': message,
+        'monthly_installment': loan.monthly_repayment if loan is not None else None,
+    }
+
+
 @api_view(['GET'])
-def view_loan(request, loan_id):
-    """View loan details"""
+def view_application(request, application_id):
+    """Poll the status of an application queued by create_loan"""
     try:
-        loan = Loan.objects.select_related('customer').get(loan_id=loan_id)
-    except Loan.DoesNotExist:
+        application = LoanApplication.objects.select_related('approved_loan').get(pk=application_id)
+    except LoanApplication.DoesNotExist:
+        return Response({'error': 'Application not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_application_data(application), status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def create_loan_batch(request):
+    """
+    Create loans for a list of applications, results in request order
+
+    Chunks commit one by one, so when one fails its items carry an error
+    while the loans of the other chunks exist and are listed with their ids.
+    """
+    items = request.data
+    if not isinstance(items, list):
+        return Response({'error': 'Expected a list of loan applications'}, status=status.HTTP_400_BAD_REQUEST)
+    max_size = getattr(settings, 'LOAN_BATCH_MAX_SIZE', 10000)
+    if len(items) > max_size:
+        return Response(
+            {'error': f'At most {max_size} loan applications per batch'}, status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    results = [None] * len(items)
+    valid = []
+    positions = []
+    for index, item in enumerate(items):
+        serializer = LoanApplicationSerializer(data=item)
+        if serializer.is_valid():
+            valid.append(serializer.validated_data)
+            positions.append(index)
+        else:
+            results[index] = {'errors': serializer.errors}
+    
+    for index, data, outcome in zip(positions, valid, create_loans(valid)):
+        if outcome is None:
+            results[index] = {'customer_id': data['customer_id'], 'error': 'Customer not found'}
+            continue
+        if isinstance(outcome, Exception):
+            results[index] = {'customer_id': data['customer_id'], 'loan_id': None, 'error': BATCH_WRITE_FAILED}
+            continue
+        decision, loan = outcome
+        decision_log.record(
+            DecisionLog.LOAN, data['customer_id'], data['loan_amount'], data['interest_rate'], data['tenure'],
+            decision, loan,
+        )
+        results[index] = {
+            'loan_id': loan.loan_id if loan else None,
+            'customer_id': data['customer_id'],
+            'loan_approved': decision.approval,
+            'message': "Loan approved successfully" if loan else decision.message,
+            'monthly_installment': decision.monthly_installment
+        }
+    
+    return Response(results, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def view_loan(request, loan_id):
+    """View loan details, answering 304 to clients holding the current version"""
+    validators = detail_cache.loan_validators(loan_id)
+    if validators is None:
         return Response({'error': 'Loan not found'}, status=status.HTTP_404_NOT_FOUND)
+    etag, last_modified = validators
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
     
-    serializer = LoanDetailSerializer(loan)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    headers = detail_cache.validator_headers(etag, last_modified)
+    content = detail_cache.cached_body(loan_id, etag)
+    if content is not None:
+        return HttpResponse(content, content_type='application/json', headers=headers)
+    
+    data = loan_detail(loan_id)
+    if data is None:
+        return Response({'error': 'Loan not found'}, status=status.HTTP_404_NOT_FOUND)
+    detail_cache.store_body(loan_id, etag, render(data))
+    return Response(data, headers=headers)
 
 
 @api_view(['GET'])
@@ -358,20 +477,96 @@ def view_loans_by_customer(request, customer_id):
     except Customer.DoesNotExist:
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    loans = customer.loans.all()
-    serializer = LoanListSerializer(loans, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    loans, error = _filter_loans_by_status(customer.loans.all(), request.GET.get('status'))
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    paginator = LoanCursorPagination()
+    page = paginator.paginate_queryset(loan_list_rows(loans), request)
+    return paginator.get_paginated_response(encode_rows(page))
+
+
+def _filter_loans_by_status(loans, loan_status):
+    """Apply the optional ?status=active|closed filter, returns (queryset, error)"""
+    if loan_status is None:
+        return loans, None
+    if loan_status not in LOAN_STATUS_FILTERS:
+        return loans, f"status must be one of: {', '.join(LOAN_STATUS_FILTERS)}"
+    return loans.filter(end_date__isnull=LOAN_STATUS_FILTERS[loan_status]), None
+
+
+@require_GET
+def export_customer_loans(request, customer_id):
+    """Stream a customer's loans as NDJSON, one LoanListSerializer-shaped object per line"""
+    # Plain Django view, DRF content negotiation would refuse Accept: application/x-ndjson
+    if not Customer.objects.filter(customer_id=customer_id).exists():
+        return JsonResponse({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    loans, error = _filter_loans_by_status(Loan.objects.filter(customer_id=customer_id), request.GET.get('status'))
+    if error:
+        return JsonResponse({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(ndjson_lines(loans, CUSTOMER_EXPORT_FIELDS), content_type=NDJSON)
+    response['Content-Disposition'] = f'attachment; filename="customer-{customer_id}-loans.ndjson"'
+    return response
+
+
+@require_GET
+@staff_member_required
+def export_loan_book(request):
+    """Stream every loan as NDJSON, staff only"""
+    loans, error = _filter_loans_by_status(Loan.objects.all(), request.GET.get('status'))
+    if error:
+        return JsonResponse({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(ndjson_lines(loans, BOOK_EXPORT_FIELDS), content_type=NDJSON)
+    response['Content-Disposition'] = 'attachment; filename="loan-book.ndjson"'
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    """Request, task and decision log metrics of every live process, in Prometheus text format"""
+    # This process's numbers are always current, the others' as of their last publish
+    metrics.publish()
+    return HttpResponse(metrics.render(metrics.collect()), content_type=metrics.CONTENT_TYPE)
 
 
-def calculate_monthly_installment(principal, annual_rate, tenure_months):
-    """Calculate monthly installment using compound interest"""
-    principal = float(principal)
-    monthly_rate = float(annual_rate) / 100 / 12
-    months = int(tenure_months)
+def _method_not_allowed(request):
+    return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405, headers={'Allow': 'GET'})
+
+
+async def view_loan_async(request, loan_id):
+    """View loan details, async ORM version of view_loan for the ASGI server"""
+    if request.method != 'GET':
+        return _method_not_allowed(request)
+    row = await loan_detail_rows(loan_id).afirst()
+    if row is None:
+        return JsonResponse({'error': 'Loan not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    if monthly_rate == 0:
-        return round(principal / months, 2)
+    return JsonResponse(detail_from_row(row), status=status.HTTP_200_OK)
+
+
+async def view_loans_by_customer_async(request, customer_id):
+    """View all loans for a customer, async ORM version of view_loans_by_customer"""
+    if request.method != 'GET':
+        return _method_not_allowed(request)
+    try:
+        customer = await Customer.objects.aget(customer_id=customer_id)
+    except Customer.DoesNotExist:
+        return JsonResponse({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # EMI = P * r * (1 + r)^n / ((1 + r)^n - 1)
-    emi = principal * monthly_rate * (1 + monthly_rate) ** months / ((1 + monthly_rate) ** months - 1)
-    return round(emi, 2)
+    loans, error = _filter_loans_by_status(customer.loans.all(), request.GET.get('status'))
+    if error:
+        return JsonResponse({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    paginator = LoanCursorPagination()
+    try:
+        # The paginator slices and evaluates the queryset itself
+        page = await sync_to_async(paginator.paginate_queryset)(loan_list_rows(loans), Request(request))
+    except NotFound as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_404_NOT_FOUND)
+    link = paginator.get_link_header()
+    return JsonResponse(
+        encode_rows(page), safe=False, status=status.HTTP_200_OK, headers={'Link': link} if link else None
+    )